@@ -12,6 +12,9 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
+
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -135,13 +138,57 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # REST Framework configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        # Nagłówek Authorization: Bearer (tylko przy API_TOKENS_ENABLED), w pozostałych żądaniach sesja
+        'documents.authentication.SignedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 20
+    'PAGE_SIZE': 20,
+    'EXCEPTION_HANDLER': 'documents.exceptions.exception_handler',
+}
+
+# Cache (m.in. role i sekcje z profili, patrz documents.permissions). Domyślnie lokalny dla procesu;
+# przy kilku procesach serwera REDIS_URL daje wspólny cache i natychmiastowe unieważnianie
+if os.getenv('REDIS_URL'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                          'LOCATION': os.getenv('REDIS_URL')}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+PROFILE_CACHE_TIMEOUT = int(os.getenv('PROFILE_CACHE_TIMEOUT', '300'))
+
+# Podpisane tokeny API (documents.tokens): logowanie zwraca krótkotrwały token dostępu z rolą
+# i sekcją oraz token odświeżania; żądania z tokenem nie czytają tabeli sesji
+API_TOKENS_ENABLED = os.getenv('API_TOKENS_ENABLED', '0') == '1'
+ACCESS_TOKEN_LIFETIME = int(os.getenv('ACCESS_TOKEN_LIFETIME', '300'))
+REFRESH_TOKEN_LIFETIME = int(os.getenv('REFRESH_TOKEN_LIFETIME', str(7 * 24 * 3600)))
+
+# Przechowywanie sesji (SESSION_PROFILE), porównanie kosztu: manage.py benchmark_sessions
+# - 'db' (domyślnie): każde żądanie z sesją czyta tabelę django_session,
+# - 'cached_db': odczyt z cache lokalnego dla procesu, zapis także do bazy (baza tylko przy braku w cache),
+# - 'cached_db_file': jak wyżej, ale cache plikowy wspólny dla procesów na jednym serwerze,
+# - 'signed_cookies': dane sesji podpisane w ciasteczku, bez bazy; wylogowanie nie unieważnia
+#   skopiowanego wcześniej ciasteczka (ważne do SESSION_COOKIE_AGE)
+SESSION_PROFILES = {
+    'db': {'SESSION_ENGINE': 'django.contrib.sessions.backends.db'},
+    'cached_db': {'SESSION_ENGINE': 'django.contrib.sessions.backends.cached_db',
+                  'SESSION_CACHE_ALIAS': 'sessions_locmem'},
+    'cached_db_file': {'SESSION_ENGINE': 'django.contrib.sessions.backends.cached_db',
+                       'SESSION_CACHE_ALIAS': 'sessions_file'},
+    'signed_cookies': {'SESSION_ENGINE': 'django.contrib.sessions.backends.signed_cookies'},
+}
+SESSION_PROFILE = os.getenv('SESSION_PROFILE', 'db')
+if SESSION_PROFILE not in SESSION_PROFILES:
+    raise ImproperlyConfigured(f'SESSION_PROFILE: nieznany profil {SESSION_PROFILE!r}, dostępne: {", ".join(SESSION_PROFILES)}')
+SESSION_ENGINE = SESSION_PROFILES[SESSION_PROFILE]['SESSION_ENGINE']
+SESSION_CACHE_ALIAS = SESSION_PROFILES[SESSION_PROFILE].get('SESSION_CACHE_ALIAS', 'default')
+CACHES['sessions_locmem'] = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                             'LOCATION': 'sessions'}
+CACHES['sessions_file'] = {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': os.getenv('SESSION_FILE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'document_system_sessions')),
 }
 
 # CORS configuration
@@ -152,6 +199,9 @@ CORS_ALLOWED_ORIGINS = [
 
 CORS_ALLOW_CREDENTIALS = True
 
+# Nagłówki odpowiedzi czytane przez SPA (nazwa pobieranego pliku, liczba błędów eksportu)
+CORS_EXPOSE_HEADERS = ['Content-Disposition', 'X-Export-Errors']
+
 # CSRF z aplikacji SPA (React na porcie 3000)
 CSRF_TRUSTED_ORIGINS = [
     "http://localhost:3000",
@@ -194,8 +244,32 @@ SOCIAL_AUTH_PIPELINE = (
     'social_core.pipeline.social_auth.associate_user',
     'social_core.pipeline.social_auth.load_extra_data',
     'social_core.pipeline.user.user_details',
+    'documents.pipeline.issue_api_tokens',
 )
 
 # Media files configuration
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Przesyłane pliki zawsze trafiają do pliku tymczasowego (po kawałku), a nie do pamięci
+FILE_UPLOAD_HANDLERS = ['django.core.files.uploadhandler.TemporaryFileUploadHandler']
+# Limity sprawdzane przed zapisaniem pliku DOCX (ochrona przed "bombami ZIP"), patrz documents.uploads
+DOCUMENT_MAX_UNCOMPRESSED_SIZE = int(os.getenv('DOCUMENT_MAX_UNCOMPRESSED_SIZE', str(200 * 1024 * 1024)))
+DOCUMENT_MAX_ARCHIVE_ENTRIES = int(os.getenv('DOCUMENT_MAX_ARCHIVE_ENTRIES', '5000'))
+
+# Zadania w tle (konwersja DOCX -> HTML) - lokalna pula procesów
+DOCUMENT_WORKER_PROCESSES = int(os.getenv('DOCUMENT_WORKER_PROCESSES', '0')) or None
+DOCUMENT_JOBS_EAGER = os.getenv('DOCUMENT_JOBS_EAGER', '0') == '1'
+
+# Obrazy z konwersji DOCX -> HTML jako osobne pliki (MEDIA_ROOT/images, nazwa = SHA-256 treści)
+# zamiast base64 w HTML; DOCUMENT_IMAGES_URL - adres obrazów wpisywany w HTML. Adres względny
+# (od "/") jest w odpowiedziach API uzupełniany o adres serwera, z którego przyszło żądanie
+DOCUMENT_EXTRACT_IMAGES = os.getenv('DOCUMENT_EXTRACT_IMAGES', '1') == '1'
+DOCUMENT_IMAGES_URL = os.getenv('DOCUMENT_IMAGES_URL', '/api/documents/images/')
+
+# Tryb generowania plików DOCX: 'zip' (przepisuje tylko części XML z polami) lub 'docx' (python-docx)
+DOCUMENT_RENDER_MODE = os.getenv('DOCUMENT_RENDER_MODE', 'zip')
+
+# Przechowywanie wartości pól: 'rows' (FieldValue), 'both' (FieldValue + JSON) lub 'json'
+# (tylko DocumentAssignment.values). Patrz documents.values
+DOCUMENT_VALUE_STORAGE = os.getenv('DOCUMENT_VALUE_STORAGE', 'rows')
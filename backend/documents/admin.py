@@ -1,7 +1,7 @@
 from django.contrib import admin
 from .models import (
     UserProfile, Document, EditableField, 
-    DocumentAssignment, FieldValue, DocumentVersion
+    DocumentAssignment, FieldValue, DocumentVersion, ProcessingJob, StoredFile
 )
 
 
@@ -14,8 +14,8 @@ class UserProfileAdmin(admin.ModelAdmin):
 
 @admin.register(Document)
 class DocumentAdmin(admin.ModelAdmin):
-    list_display = ['name', 'created_by', 'status', 'created_at']
-    list_filter = ['status', 'created_at']
+    list_display = ['name', 'created_by', 'status', 'processing_status', 'created_at']
+    list_filter = ['status', 'processing_status', 'created_at']
     search_fields = ['name', 'created_by__username']
     readonly_fields = ['original_content', 'created_at', 'updated_at']
 
@@ -43,6 +43,19 @@ class FieldValueAdmin(admin.ModelAdmin):
 
 @admin.register(DocumentVersion)
 class DocumentVersionAdmin(admin.ModelAdmin):
-    list_display = ['assignment', 'created_at']
-    list_filter = ['created_at']
-    readonly_fields = ['content', 'created_at']
+    list_display = ['assignment', 'status', 'created_at']
+    list_filter = ['status', 'created_at']
+    readonly_fields = ['content', 'render_key', 'claimed_at', 'error', 'created_at']
+
+
+@admin.register(ProcessingJob)
+class ProcessingJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'status', 'document', 'created_by', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status', 'created_at']
+    readonly_fields = ['error', 'created_at', 'started_at', 'finished_at']
+
+
+@admin.register(StoredFile)
+class StoredFileAdmin(admin.ModelAdmin):
+    list_display = ['sha256', 'size', 'ref_count', 'created_at']
+    readonly_fields = ['sha256', 'file', 'size', 'ref_count', 'html', 'created_at']
@@ -4,3 +4,19 @@ from django.apps import AppConfig
 class DocumentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'documents'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+
+        from .models import UserProfile
+        from .permissions import invalidate_profile
+
+        def _profile_changed(sender, instance, **kwargs):
+            # Rola lub sekcja mogła się zmienić - kolejne żądanie odczyta profil z bazy
+            try:
+                invalidate_profile(instance.user)
+            except UserProfile.user.RelatedObjectDoesNotExist:
+                pass
+
+        post_save.connect(_profile_changed, sender=UserProfile, dispatch_uid='documents_profile_saved')
+        post_delete.connect(_profile_changed, sender=UserProfile, dispatch_uid='documents_profile_deleted')
@@ -0,0 +1,123 @@
+"""Archiwa ZIP z wygenerowanymi dokumentami przypisań."""
+import zipfile
+
+from django.utils import timezone
+
+from .generation import _sanitize
+
+CHUNK_SIZE = 64 * 1024
+# Raport przypisań, których plików nie ma w archiwum
+ERRORS_FILE = 'BLEDY.txt'
+MISSING_FILE_ERROR = 'Brak pliku wygenerowanej wersji'
+
+
+class _ZipSink:
+    """Wyjście dla zipfile bez możliwości przewijania (brak seek) - zipfile zapisuje
+    wtedy rozmiary w deskryptorach danych, a zebrane bajty oddajemy kawałkami."""
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def pop(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def export_filename(user, document=None) -> str:
+    """Nazwa pobieranego archiwum: <dokument>_completed_<data>.zip lub completed_<admin>_<data>.zip"""
+    stamp = timezone.localtime().strftime('%Y%m%d_%H%M')
+    if document is not None:
+        return f"{_sanitize(document.name.rsplit('.', 1)[0])}_completed_{stamp}.zip"
+    return f"completed_{_sanitize(user.username)}_{stamp}.zip"
+
+
+def archive_name(assignment) -> str:
+    """Ścieżka pliku w archiwum: <użytkownik>/<użytkownik>__<dokument>.docx"""
+    base = _sanitize(assignment.document.name.rsplit('.', 1)[0])
+    uname = _sanitize(assignment.user.username)
+    return f"{uname}/{uname}__{base}.docx"
+
+
+def completed_members(assignments, versions: dict):
+    """Pary (nazwa w archiwum, wersja) dla przypisań, które mają wygenerowaną wersję."""
+    for ass in assignments:
+        version = versions.get(ass.id)
+        if version is not None and version.generated_file:
+            yield archive_name(ass), version
+
+
+def drop_missing_files(assignments, versions: dict, errors: dict):
+    """Przypisania, których pliku wersji nie da się otworzyć (usunięty z dysku, brak uprawnień),
+    przenieś z versions do errors - trafiają do raportu tak jak nieudane renderowanie.
+
+    Otwieramy każdy plik przed budową archiwum, żeby liczba błędów (nagłówek X-Export-Errors)
+    była znana przed wysłaniem pierwszego bajtu. Plik utracony już w trakcie budowy archiwum
+    trafia tylko do BLEDY.txt (patrz stream_zip).
+    """
+    for ass in assignments:
+        version = versions.get(ass.id)
+        if version is None:
+            continue
+        file = version.generated_file
+        try:
+            if not file:
+                raise FileNotFoundError(MISSING_FILE_ERROR)
+            file.open('rb').close()
+        except OSError:
+            errors[ass.id] = MISSING_FILE_ERROR
+            del versions[ass.id]
+
+
+def errors_report(assignments, errors: dict) -> str:
+    """Treść pliku z listą przypisań, których nie udało się wygenerować."""
+    lines = [
+        f"{archive_name(ass)}: {errors[ass.id]}"
+        for ass in assignments if ass.id in errors
+    ]
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def stream_zip(members, report: str = '', failures: list = None):
+    """Generator bajtów archiwum ZIP budowanego w locie.
+
+    Pliki czytamy kawałkami i od razu oddajemy klientowi, więc zużycie pamięci nie
+    zależy od liczby ani rozmiaru plików. Pliki .docx są już skompresowane, dlatego
+    zapisujemy je bez ponownej kompresji (ZIP_STORED).
+    report - raport błędów (errors_report) zapisywany na końcu jako BLEDY.txt. Pliki, których
+    nie udało się otworzyć podczas budowy archiwum, są do niego dopisywane (i do failures).
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as zf:
+        for arcname, version in members:
+            info = zipfile.ZipInfo(arcname, date_time=timezone.localtime(version.created_at).timetuple()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            try:
+                fh = version.generated_file.open('rb')
+            except OSError as e:
+                line = f"{arcname}: {MISSING_FILE_ERROR} ({e})\n"
+                report += line
+                if failures is not None:
+                    failures.append(line)
+                continue
+            with fh, zf.open(info, 'w') as out:
+                for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+                    out.write(chunk)
+                    yield sink.pop()
+            yield sink.pop()
+        if report:
+            zf.writestr(ERRORS_FILE, report.encode('utf-8'), compress_type=zipfile.ZIP_DEFLATED)
+            yield sink.pop()
+    yield sink.pop()
@@ -0,0 +1,39 @@
+from django.contrib.auth.models import User
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+
+from .tokens import InvalidToken, read_access, tokens_enabled
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """`Authorization: Bearer <access>` z tokenem z documents.tokens.
+
+    Użytkownik jest odtwarzany z danych tokenu (bez zapytań do bazy): ma ID, nazwę
+    i flagę superużytkownika, a rola i sekcja trafiają od razu do profile_info.
+    Widoki, które potrzebują pozostałych pól użytkownika, pobierają go same
+    (request.auth to wtedy dane tokenu, przy sesji - None).
+    """
+    keyword = b'bearer'
+
+    def authenticate(self, request):
+        if not tokens_enabled():
+            return None
+        parts = get_authorization_header(request).split()
+        if not parts or parts[0].lower() != self.keyword:
+            return None
+        if len(parts) != 2:
+            raise AuthenticationFailed('Nieprawidłowy nagłówek Authorization')
+        try:
+            claims = read_access(parts[1].decode('latin-1'))
+        except InvalidToken:
+            raise AuthenticationFailed('Token wygasł lub jest nieprawidłowy')
+
+        user = User(id=claims['uid'], username=claims['un'], is_superuser=claims['su'], is_active=True)
+        user._state.adding = False
+        user._state.db = 'default'
+        user._profile_info = {'role': claims['role'], 'section': claims['section']}
+        return user, claims
+
+    def authenticate_header(self, request):
+        # 401 z WWW-Authenticate zamiast 403 - klient wie, że ma odświeżyć token
+        return 'Bearer realm="api"' if tokens_enabled() else None
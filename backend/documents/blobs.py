@@ -0,0 +1,75 @@
+"""Pliki źródłowe dokumentów przechowywane raz na treść.
+
+Przesłany plik (już na dysku, patrz FILE_UPLOAD_HANDLERS) jest haszowany (SHA-256) po
+kawałku i zapisywany w układzie adresowanym treścią (blobs/ab/abcd....docx). Kolejne przesłanie
+tych samych bajtów tylko zwiększa licznik odwołań StoredFile, a dokument wskazuje
+istniejący plik. Wynik konwersji mammoth jest zapamiętywany na StoredFile, więc
+ponowne przesłanie lub przetworzenie identycznej treści niczego nie konwertuje.
+Plik jest usuwany dopiero wtedy, gdy nie korzysta z niego żaden dokument (release).
+"""
+import hashlib
+import os
+
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import StoredFile
+
+
+def blob_name(sha256: str, ext: str = '.docx') -> str:
+    return f'blobs/{sha256[:2]}/{sha256}{ext}'
+
+
+def store_upload(uploaded) -> StoredFile:
+    """Zapisz przesłany plik (lub zwiększ licznik istniejącego o tej samej treści).
+    Plik jest czytany po kawałku; przesłany plik tymczasowy jest przenoszony do magazynu
+    bez kopiowania w pamięci. Zwraca StoredFile z już policzonym odwołaniem bieżącego dokumentu."""
+    ext = os.path.splitext(uploaded.name)[1].lower() or '.docx'
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in uploaded.chunks():
+        digest.update(chunk)
+        size += len(chunk)
+    sha = digest.hexdigest()
+    while True:
+        if StoredFile.objects.filter(sha256=sha).update(ref_count=F('ref_count') + 1):
+            return StoredFile.objects.get(sha256=sha)
+        uploaded.seek(0)
+        name = default_storage.save(blob_name(sha, ext), uploaded)
+        try:
+            with transaction.atomic():
+                return StoredFile.objects.create(sha256=sha, file=name, size=size, ref_count=1)
+        except IntegrityError:
+            # Ten sam plik zapisał równolegle ktoś inny - korzystamy z jego wiersza
+            default_storage.delete(name)
+
+
+def release(blob_id: int):
+    """Zmniejsz licznik odwołań; nieużywany plik usuń po zatwierdzeniu transakcji."""
+    StoredFile.objects.filter(id=blob_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+    unused = StoredFile.objects.filter(id=blob_id, ref_count=0).values_list('file', flat=True).first()
+    # Warunkowe usunięcie - równoległe przesłanie tej samej treści mogło właśnie podbić licznik
+    if unused is not None and StoredFile.objects.filter(id=blob_id, ref_count=0).delete()[0]:
+        transaction.on_commit(lambda: _delete_file(unused))
+
+
+def _delete_file(name: str):
+    try:
+        default_storage.delete(name)
+    except Exception:
+        pass
+
+
+def cached_html(blob_id, mode: str):
+    """HTML z konwersji tej treści w danym trybie (documents.jobs.html_cache_mode)
+    albo None, jeśli jeszcze jej tak nie konwertowano."""
+    if blob_id is None:
+        return None
+    return (StoredFile.objects.filter(id=blob_id, html_mode=mode)
+            .values_list('html', flat=True).first())
+
+
+def remember_html(blob_id, html: str, mode: str):
+    if blob_id is not None:
+        StoredFile.objects.filter(id=blob_id).update(html=html, html_mode=mode)
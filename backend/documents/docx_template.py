@@ -0,0 +1,217 @@
+"""Skompilowany indeks szablonu DOCX.
+
+Indeks mapuje wartości oryginalne pól (EditableField.original_value) na miejsca
+w dokumencie, w których występują: część pakietu (np. word/document.xml,
+word/header1.xml), numer paragrafu w tej części oraz zakres znaków w
+połączonym tekście runów paragrafu. Budujemy go raz dla dokumentu, a przy
+generowaniu wersji dla przypisania podmieniamy tylko wskazane zakresy - bez
+ponownego przeszukiwania całego dokumentu dla każdego pola.
+
+Wystąpienia wszystkich pól wyszukujemy jednym przebiegiem po tekście paragrafu
+automatem Aho-Corasick (PlaceholderMatcher).
+
+Moduł nie importuje modeli Django (może działać w procesach roboczych).
+"""
+import hashlib
+import json
+import re
+from collections import deque
+
+from docx.oxml.ns import qn
+from docx.text.paragraph import Paragraph
+
+INDEX_VERSION = 2
+
+# Części pakietu zawierające tekst dokumentu
+TEXT_PART_RE = re.compile(r'^word/(document\d*|header\d*|footer\d*|footnotes|endnotes)\.xml$')
+
+_W_P = qn('w:p')
+
+
+def fields_key(fields, file_name: str = '') -> str:
+    """Klucz unieważniania indeksu: plik źródłowy + definicje pól.
+
+    fields - lista par (field_id, original_value) w kolejności pól dokumentu.
+    """
+    payload = json.dumps([INDEX_VERSION, file_name, list(map(list, fields))], ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class PlaceholderMatcher:
+    """Automat Aho-Corasick wyszukujący wszystkie wzorce w jednym przebiegu po tekście.
+
+    patterns - lista par (klucz, wzorzec). Przy powtórzonym wzorcu wygrywa pierwszy klucz.
+    """
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        self._patterns = []
+        seen = set()
+        for key, pattern in patterns:
+            if not pattern or pattern in seen:
+                continue
+            seen.add(pattern)
+            node = 0
+            for ch in pattern:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                    self._goto[node][ch] = nxt
+                node = nxt
+            self._out[node] += (len(self._patterns),)
+            self._patterns.append((key, len(pattern)))
+
+        # Krawędzie porażki (BFS od korzenia)
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] += self._out[self._fail[nxt]]
+
+    def __bool__(self):
+        return bool(self._patterns)
+
+    def find_all(self, text: str):
+        """Wszystkie rozłączne wystąpienia jako [start, end, klucz].
+        Przy nakładaniu się wygrywa wystąpienie najbardziej na lewo, potem najdłuższe.
+        """
+        goto, fail, out, patterns = self._goto, self._fail, self._out, self._patterns
+        matches = []
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for idx in out[node]:
+                key, length = patterns[idx]
+                matches.append((i + 1 - length, i + 1, key))
+
+        matches.sort(key=lambda m: (m[0], -m[1]))
+        spans = []
+        last_end = 0
+        for start, end, key in matches:
+            if start >= last_end:
+                spans.append([start, end, key])
+                last_end = end
+        return spans
+
+
+def iter_docx_parts(doc):
+    """Części tekstowe otwartego dokumentu python-docx jako pary (nazwa, element)."""
+    for part in doc.part.package.iter_parts():
+        name = str(part.partname).lstrip('/')
+        if TEXT_PART_RE.match(name) and hasattr(part, 'element'):
+            yield name, part.element
+
+
+def part_paragraphs(element):
+    """Wszystkie paragrafy części w kolejności dokumentu, łącznie z tabelami zagnieżdżonymi."""
+    return [Paragraph(p, None) for p in element.iter(_W_P)]
+
+
+def compile_parts(parts, fields, file_name: str = '') -> dict:
+    """Zbuduj indeks dla części pakietu (pary: nazwa części, element XML)."""
+    matcher = PlaceholderMatcher(fields)
+    index = {}
+    if matcher:
+        for name, element in parts:
+            found = {}
+            for idx, para in enumerate(part_paragraphs(element)):
+                text = ''.join(r.text or '' for r in para.runs)
+                if not text:
+                    continue
+                spans = matcher.find_all(text)
+                if spans:
+                    found[str(idx)] = spans
+            if found:
+                index[name] = found
+    return {
+        'version': INDEX_VERSION,
+        'key': fields_key(fields, file_name),
+        'parts': index,
+    }
+
+
+def compile_template(doc, fields, file_name: str = '') -> dict:
+    """Zbuduj indeks dla otwartego dokumentu python-docx."""
+    return compile_parts(iter_docx_parts(doc), fields, file_name)
+
+
+def replace_span(runs, start: int, end: int, new: str) -> bool:
+    """Replace text in [start, end) of the joined run text, possibly spanning
+    multiple runs, while preserving styles outside the replaced span.
+
+    - Only the text inside the span is unified (goes into the first affected run);
+      text before and after keeps its original runs/styles.
+    - If the span does not overlap any run, returns False.
+    """
+    texts = [r.text or '' for r in runs]
+
+    # Compute offsets per run: [start_pos, end_pos)
+    offsets = []
+    pos = 0
+    for t in texts:
+        offsets.append((pos, pos + len(t)))
+        pos += len(t)
+
+    # Find runs overlapping [start, end)
+    in_span = [i for i, (s, e) in enumerate(offsets) if not (e <= start or s >= end)]
+    if not in_span:
+        return False
+
+    first_i, last_i = in_span[0], in_span[-1]
+    first_s = offsets[first_i][0]
+    last_s = offsets[last_i][0]
+
+    prefix_len = max(0, start - first_s)
+    suffix_start = max(0, end - last_s)
+
+    if first_i == last_i:
+        # Replacement fully inside a single run
+        text = texts[first_i]
+        runs[first_i].text = text[:prefix_len] + new + text[suffix_start:]
+    else:
+        # First run: prefix + new, middle runs cleared, last run keeps suffix
+        runs[first_i].text = texts[first_i][:prefix_len] + new
+        for i in in_span[1:-1]:
+            runs[i].text = ''
+        runs[last_i].text = texts[last_i][suffix_start:]
+    return True
+
+
+def apply_to_part(element, part_index: dict, values: dict) -> int:
+    """Podmień zaindeksowane zakresy w jednej części wartościami pól (field_id -> value).
+    Zakresy w paragrafie przetwarzamy od końca, więc wcześniejsze offsety pozostają ważne.
+    Zwraca liczbę wykonanych podmian.
+    """
+    paragraphs = part_paragraphs(element)
+    replaced = 0
+    for idx, spans in part_index.items():
+        runs = paragraphs[int(idx)].runs
+        for start, end, field_id in reversed(spans):
+            new = values.get(field_id)
+            if new is None:
+                continue
+            if replace_span(runs, start, end, new):
+                replaced += 1
+    return replaced
+
+
+def apply_template(doc, compiled: dict, values: dict) -> int:
+    """Podmień zaindeksowane zakresy w otwartym dokumencie python-docx."""
+    index = compiled.get('parts') or {}
+    replaced = 0
+    for name, element in iter_docx_parts(doc):
+        if name in index:
+            replaced += apply_to_part(element, index[name], values)
+    return replaced
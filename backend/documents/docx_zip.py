@@ -0,0 +1,158 @@
+"""Renderowanie DOCX na poziomie archiwum ZIP.
+
+Plik .docx to archiwum ZIP. Zamiast ładować cały pakiet przez python-docx i
+serializować ponownie wszystkie części, przepisujemy wyłącznie części XML, w
+których indeks szablonu (documents.docx_template) wskazuje pola do podmiany.
+Pozostałe elementy archiwum - style, obrazy, czcionki - kopiujemy bajt po
+bajcie w postaci skompresowanej, bez dekompresji.
+
+Moduł nie importuje modeli Django (może działać w procesach roboczych).
+"""
+import struct
+import zipfile
+import zlib
+
+from docx.opc.oxml import serialize_part_xml
+from docx.oxml.parser import parse_xml
+
+from . import docx_template
+
+# Struktury nagłówków ZIP (APPNOTE.TXT, jak w module zipfile)
+_LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+_CENTRAL_HEADER = struct.Struct('<4s4B4HL2L5H2L')
+_END_RECORD = struct.Struct('<4s4H2LH')
+_LOCAL_SIG = b'PK\x03\x04'
+_CENTRAL_SIG = b'PK\x01\x02'
+_END_SIG = b'PK\x05\x06'
+
+_FLAG_ENCRYPTED = 0x01
+_FLAG_DATA_DESCRIPTOR = 0x08
+_ZIP32_LIMIT = 0xFFFFFFFF
+_COPY_CHUNK = 64 * 1024
+
+
+def _dos_datetime(date_time):
+    year, month, day, hour, minute, second = date_time
+    dosdate = (max(year, 1980) - 1980) << 9 | month << 5 | day
+    dostime = hour << 11 | minute << 5 | (second // 2)
+    return dostime, dosdate
+
+
+class RawZipWriter:
+    """Minimalny zapis archiwum ZIP pozwalający kopiować skompresowane dane
+    elementów z innego archiwum bez ich dekompresji. Bez ZIP64 (szablony DOCX
+    są dalekie od limitu 4 GB)."""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self._offset = 0
+        self._central = []
+
+    def _write(self, data: bytes):
+        self.fp.write(data)
+        self._offset += len(data)
+
+    def _add_entry(self, name: str, flag_bits: int, compress_type: int, date_time,
+                   crc: int, compress_size: int, file_size: int, external_attr: int = 0):
+        if compress_size > _ZIP32_LIMIT or file_size > _ZIP32_LIMIT:
+            raise ValueError(f'Element {name} przekracza limit rozmiaru ZIP')
+        encoded = name.encode('utf-8')
+        if not name.isascii():
+            flag_bits |= 0x800
+        dostime, dosdate = _dos_datetime(date_time)
+        version = 20
+        header_offset = self._offset
+        self._write(_LOCAL_HEADER.pack(
+            _LOCAL_SIG, version, 0, flag_bits, compress_type, dostime, dosdate,
+            crc, compress_size, file_size, len(encoded), 0,
+        ))
+        self._write(encoded)
+        self._central.append((
+            encoded, flag_bits, compress_type, dostime, dosdate,
+            crc, compress_size, file_size, external_attr, header_offset,
+        ))
+
+    def copy_raw(self, src_fp, info: zipfile.ZipInfo):
+        """Skopiuj element z archiwum źródłowego (src_fp) bez dekompresji."""
+        if info.flag_bits & _FLAG_ENCRYPTED:
+            raise ValueError(f'Zaszyfrowany element {info.filename} nie jest obsługiwany')
+        src_fp.seek(info.header_offset)
+        header = _LOCAL_HEADER.unpack(src_fp.read(_LOCAL_HEADER.size))
+        if header[0] != _LOCAL_SIG:
+            raise zipfile.BadZipFile(f'Uszkodzony nagłówek elementu {info.filename}')
+        src_fp.seek(header[10] + header[11], 1)
+
+        # Rozmiary i CRC znamy z katalogu centralnego - deskryptor danych jest zbędny
+        self._add_entry(
+            info.filename, info.flag_bits & ~_FLAG_DATA_DESCRIPTOR, info.compress_type,
+            info.date_time, info.CRC, info.compress_size, info.file_size, info.external_attr,
+        )
+        remaining = info.compress_size
+        while remaining:
+            chunk = src_fp.read(min(_COPY_CHUNK, remaining))
+            if not chunk:
+                raise zipfile.BadZipFile(f'Niekompletne dane elementu {info.filename}')
+            self._write(chunk)
+            remaining -= len(chunk)
+
+    def write_bytes(self, info: zipfile.ZipInfo, data: bytes):
+        """Zapisz nową zawartość elementu (kompresja deflate), zachowując jego metadane."""
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        self._add_entry(
+            info.filename, info.flag_bits & 0x800, zipfile.ZIP_DEFLATED, info.date_time,
+            zlib.crc32(data), len(compressed), len(data), info.external_attr,
+        )
+        self._write(compressed)
+
+    def close(self):
+        start = self._offset
+        for (encoded, flag_bits, compress_type, dostime, dosdate,
+             crc, compress_size, file_size, external_attr, header_offset) in self._central:
+            self._write(_CENTRAL_HEADER.pack(
+                _CENTRAL_SIG, 20, 0, 20, 0, flag_bits, compress_type, dostime, dosdate,
+                crc, compress_size, file_size, len(encoded), 0, 0, 0, 0,
+                external_attr, header_offset,
+            ))
+            self._write(encoded)
+        if len(self._central) > 0xFFFF or self._offset > _ZIP32_LIMIT:
+            raise ValueError('Archiwum przekracza limity ZIP')
+        size = self._offset - start
+        self._write(_END_RECORD.pack(
+            _END_SIG, 0, 0, len(self._central), len(self._central), size, start, 0,
+        ))
+
+
+def _iter_zip_parts(zf: zipfile.ZipFile):
+    for info in zf.infolist():
+        if docx_template.TEXT_PART_RE.match(info.filename):
+            yield info.filename, parse_xml(zf.read(info))
+
+
+def compile_zip(src_fp, fields, file_name: str = '') -> dict:
+    """Zbuduj indeks szablonu bezpośrednio z archiwum DOCX (bez python-docx Document)."""
+    with zipfile.ZipFile(src_fp) as zf:
+        return docx_template.compile_parts(_iter_zip_parts(zf), fields, file_name)
+
+
+def render_zip(src_fp, dst_fp, compiled: dict, values: dict) -> int:
+    """Zapisz do dst_fp kopię archiwum src_fp z podmienionymi polami.
+    Przepisywane są tylko części wskazane w indeksie, w których faktycznie nastąpiła podmiana;
+    reszta jest kopiowana bez dekompresji. Zwraca liczbę wykonanych podmian.
+    """
+    index = compiled.get('parts') or {}
+    replaced = 0
+    with zipfile.ZipFile(src_fp) as zf:
+        writer = RawZipWriter(dst_fp)
+        for info in zf.infolist():
+            part_index = index.get(info.filename)
+            if part_index:
+                element = parse_xml(zf.read(info))
+                count = docx_template.apply_to_part(element, part_index, values)
+                if count:
+                    replaced += count
+                    writer.write_bytes(info, serialize_part_xml(element))
+                    continue
+            writer.copy_raw(src_fp, info)
+        writer.close()
+    return replaced
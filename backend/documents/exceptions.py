@@ -0,0 +1,11 @@
+from rest_framework.exceptions import NotAuthenticated, PermissionDenied
+from rest_framework.views import exception_handler as drf_exception_handler
+
+
+def exception_handler(exc, context):
+    """Odmowy z klas uprawnień zwracają komunikat także w polu 'error', jak widoki aplikacji."""
+    response = drf_exception_handler(exc, context)
+    if response is not None and isinstance(exc, (PermissionDenied, NotAuthenticated)) \
+            and isinstance(response.data, dict) and 'detail' in response.data:
+        response.data['error'] = response.data['detail']
+    return response
@@ -0,0 +1,174 @@
+"""Eksport ukończonych przypisań do archiwum ZIP jako zadanie w tle.
+
+Gotowe archiwum zapisujemy na dysku (ProcessingJob.result_file) razem z kluczem
+opisującym zakres danych: administrator, dokument, liczba ukończonych przypisań,
+czas ostatniego ukończenia, suma rewizji wartości oraz szablony dokumentów (treść pliku
+źródłowego i definicje pól) i tryb renderowania. Dopóki klucz się nie zmieni (np. nie
+zostanie ukończone kolejne przypisanie, zmieniona wartość ani dodane lub usunięte pole),
+kolejne żądania eksportu dostają to samo archiwum.
+"""
+import hashlib
+import json
+import tempfile
+import time
+from functools import partial
+
+from django.core.files.base import File
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.utils import timezone
+
+from . import archives, generation, jobs
+from .generation import ensure_versions
+from .models import Document, DocumentAssignment, EditableField, ProcessingJob
+
+# Zadanie w toku starsze niż ten limit uznajemy za porzucone (np. restart serwera)
+STALE_AFTER = jobs.JOB_STALE_AFTER['export']
+# Zapis postępu do bazy co najwyżej raz na ten czas (s)
+PROGRESS_INTERVAL = 0.5
+
+
+def completed_queryset(user, document=None):
+    qs = DocumentAssignment.objects.filter(document__created_by=user, status='completed')
+    if document is not None:
+        qs = qs.filter(document=document)
+    return qs
+
+
+def _templates_digest(completed) -> str:
+    """Odcisk szablonów dokumentów z zakresu eksportu: plik źródłowy i definicje pól
+    (jak w documents.generation.version_fingerprint) oraz tryb renderowania."""
+    document_ids = completed.values('document_id')
+    digest = hashlib.sha256(generation.render_mode().encode('utf-8'))
+    for row in (Document.objects.filter(id__in=document_ids).order_by('id')
+                .values_list('id', 'file', 'blob__sha256')):
+        digest.update(json.dumps(row).encode('utf-8'))
+    for row in (EditableField.objects.filter(document_id__in=document_ids).order_by('document_id', 'id')
+                .values_list('document_id', 'field_id', 'original_value')):
+        digest.update(json.dumps(row, ensure_ascii=False).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def export_cache_key(user, document=None) -> str:
+    """Klucz zakresu eksportu - zmienia się, gdy przybędzie lub ubędzie ukończonych przypisań,
+    zmienią się wartości któregoś z nich (każdy zapis podbija rewizję) albo szablon dokumentu
+    (pola, plik źródłowy)."""
+    completed = completed_queryset(user, document)
+    stats = completed.aggregate(n=Count('id'), last=Max('completed_at'), revisions=Sum('revision'))
+    last = stats['last'].isoformat() if stats['last'] else ''
+    scope = document.id if document is not None else 'all'
+    raw = f"{user.id}:{scope}:{stats['n']}:{last}:{stats['revisions'] or 0}:{_templates_digest(completed)}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def request_export(user, document=None):
+    """Zwróć (zadanie, czy_z_cache). Wykorzystuje gotowe archiwum lub eksport w toku
+    dla tego samego zakresu; w przeciwnym razie zleca nowy eksport.
+    """
+    key = export_cache_key(user, document)
+    existing = (ProcessingJob.objects
+                .filter(kind='export', created_by=user, cache_key=key)
+                .exclude(status='failed')
+                .order_by('-created_at')
+                .first())
+    if existing is not None:
+        if existing.status == 'done':
+            if existing.result_file and existing.result_file.storage.exists(existing.result_file.name):
+                return existing, True
+        elif existing.created_at > timezone.now() - STALE_AFTER:
+            return existing, False
+        else:
+            jobs.expire_if_stale(existing)
+
+    job = ProcessingJob.objects.create(kind='export', document=document, created_by=user, cache_key=key)
+    transaction.on_commit(partial(jobs.run_in_background, run_export, job.id))
+    return job, False
+
+
+class _Progress:
+    """Licznik postępu zapisywany do bazy z ograniczoną częstotliwością."""
+
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+        self.done = 0
+        self._saved_at = 0.0
+
+    def set_total(self, total: int):
+        ProcessingJob.objects.filter(id=self.job_id).update(progress_total=total)
+
+    def add_total(self, n: int):
+        ProcessingJob.objects.filter(id=self.job_id).update(progress_total=F('progress_total') + n)
+
+    def step(self):
+        self.done += 1
+        now = time.monotonic()
+        if now - self._saved_at >= PROGRESS_INTERVAL:
+            self._saved_at = now
+            ProcessingJob.objects.filter(id=self.job_id).update(progress_done=self.done)
+
+
+def _counted(members, progress: _Progress):
+    for member in members:
+        yield member
+        progress.step()
+
+
+def run_export(job_id: int):
+    """Wygeneruj brakujące wersje i zapisz archiwum ZIP na dysku."""
+    job = ProcessingJob.objects.select_related('created_by', 'document').filter(id=job_id).first()
+    if job is None:
+        return
+    ProcessingJob.objects.filter(id=job_id).update(status='running', started_at=timezone.now())
+    try:
+        assignments = list(
+            completed_queryset(job.created_by, job.document)
+            .select_related('document', 'user')
+            .defer('document__original_content')
+            .order_by('document__name', 'user__username')
+        )
+        if not assignments:
+            raise ValueError('Brak ukończonych przypisań do pobrania')
+
+        # Postęp: wygenerowanie brakujących wersji + dopisanie każdego pliku do archiwum
+        progress = _Progress(job_id)
+        progress.set_total(len(assignments))
+        versions, errors = ensure_versions(assignments, on_missing=progress.add_total, on_progress=progress.step)
+        archives.drop_missing_files(assignments, versions, errors)
+        report = archives.errors_report(assignments, errors)
+        failures = []
+
+        with tempfile.TemporaryFile() as tmp:
+            members = _counted(archives.completed_members(assignments, versions), progress)
+            for chunk in archives.stream_zip(members, report, failures):
+                tmp.write(chunk)
+            tmp.seek(0)
+            job.result_file.save(archives.export_filename(job.created_by, job.document), File(tmp), save=False)
+
+        ProcessingJob.objects.filter(id=job_id).update(
+            status='done',
+            result_file=job.result_file.name,
+            progress_done=F('progress_total'),
+            error=report + ''.join(failures),
+            finished_at=timezone.now(),
+        )
+    except Exception as e:
+        ProcessingJob.objects.filter(id=job_id).update(
+            status='failed', error=str(e), finished_at=timezone.now(),
+        )
+        return
+
+    _remove_previous_exports(job)
+
+
+def _remove_previous_exports(job: ProcessingJob):
+    """Usuń pliki starszych archiwów z tego samego zakresu - nie będą już używane."""
+    previous = (ProcessingJob.objects
+                .filter(kind='export', created_by=job.created_by, document=job.document, status='done')
+                .exclude(id=job.id)
+                .exclude(result_file=''))
+    for old in previous:
+        try:
+            old.result_file.delete(save=False)
+        except Exception:
+            pass
+        ProcessingJob.objects.filter(id=old.id).update(result_file='')
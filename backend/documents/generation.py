@@ -0,0 +1,402 @@
+"""Generowanie plików DOCX z wartościami pól dla przypisań.
+
+Tryb renderowania wybiera ustawienie DOCUMENT_RENDER_MODE:
+- 'zip' (domyślnie) - przepisywane są tylko części XML z polami, reszta archiwum
+  jest kopiowana bez dekompresji (documents.docx_zip),
+- 'docx' - cały pakiet ładowany i zapisywany przez python-docx.
+
+Samo renderowanie (documents.workers.render_docx) nie dotyka bazy danych, więc
+przy eksporcie wielu przypisań brakujące wersje generujemy równolegle w puli
+procesów (generate_versions).
+
+Każda wersja nosi odcisk wejścia (plik źródłowy, definicje pól, wartości) - wersję
+podajemy tylko przy zgodnym odcisku, a renderujemy tylko przy jego zmianie. Renderowanie
+poprzedza rezerwacja wiersza DocumentVersion dla pary (przypisanie, odcisk), więc równoległe
+żądania o tę samą wersję czekają na jedno renderowanie (claim_version, get_or_render_version).
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.core.files.base import File
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils import timezone
+
+from . import docx_template, docx_zip, jobs, workers
+from .models import Document, DocumentAssignment, DocumentVersion, FieldValue
+from .values import read_values, reads_json
+
+# Jak długo czekamy na wersję renderowaną przez inne żądanie lub proces (s)
+RENDER_WAIT_TIMEOUT = 120
+RENDER_POLL_INTERVAL = 0.2
+# Rezerwację renderowania starszą niż ten limit uznajemy za porzuconą (np. restart serwera)
+RENDER_STALE_AFTER = timedelta(minutes=5)
+
+
+def _sanitize(name: str) -> str:
+    name = name or ''
+    return ''.join(ch if ch.isalnum() or ch in (' ', '-', '_') else '_' for ch in name).strip().replace(' ', '_')
+
+
+def _field_pairs(fields):
+    return [(f.field_id, f.original_value or '') for f in fields]
+
+
+def render_mode() -> str:
+    return getattr(settings, 'DOCUMENT_RENDER_MODE', 'zip')
+
+
+def compile_document_template(document: Document, fields=None) -> dict:
+    """Zbuduj i zapisz indeks szablonu dokumentu (patrz documents.docx_template).
+    Wywoływane przy zmianie pól oraz przy renderowaniu, gdy zapisany indeks jest nieaktualny.
+    """
+    if fields is None:
+        fields = list(document.editable_fields.all())
+    with document.file.open('rb') as f:
+        compiled = docx_zip.compile_zip(f, _field_pairs(fields), document.file.name)
+    Document.objects.filter(id=document.id).update(compiled_template=compiled)
+    document.compiled_template = compiled
+    return compiled
+
+
+def _compiled_for(document: Document, fields) -> dict:
+    compiled = document.compiled_template
+    key = docx_template.fields_key(_field_pairs(fields), document.file.name)
+    if not compiled or compiled.get('key') != key:
+        compiled = compile_document_template(document, fields)
+    return compiled
+
+
+def version_filename(assignment: DocumentAssignment) -> str:
+    filename_base = assignment.document.name.rsplit('.', 1)[0]
+    safe_doc = _sanitize(filename_base)
+    safe_user = _sanitize(assignment.user.username)
+    # Prefer pattern: username__document.docx for easy sorting by user
+    return f"{safe_user}__{safe_doc}.docx"
+
+
+def build_render_task(assignment: DocumentAssignment, fields=None, compiled=None, values=None) -> dict:
+    """Zbierz z bazy wszystko, czego potrzebuje documents.workers.render_docx.
+    fields/compiled/values - opcjonalnie już pobrane pola, aktualny indeks dokumentu i wartości.
+    """
+    doc_model = assignment.document
+    file_field = doc_model.file
+    if not file_field or not file_field.name.lower().endswith('.docx'):
+        raise ValueError('Brak pliku DOCX do przetworzenia')
+
+    if fields is None:
+        fields = list(doc_model.editable_fields.all())
+    # Mapuj field_id -> value
+    values_by_field_id = values if values is not None else read_values(assignment)
+    return {
+        'src_path': file_field.path,
+        'compiled': compiled or _compiled_for(doc_model, fields),
+        'values': values_by_field_id,
+        'mode': render_mode(),
+    }
+
+
+def _run_task(task: dict, dst_path: str, submit=None):
+    """Wyrenderuj w bieżącym procesie albo zleć przez submit (zwraca wtedy future)."""
+    args = (task['src_path'], dst_path, task['compiled'], task['values'], task['mode'])
+    if submit is None:
+        return workers.render_docx(*args)
+    return submit(workers.render_docx, *args)
+
+
+def _temp_path() -> str:
+    fd, path = tempfile.mkstemp(suffix='.docx')
+    os.close(fd)
+    return path
+
+
+def source_digest(document: Document) -> str:
+    """Odcisk treści pliku źródłowego: SHA-256 z StoredFile (documents.blobs); dla dokumentów
+    sprzed magazynu treści - nazwa i rozmiar pliku."""
+    if document.blob_id is not None:
+        return document.blob.sha256
+    try:
+        size = document.file.size
+    except (OSError, ValueError):
+        size = None
+    return f'{document.file.name}:{size}'
+
+
+def version_fingerprint(assignment: DocumentAssignment, fields, values: dict) -> str:
+    """Odcisk wejścia renderowania: treść pliku źródłowego, definicje pól, wartości i tryb renderowania.
+    Ten sam odcisk oznacza ten sam plik wynikowy, więc wersję z pasującym odciskiem
+    można podać bez renderowania, a każda zmiana wejścia wymusza nowe renderowanie."""
+    document = assignment.document
+    current = {f.field_id for f in fields}
+    payload = json.dumps([
+        docx_template.fields_key(_field_pairs(fields), document.file.name),
+        source_digest(document),
+        render_mode(),
+        sorted((k, v) for k, v in values.items() if k in current),
+    ], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def render_inputs(assignment: DocumentAssignment):
+    """(pola, wartości, odcisk) przypisania; korzysta z prefetchu pól i wartości, jeśli jest."""
+    fields = list(assignment.document.editable_fields.all())
+    values = read_values(assignment)
+    return fields, values, version_fingerprint(assignment, fields, values)
+
+
+def claim_version(assignment: DocumentAssignment, key: str, force: bool = False):
+    """Zarezerwuj renderowanie wersji o danym kluczu (odcisku) przypisania (single-flight).
+
+    Zwraca (wersja, czy_rezerwacja_nasza). Blokadą jest wiersz DocumentVersion z unikalną
+    parą (przypisanie, klucz): tylko jeden INSERT się powiedzie, więc działa to tak samo
+    na SQLite i PostgreSQL. Nieudane albo porzucone renderowanie (bez postępu dłużej
+    niż RENDER_STALE_AFTER) przejmujemy warunkowym UPDATE.
+    force - przejmij także gotową wersję (ponowne renderowanie).
+    """
+    while True:
+        now = timezone.now()
+        version = DocumentVersion.objects.filter(assignment=assignment, render_key=key).first()
+        if version is None:
+            try:
+                with transaction.atomic():
+                    version = DocumentVersion.objects.create(
+                        assignment=assignment, content='', render_key=key,
+                        status='rendering', claimed_at=now,
+                    )
+                return version, True
+            except IntegrityError:
+                # Ktoś zarezerwował ten klucz w międzyczasie
+                continue
+
+        takeover = (
+            version.status == 'failed'
+            or (version.status == 'rendering' and (version.claimed_at is None
+                                                   or version.claimed_at < now - RENDER_STALE_AFTER))
+            or (force and version.status == 'ready')
+        )
+        if not takeover:
+            return version, False
+        taken = (DocumentVersion.objects
+                 .filter(id=version.id, status=version.status, claimed_at=version.claimed_at)
+                 .update(status='rendering', claimed_at=now, error=''))
+        if taken:
+            version.status, version.claimed_at, version.error = 'rendering', now, ''
+            return version, True
+
+
+def _store_version(version: DocumentVersion, assignment: DocumentAssignment, path: str) -> DocumentVersion:
+    """Zapisz wygenerowany plik w zarezerwowanej wersji, oznacz ją jako gotową i usuń plik tymczasowy."""
+    try:
+        previous = version.generated_file.name if version.generated_file else ''
+        with open(path, 'rb') as fh:
+            version.generated_file.save(version_filename(assignment), File(fh), save=False)
+        DocumentVersion.objects.filter(id=version.id).update(
+            generated_file=version.generated_file.name, status='ready', error='',
+        )
+        version.status = 'ready'
+        if previous and previous != version.generated_file.name:
+            version.generated_file.storage.delete(previous)
+        return version
+    finally:
+        os.unlink(path)
+
+
+def _mark_failed(version: DocumentVersion, error: Exception):
+    DocumentVersion.objects.filter(id=version.id).update(status='failed', error=str(error))
+    version.status, version.error = 'failed', str(error)
+
+
+def _render_claimed(version: DocumentVersion, assignment: DocumentAssignment, task: dict = None) -> DocumentVersion:
+    """Wyrenderuj zarezerwowaną wersję w bieżącym procesie."""
+    path = _temp_path()
+    try:
+        _run_task(task or build_render_task(assignment), path)
+    except Exception as e:
+        os.unlink(path)
+        _mark_failed(version, e)
+        raise
+    return _store_version(version, assignment, path)
+
+
+def get_or_render_version(assignment: DocumentAssignment, force: bool = False) -> DocumentVersion:
+    """Wersja z plikiem DOCX dla bieżącego odcisku przypisania - gotowa (bez renderowania),
+    wyrenderowana teraz albo (gdy renderuje ją już ktoś inny) po zaczekaniu na jej zakończenie.
+    Wersje z innym odciskiem (zmienione pola, wartości lub plik) nie są podawane.
+
+    Zachowujemy style, podmieniając tekst w istniejących runach. Miejsca podmian pochodzą
+    ze skompilowanego indeksu szablonu; indeks jest przebudowywany tylko wtedy, gdy zmieniły
+    się pola lub plik źródłowy.
+    """
+    fields, values, key = render_inputs(assignment)
+    deadline = time.monotonic() + RENDER_WAIT_TIMEOUT
+    while True:
+        version, owned = claim_version(assignment, key, force=force)
+        if owned:
+            return _render_claimed(version, assignment, build_render_task(assignment, fields, values=values))
+        if version.status == 'ready':
+            return version
+        if time.monotonic() > deadline:
+            raise TimeoutError('Generowanie pliku trwa zbyt długo - spróbuj ponownie za chwilę')
+        time.sleep(RENDER_POLL_INTERVAL)
+        force = False
+
+
+def generate_version_after_commit(assignment_id: int):
+    """Zleć wygenerowanie wersji w tle po zatwierdzeniu bieżącej transakcji
+    (np. po ukończeniu przypisania - odpowiedź nie czeka na renderowanie)."""
+    transaction.on_commit(partial(jobs.run_in_background, _generate_version_by_id, assignment_id))
+
+
+def _generate_version_by_id(assignment_id: int):
+    assignment = (DocumentAssignment.objects
+                  .select_related('document', 'user')
+                  .defer('document__original_content')
+                  .filter(id=assignment_id)
+                  .first())
+    if assignment is None:
+        return
+    try:
+        get_or_render_version(assignment)
+    except Exception as e:
+        # Wersję wygeneruje później pobranie pliku lub eksport ZIP
+        print(f"[WARN] DOCX generation failed for assignment {assignment_id}: {e}")
+
+
+def generate_versions(assignments, executor=None, max_in_flight: int = None, on_progress=None, force: bool = False):
+    """Wygeneruj wersje dla wielu przypisań równolegle w puli procesów.
+
+    Zwraca (wersje, błędy): słowniki id przypisania -> DocumentVersion / komunikat błędu.
+    Liczba zadań przekazanych jednocześnie do puli jest ograniczona (max_in_flight),
+    żeby nie budować kolejki z danymi wszystkich przypisań naraz. Przypisania renderowane
+    właśnie przez kogoś innego (patrz claim_version) nie są renderowane drugi raz -
+    czekamy na ich wynik na końcu.
+    on_progress - opcjonalnie wywoływane po każdym zakończonym przypisaniu.
+    force - renderuj ponownie także przypisania z gotową wersją.
+    """
+    versions, errors = {}, {}
+    assignments = list(assignments)
+    if not assignments:
+        return versions, errors
+
+    def _progress():
+        if on_progress:
+            on_progress()
+
+    if executor is None and getattr(settings, 'DOCUMENT_JOBS_EAGER', False):
+        for ass in assignments:
+            try:
+                versions[ass.id] = get_or_render_version(ass, force=force)
+            except Exception as e:
+                errors[ass.id] = str(e)
+            _progress()
+        return versions, errors
+
+    submit = executor.submit if executor is not None else jobs.submit
+    if max_in_flight is None:
+        max_in_flight = 2 * (getattr(settings, 'DOCUMENT_WORKER_PROCESSES', None) or os.cpu_count() or 1)
+
+    # Indeks szablonu sprawdzamy raz na dokument
+    templates = {}
+    pending = {}
+    waiting = []
+
+    def _finish(future):
+        ass, version, path = pending.pop(future)
+        try:
+            future.result()
+        except Exception as e:
+            errors[ass.id] = str(e)
+            _mark_failed(version, e)
+            if os.path.exists(path):
+                os.unlink(path)
+        else:
+            try:
+                versions[ass.id] = _store_version(version, ass, path)
+            except Exception as e:
+                errors[ass.id] = str(e)
+                _mark_failed(version, e)
+        _progress()
+
+    for ass in assignments:
+        try:
+            fields, values, key = render_inputs(ass)
+            version, owned = claim_version(ass, key, force=force)
+        except Exception as e:
+            errors[ass.id] = str(e)
+            _progress()
+            continue
+        if not owned:
+            if version.status == 'ready':
+                versions[ass.id] = version
+                _progress()
+            else:
+                waiting.append(ass)
+            continue
+        try:
+            if ass.document_id not in templates:
+                templates[ass.document_id] = _compiled_for(ass.document, fields)
+            task = build_render_task(ass, fields, templates[ass.document_id], values)
+        except Exception as e:
+            errors[ass.id] = str(e)
+            _mark_failed(version, e)
+            _progress()
+            continue
+        path = _temp_path()
+        pending[_run_task(task, path, submit)] = (ass, version, path)
+        if len(pending) >= max_in_flight:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in done:
+                _finish(future)
+
+    for future in list(pending):
+        _finish(future)
+    for ass in waiting:
+        try:
+            versions[ass.id] = get_or_render_version(ass)
+        except Exception as e:
+            errors[ass.id] = str(e)
+        _progress()
+    return versions, errors
+
+
+def prefetch_render_inputs(assignments):
+    """Pobierz pola dokumentów, ich pliki źródłowe i wartości przypisań zbiorczo (stała liczba zapytań)."""
+    lookups = ['document__editable_fields', 'document__blob']
+    if not reads_json():
+        lookups.append(Prefetch('field_values', queryset=FieldValue.objects.select_related('field')))
+    prefetch_related_objects(assignments, *lookups)
+
+
+def current_versions(assignments) -> dict:
+    """Gotowe wersje z odciskiem zgodnym z bieżącym stanem przypisań: id przypisania -> wersja.
+    Przypisania, których wersja jest nieaktualna lub jej brak, nie występują w wyniku."""
+    assignments = list(assignments)
+    prefetch_render_inputs(assignments)
+    keys = {a.id: render_inputs(a)[2] for a in assignments}
+    qs = (DocumentVersion.objects
+          .filter(assignment_id__in=list(keys), render_key__in=set(keys.values()), status='ready')
+          .defer('content')
+          .exclude(generated_file='')
+          .exclude(generated_file__isnull=True))
+    return {v.assignment_id: v for v in qs if keys.get(v.assignment_id) == v.render_key}
+
+
+def ensure_versions(assignments, on_missing=None, on_progress=None):
+    """Aktualne wersje dla przypisań; brakujące lub nieaktualne są generowane równolegle.
+    Zwraca (wersje, błędy) jak generate_versions. on_missing(n) - liczba wersji do wygenerowania.
+    """
+    assignments = list(assignments)
+    versions = current_versions(assignments)
+    missing = [a for a in assignments if a.id not in versions]
+    if on_missing:
+        on_missing(len(missing))
+    generated, errors = generate_versions(missing, on_progress=on_progress)
+    versions.update(generated)
+    return versions, errors
@@ -0,0 +1,259 @@
+"""Kolejka zadań w tle oparta na lokalnej puli procesów (bez zewnętrznego brokera).
+
+Zadanie jest zapisywane w bazie (ProcessingJob), a po zatwierdzeniu transakcji
+przekazywane do puli procesów. Wynik wraca do procesu serwera przez callback
+future, który aktualizuje stan zadania i dokumentu.
+
+Ustawienia:
+- DOCUMENT_WORKER_PROCESSES - liczba procesów roboczych (domyślnie liczba CPU),
+- DOCUMENT_JOBS_EAGER - wykonuj zadania synchronicznie (testy, debugowanie),
+- DOCUMENT_EXTRACT_IMAGES - zapisuj obrazy z konwersji jako osobne pliki (MEDIA_ROOT/images)
+  dostępne pod DOCUMENT_IMAGES_URL zamiast osadzać je w HTML jako base64.
+
+Dłuższe zadania korzystające z bazy (eksport ZIP) uruchamiane są w wątkach
+koordynujących (run_in_background), które zlecają renderowanie do puli procesów.
+
+Zadanie w toku dłużej niż JOB_STALE_AFTER (np. po awarii procesu roboczego lub restarcie
+serwera, kiedy callback już nie przyjdzie) uznajemy za porzucone - tak jak rezerwację
+renderowania w documents.generation. Oznaczamy je jako nieudane przy odczycie stanu
+(expire_if_stale) albo przy kolejnym zleceniu dla tego samego dokumentu, które je przejmuje.
+"""
+import hashlib
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import partial
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import blobs, workers
+from .models import Document, ProcessingJob
+
+ACTIVE_STATUSES = ('queued', 'running')
+JOB_STALE_AFTER = {
+    'convert': timedelta(minutes=15),
+    'export': timedelta(minutes=30),
+}
+STALE_ERROR = 'Zadanie przerwane (przekroczono czas wykonania) - zleć je ponownie.'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Wątki koordynujące dłuższe zadania (np. eksport), które same korzystają z bazy
+# i zlecają właściwą pracę do puli procesów
+_coordinator = ThreadPoolExecutor(max_workers=2, thread_name_prefix='documents-jobs')
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """Zwróć współdzieloną pulę procesów (tworzoną leniwie przy pierwszym użyciu)."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            max_workers = getattr(settings, 'DOCUMENT_WORKER_PROCESSES', None) or None
+            _executor = ProcessPoolExecutor(max_workers=max_workers)
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def submit(fn, *args):
+    """Zleć funkcję do puli procesów. Jeśli pula padła (np. OOM), utwórz ją ponownie."""
+    try:
+        return get_executor().submit(fn, *args)
+    except BrokenProcessPool:
+        _reset_executor()
+        return get_executor().submit(fn, *args)
+
+
+def _close_connection_after(fn, *args):
+    try:
+        fn(*args)
+    finally:
+        connection.close()
+
+
+def run_in_background(fn, *args):
+    """Uruchom funkcję w wątku koordynującym (albo od razu w trybie DOCUMENT_JOBS_EAGER)."""
+    if _is_eager():
+        fn(*args)
+        return
+    _coordinator.submit(_close_connection_after, fn, *args)
+
+
+def _is_eager() -> bool:
+    return bool(getattr(settings, 'DOCUMENT_JOBS_EAGER', False))
+
+
+def conversion_mode() -> str:
+    """'files' - obrazy jako osobne pliki, 'inline' - obrazy w HTML jako data URI."""
+    return 'files' if getattr(settings, 'DOCUMENT_EXTRACT_IMAGES', False) else 'inline'
+
+
+def html_cache_mode() -> str:
+    """Tryb HTML zapamiętanego dla treści pliku (StoredFile.html_mode). W trybie 'files' adres
+    obrazów jest wpisany w HTML, więc zmiana DOCUMENT_IMAGES_URL wymusza nową konwersję."""
+    mode = conversion_mode()
+    if mode == 'files':
+        mode += ':' + hashlib.sha256(images_url().encode('utf-8')).hexdigest()[:16]
+    return mode
+
+
+def images_dir() -> str:
+    return os.path.join(settings.MEDIA_ROOT, 'images')
+
+
+def images_url() -> str:
+    return getattr(settings, 'DOCUMENT_IMAGES_URL', '')
+
+
+def _conversion_args(path: str) -> tuple:
+    if conversion_mode() == 'files':
+        return path, images_dir(), images_url()
+    return (path,)
+
+
+def _from_ts(ts):
+    return datetime.fromtimestamp(ts, tz=dt_timezone.utc) if ts else None
+
+
+def _stale_before(kind: str):
+    return timezone.now() - JOB_STALE_AFTER[kind]
+
+
+def expire_stale_conversions(document_id=None) -> int:
+    """Oznacz porzucone konwersje jako nieudane, a ich dokumenty (bez innej konwersji w toku)
+    jako 'failed'. Warunkowy UPDATE - zadanie zakończone w międzyczasie nie jest zmieniane.
+    Zwraca liczbę oznaczonych zadań."""
+    stale = ProcessingJob.objects.filter(kind='convert', status__in=ACTIVE_STATUSES,
+                                         created_at__lt=_stale_before('convert'))
+    if document_id is not None:
+        stale = stale.filter(document_id=document_id)
+    document_ids = list(stale.values_list('document_id', flat=True))
+    if not document_ids:
+        return 0
+    now = timezone.now()
+    expired = stale.filter(document_id__in=document_ids).update(status='failed', error=STALE_ERROR, finished_at=now)
+    (Document.objects
+     .filter(id__in=document_ids, processing_status='processing')
+     .exclude(jobs__kind='convert', jobs__status__in=ACTIVE_STATUSES)
+     .update(processing_status='failed', updated_at=now))
+    return expired
+
+
+def expire_if_stale(job: ProcessingJob) -> ProcessingJob:
+    """Stan zadania do pokazania klientowi - porzucone zadanie jest najpierw oznaczane jako nieudane."""
+    limit = JOB_STALE_AFTER.get(job.kind)
+    if job.status not in ACTIVE_STATUSES or limit is None or job.created_at >= _stale_before(job.kind):
+        return job
+    if job.kind == 'convert':
+        expire_stale_conversions(job.document_id)
+    else:
+        (ProcessingJob.objects.filter(id=job.id, status__in=ACTIVE_STATUSES)
+         .update(status='failed', error=STALE_ERROR, finished_at=timezone.now()))
+    job.refresh_from_db()
+    return job
+
+
+def enqueue_conversion(document: Document, user) -> ProcessingJob:
+    """Zleć konwersję DOCX -> HTML dla dokumentu i oznacz go jako przetwarzany.
+    Jeśli ta sama treść była już konwertowana (documents.blobs), wynik jest brany z cache
+    i zadanie kończy się od razu. Konwersja dokumentu już w toku jest zwracana zamiast
+    nowej; porzuconą (JOB_STALE_AFTER) przejmuje nowe zadanie."""
+    expire_stale_conversions(document.id)
+    active = (ProcessingJob.objects
+              .filter(kind='convert', document=document, status__in=ACTIVE_STATUSES)
+              .order_by('-created_at').first())
+    if active is not None:
+        document.processing_status = 'processing'
+        return active
+
+    html = blobs.cached_html(document.blob_id, html_cache_mode())
+    if html is not None:
+        now = timezone.now()
+        job = ProcessingJob.objects.create(kind='convert', document=document, created_by=user,
+                                           status='done', started_at=now, finished_at=now)
+        Document.objects.filter(id=document.id).update(original_content=html, processing_status='ready', updated_at=now)
+        document.original_content = html
+        document.processing_status = 'ready'
+        return job
+
+    job = ProcessingJob.objects.create(kind='convert', document=document, created_by=user)
+    Document.objects.filter(id=document.id).update(processing_status='processing')
+    document.processing_status = 'processing'
+    transaction.on_commit(partial(_dispatch_conversion, job.id))
+    return job
+
+
+def _dispatch_conversion(job_id: int):
+    job = ProcessingJob.objects.select_related('document').get(id=job_id)
+    try:
+        path = job.document.file.path
+    except Exception as e:
+        _finish_conversion(job_id, error=e)
+        return
+
+    if _is_eager():
+        try:
+            result = workers.convert_docx_to_html(*_conversion_args(path))
+        except Exception as e:
+            _finish_conversion(job_id, error=e)
+        else:
+            _finish_conversion(job_id, result=result)
+        return
+
+    ProcessingJob.objects.filter(id=job_id).update(status='running')
+    future = submit(workers.convert_docx_to_html, *_conversion_args(path))
+    future.add_done_callback(partial(_on_conversion_done, job_id))
+
+
+def _on_conversion_done(job_id: int, future):
+    # Callback wykonywany w wątku zarządzającym pulą - własne połączenie z bazą
+    try:
+        try:
+            result = future.result()
+        except Exception as e:
+            _finish_conversion(job_id, error=e)
+        else:
+            _finish_conversion(job_id, result=result)
+    finally:
+        connection.close()
+
+
+def _finish_conversion(job_id: int, result: dict = None, error: Exception = None):
+    now = timezone.now()
+    job = ProcessingJob.objects.filter(id=job_id).first()
+    if job is None:
+        # Dokument (a z nim zadanie) usunięto w trakcie konwersji
+        return
+    # Tylko zadanie wciąż w toku - porzucone (expire_stale_conversions) mogło już zostać przejęte
+    active = ProcessingJob.objects.filter(id=job_id, status__in=ACTIVE_STATUSES)
+
+    if error is not None:
+        if active.update(status='failed', error=f'Błąd przetwarzania pliku DOCX: {error}', finished_at=now):
+            Document.objects.filter(id=job.document_id).update(processing_status='failed', updated_at=now)
+        return
+
+    with transaction.atomic():
+        if not active.update(
+            status='done',
+            started_at=_from_ts(result.get('started_at')),
+            finished_at=_from_ts(result.get('finished_at')) or now,
+        ):
+            return
+        Document.objects.filter(id=job.document_id).update(
+            original_content=result['html'],
+            processing_status='ready',
+            updated_at=now,
+        )
+        blob_id = Document.objects.filter(id=job.document_id).values_list('blob_id', flat=True).first()
+        blobs.remember_html(blob_id, result['html'], html_cache_mode())
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from documents.values import backfill_json, storage_mode
+
+
+class Command(BaseCommand):
+    help = 'Przepisz wartości pól z wierszy FieldValue do DocumentAssignment.values (przed przejściem na DOCUMENT_VALUE_STORAGE=both/json).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if storage_mode() == 'json':
+            self.stderr.write(self.style.WARNING(
+                "DOCUMENT_VALUE_STORAGE=json - wiersze FieldValue nie są aktualizowane, "
+                "przepisanie mogłoby nadpisać nowsze wartości. Uruchom przed zmianą trybu."
+            ))
+            return
+        updated = backfill_json(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Zaktualizowano {updated} przypisań'))
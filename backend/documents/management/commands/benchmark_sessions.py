@@ -0,0 +1,141 @@
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from documents.models import Document, DocumentAssignment, EditableField, UserProfile
+from documents.tokens import issue_tokens
+
+ENDPOINTS = (
+    ('current_user', '/api/auth/current-user/'),
+    ('user_assignments', '/api/assignments/user/'),
+)
+
+# Punkt odniesienia: token API (documents.tokens) - żądanie bez sesji
+BASELINE = 'token'
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return statistics.mean(samples) * 1000, p95 * 1000
+
+
+class Command(BaseCommand):
+    help = ('Porównaj koszt sesji na żądanie dla profili SESSION_PROFILES (db, cached_db, cached_db_file, '
+            'signed_cookies) na endpointach current_user i user_assignments. Dane są tworzone '
+            'w osobnej, tymczasowej bazie SQLite; baza projektu nie jest używana.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Liczba pomiarów na endpoint i profil.')
+        parser.add_argument('--assignments', type=int, default=20,
+                            help='Liczba przypisań użytkownika (rozmiar listy user_assignments).')
+        parser.add_argument('--profiles', nargs='+', default=list(settings.SESSION_PROFILES),
+                            help='Profile do porównania (domyślnie wszystkie).')
+
+    def handle(self, *args, **options):
+        unknown = sorted(set(options['profiles']) - set(settings.SESSION_PROFILES))
+        if unknown:
+            raise CommandError(f'Nieznane profile: {", ".join(unknown)}')
+        if connection.vendor != 'sqlite':
+            raise CommandError('Benchmark tworzy tymczasową bazę SQLite - wymaga bazy sqlite w DATABASES.')
+
+        workdir = tempfile.mkdtemp(prefix='session-bench-')
+        caches = {**settings.CACHES,
+                  'sessions_file': {**settings.CACHES['sessions_file'], 'LOCATION': os.path.join(workdir, 'cache')}}
+        setup_test_environment()
+        # Baza w pliku (a nie w pamięci), żeby odczyt django_session kosztował tyle co w działającym serwerze
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(workdir, 'bench.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CACHES=caches):
+                user = self._seed(options['assignments'])
+                results = {}
+                for name in options['profiles']:
+                    with override_settings(**settings.SESSION_PROFILES[name]):
+                        client = Client()
+                        client.force_login(user)
+                        results[name] = self._measure(client, options['requests'])
+                with override_settings(API_TOKENS_ENABLED=True):
+                    client = Client(headers={'authorization': f'Bearer {issue_tokens(user)["access"]}'})
+                    results[BASELINE] = self._measure(client, options['requests'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        self._report(results, options)
+
+    def _seed(self, n_assignments):
+        admin = User.objects.create_user('bench_admin')
+        UserProfile.objects.create(user=admin, role='admin', section='A')
+        user = User.objects.create_user('bench_user', first_name='Jan', last_name='Kowalski')
+        UserProfile.objects.create(user=user, role='user', section='A', index='1', profile_completed=True)
+        for i in range(n_assignments):
+            doc = Document.objects.create(name=f'bench{i}.docx', file='documents/bench.docx', created_by=admin)
+            EditableField.objects.bulk_create(
+                [EditableField(document=doc, field_id=f'pole_{j}', label=f'Pole {j}') for j in range(5)])
+            DocumentAssignment.objects.create(document=doc, user=user)
+        return user
+
+    def _measure(self, client, n_requests):
+        result = {}
+        for endpoint, url in ENDPOINTS:
+            # Rozgrzewka: cache sesji i profilu, połączenie z bazą
+            for _ in range(5):
+                response = client.get(url)
+                if response.status_code != 200:
+                    raise CommandError(f'{url}: HTTP {response.status_code}')
+            executed = []
+
+            def record(execute, sql, params, many, context):
+                executed.append(sql)
+                return execute(sql, params, many, context)
+
+            with connection.execute_wrapper(record):
+                client.get(url)
+            times = []
+            for _ in range(n_requests):
+                started = time.perf_counter()
+                client.get(url)
+                times.append(time.perf_counter() - started)
+            mean, p95 = _percentiles(times)
+            result[endpoint] = {
+                'mean': mean,
+                'p95': p95,
+                'queries': len(executed),
+                'session_queries': sum('django_session' in sql for sql in executed),
+            }
+        return result
+
+    def _report(self, results, options):
+        names = list(results)
+        self.stdout.write(f"{options['requests']} żądań na endpoint, {options['assignments']} przypisań na liście")
+        header = f"{'':30}" + ''.join(f'{name:>16}' for name in names)
+        for endpoint, _ in ENDPOINTS:
+            self.stdout.write('')
+            self.stdout.write(endpoint)
+            self.stdout.write(header)
+            self.stdout.write('-' * len(header))
+            baseline = results[BASELINE][endpoint]['mean']
+            for key, label, fmt in (
+                ('mean', 'Średnio [ms]', '>16.3f'),
+                ('p95', '  p95 [ms]', '>16.3f'),
+                ('overhead', 'Koszt sesji vs token [ms]', '>+16.3f'),
+                ('queries', 'Zapytania SQL', '>16d'),
+                ('session_queries', '  w tym django_session', '>16d'),
+            ):
+                cells = []
+                for name in names:
+                    row = results[name][endpoint]
+                    value = row['mean'] - baseline if key == 'overhead' else row[key]
+                    cells.append(format(value, fmt))
+                self.stdout.write(f'{label:30}' + ''.join(cells))
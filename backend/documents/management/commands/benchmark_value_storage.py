@@ -0,0 +1,142 @@
+import os
+import random
+import shutil
+import statistics
+import string
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from documents.models import Document, DocumentAssignment, EditableField
+from documents.values import read_values, write_values
+
+# Porównywane tryby DOCUMENT_VALUE_STORAGE ('both' to suma kosztów zapisu obu)
+MODES = ('rows', 'json')
+
+
+def _value(rng):
+    return ''.join(rng.choices(string.ascii_letters + ' ', k=rng.randint(5, 40)))
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return statistics.mean(samples) * 1000, p95 * 1000
+
+
+class Command(BaseCommand):
+    help = ('Porównaj przechowywanie wartości pól jako wiersze FieldValue i jako JSON na przypisaniu. '
+            'Zapis i odczyt idą przez documents.values (write_values/read_values) na modelach projektu; '
+            'dane są tworzone w osobnej, tymczasowej bazie SQLite dla każdego trybu - baza projektu '
+            'nie jest używana.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--assignments', type=int, default=20000)
+        parser.add_argument('--fields', type=int, default=50,
+                            help='Pól na dokument (domyślnie 20000 x 50 = 1M wartości).')
+        parser.add_argument('--samples', type=int, default=2000,
+                            help='Liczba pomiarów odczytu i zapisu.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--keep', action='store_true', help='Nie usuwaj plików baz po pomiarze.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Benchmark tworzy tymczasowe bazy SQLite - wymaga bazy sqlite w DATABASES.')
+        n_assign, n_fields = options['assignments'], options['fields']
+        self.stdout.write(f'{n_assign} przypisań x {n_fields} pól = {n_assign * n_fields} wartości')
+
+        workdir = tempfile.mkdtemp(prefix='value-storage-')
+        setup_test_environment()
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        results = {}
+        try:
+            for mode in MODES:
+                # Te same dane i kolejność pomiarów w obu trybach
+                rng = random.Random(options['seed'])
+                path = os.path.join(workdir, f'{mode}.sqlite3')
+                test_settings['NAME'] = path
+                old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+                try:
+                    with override_settings(DOCUMENT_VALUE_STORAGE=mode):
+                        results[mode] = self._bench(n_assign, n_fields, options['samples'], rng)
+                    results[mode]['size_mb'] = os.path.getsize(path) / 1024 / 1024
+                finally:
+                    connection.close()
+                    if options['keep']:
+                        connection.settings_dict['NAME'] = old_name
+                    else:
+                        connection.creation.destroy_test_db(old_name, verbosity=0)
+        finally:
+            teardown_test_environment()
+            if options['keep']:
+                self.stdout.write(f'Bazy zachowane w {workdir}')
+            else:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        header = f"{'':28}" + ''.join(f'{mode:>12}' for mode in MODES)
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for key, label in (
+            ('load_s', 'Zapis całości [s]'),
+            ('size_mb', 'Rozmiar bazy [MB]'),
+            ('read_mean', 'Odczyt przypisania [ms]'),
+            ('read_p95', '  p95 [ms]'),
+            ('write_one_mean', 'Zapis 1 pola [ms]'),
+            ('write_one_p95', '  p95 [ms]'),
+            ('write_all_mean', 'Zapis całego formularza [ms]'),
+            ('write_all_p95', '  p95 [ms]'),
+        ):
+            self.stdout.write(f'{label:28}' + ''.join(f'{results[mode][key]:>12.3f}' for mode in MODES))
+
+    def _seed(self, n_assign, n_fields):
+        admin = User.objects.create_user('bench_admin')
+        document = Document.objects.create(name='bench.docx', file='documents/bench.docx', created_by=admin)
+        EditableField.objects.bulk_create(
+            [EditableField(document=document, field_id=f'pole_{i}', label=f'Pole {i}') for i in range(n_fields)])
+        users = User.objects.bulk_create([User(username=f'bench_user_{i}') for i in range(n_assign)])
+        DocumentAssignment.objects.bulk_create(
+            [DocumentAssignment(document=document, user=user) for user in users], batch_size=500)
+        return list(DocumentAssignment.objects.order_by('id'))
+
+    def _bench(self, n_assign, n_fields, samples, rng):
+        assignments = self._seed(n_assign, n_fields)
+        field_ids = [f'pole_{i}' for i in range(n_fields)]
+
+        # Wypełnienie wszystkich formularzy - po jednym write_values na przypisanie
+        started = time.perf_counter()
+        with transaction.atomic():
+            for assignment in assignments:
+                write_values(assignment, {f: _value(rng) for f in field_ids})
+        load = time.perf_counter() - started
+
+        by_id = {a.id: a for a in assignments}
+        picks = [rng.choice(assignments).id for _ in range(samples)]
+
+        def read(a_id):
+            # Jak widok szczegółów przypisania: przypisanie z bazy, potem jego wartości
+            return read_values(DocumentAssignment.objects.get(id=a_id))
+
+        def write(a_id, names):
+            write_values(by_id[a_id], {n: _value(rng) for n in names})
+
+        read_mean, read_p95 = self._timed(picks, read)
+        one_mean, one_p95 = self._timed(picks, lambda a_id: write(a_id, [rng.choice(field_ids)]))
+        all_mean, all_p95 = self._timed(picks[: max(1, len(picks) // 10)], lambda a_id: write(a_id, field_ids))
+        return {
+            'load_s': load,
+            'read_mean': read_mean, 'read_p95': read_p95,
+            'write_one_mean': one_mean, 'write_one_p95': one_p95,
+            'write_all_mean': all_mean, 'write_all_p95': all_p95,
+        }
+
+    def _timed(self, picks, fn):
+        times = []
+        for assignment_id in picks:
+            started = time.perf_counter()
+            fn(assignment_id)
+            times.append(time.perf_counter() - started)
+        return _percentiles(times)
@@ -0,0 +1,164 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from documents.models import UserProfile
+from documents.workers import hash_passwords
+
+COLUMNS = ('username', 'password', 'email', 'first_name', 'last_name', 'role', 'index', 'section')
+ROLES = ('admin', 'user')
+# Hasła do jednego procesu roboczego naraz (mniej komunikacji między procesami)
+HASH_CHUNK = 50
+
+
+def _read_csv(path, delimiter):
+    # utf-8-sig - eksporty z Excela zaczynają się od BOM
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        yield from csv.DictReader(f, delimiter=delimiter)
+
+
+def _read_json(path):
+    with open(path, encoding='utf-8') as f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        if first == '[':
+            # Tablica JSON jest wczytywana w całości; JSON Lines (obiekt w wierszu) strumieniowo
+            f.seek(0)
+            yield from json.load(f)
+            return
+        f.seek(0)
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = ('Zaimportuj użytkowników z profilami (index, sekcja, rola) z pliku CSV lub JSON/JSON Lines. '
+            f"Kolumny: {', '.join(COLUMNS)}; wymagana tylko username. Istniejące konta są pomijane.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('csv', 'json'), default=None,
+                            help='Domyślnie według rozszerzenia pliku (.csv lub .json/.jsonl).')
+        parser.add_argument('--delimiter', default=',', help='Separator kolumn CSV.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Procesy haszujące hasła (domyślnie DOCUMENT_WORKER_PROCESSES lub liczba CPU; '
+                                 '0 - haszowanie w bieżącym procesie).')
+        parser.add_argument('--default-role', choices=ROLES, default='user')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'Plik {path} nie istnieje')
+        fmt = options['format'] or ('csv' if path.lower().endswith('.csv') else 'json')
+        rows = _read_csv(path, options['delimiter']) if fmt == 'csv' else _read_json(path)
+
+        workers = options['workers']
+        if workers is None:
+            workers = getattr(settings, 'DOCUMENT_WORKER_PROCESSES', None) or os.cpu_count() or 1
+        self.stats = {'read': 0, 'created': 0, 'existing': 0, 'invalid': 0, 'hash_s': 0.0}
+        self.seen = set()
+        started = time.perf_counter()
+        if workers:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                self._import(rows, options, executor.map)
+        else:
+            self._import(rows, options, map)
+        elapsed = time.perf_counter() - started
+
+        s = self.stats
+        rate = s['created'] / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Utworzono {s['created']} z {s['read']} kont w {elapsed:.1f} s ({rate:.0f} kont/s; "
+            f"haszowanie {s['hash_s']:.1f} s, {workers or 1} proc.). "
+            f"Pominięto: istniejące {s['existing']}, błędne {s['invalid']}"
+        ))
+
+    def _import(self, rows, options, map_fn):
+        for batch in _batches(rows, options['batch_size']):
+            self.stats['read'] += len(batch)
+            records = self._clean(batch, options['default_role'])
+            if records:
+                self._insert(records, map_fn)
+
+    def _clean(self, batch, default_role):
+        """Rekordy do utworzenia: poprawne, bez powtórzeń w pliku i bez istniejących kont."""
+        records = {}
+        for row in batch:
+            row = {k.strip().lower(): ('' if v is None else str(v).strip()) for k, v in row.items() if k}
+            username = row.get('username', '')
+            role = row.get('role') or default_role
+            if not self._valid_username(username) or role not in ROLES or username in self.seen:
+                self.stats['invalid'] += 1
+                continue
+            self.seen.add(username)
+            row['role'] = role
+            records[username] = row
+        existing = set(User.objects.filter(username__in=list(records)).values_list('username', flat=True))
+        self.stats['existing'] += len(existing)
+        return [r for name, r in records.items() if name not in existing]
+
+    @staticmethod
+    def _valid_username(username) -> bool:
+        if not username or len(username) > 150:
+            return False
+        try:
+            User.username_validator(username)
+        except ValidationError:
+            return False
+        return True
+
+    def _insert(self, records, map_fn):
+        started = time.perf_counter()
+        passwords = [r.get('password', '') for r in records]
+        chunks = [passwords[i:i + HASH_CHUNK] for i in range(0, len(passwords), HASH_CHUNK)]
+        hashes = [h for chunk in map_fn(hash_passwords, chunks) for h in chunk]
+        self.stats['hash_s'] += time.perf_counter() - started
+
+        users = [
+            User(username=r['username'], password=h, email=r.get('email', ''),
+                 first_name=r.get('first_name', '')[:150], last_name=r.get('last_name', '')[:150],
+                 is_staff=r['role'] == 'admin')
+            for r, h in zip(records, hashes)
+        ]
+        with transaction.atomic():
+            # Konto utworzone w międzyczasie przez kogoś innego jest pomijane (konflikt nazwy)
+            User.objects.bulk_create(users, ignore_conflicts=True)
+            # bulk_create z ignore_conflicts nie mówi, które wiersze wstawił - nasze konta poznajemy
+            # po skrócie hasła (z losową solą, także dla kont bez hasła)
+            hashes_by_name = {u.username: u.password for u in users}
+            inserted = {
+                username: user_id
+                for username, user_id, password in (
+                    User.objects.filter(username__in=list(hashes_by_name)).values_list('username', 'id', 'password'))
+                if password == hashes_by_name[username]
+            }
+            # Profile i podsumowanie tylko dla wstawionych kont - pominięte duplikaty zachowują swój profil
+            UserProfile.objects.bulk_create(
+                [UserProfile(user_id=inserted[r['username']], role=r['role'],
+                             index=r.get('index', '')[:64], section=r.get('section', '')[:128])
+                 for r in records if r['username'] in inserted],
+                ignore_conflicts=True,
+            )
+        self.stats['created'] += len(inserted)
+        self.stats['existing'] += len(records) - len(inserted)
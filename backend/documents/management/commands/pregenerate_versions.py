@@ -0,0 +1,55 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from documents.archives import archive_name
+from documents.generation import current_versions, generate_versions
+from documents.models import Document, DocumentAssignment
+
+
+class Command(BaseCommand):
+    help = 'Wygeneruj z góry pliki DOCX dla wszystkich ukończonych przypisań dokumentu.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('document_id', type=int)
+        parser.add_argument('--force', action='store_true',
+                            help='Generuj także przypisania, które mają już aktualną wersję.')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Liczba procesów roboczych (domyślnie DOCUMENT_WORKER_PROCESSES).')
+
+    def handle(self, *args, **options):
+        try:
+            document = Document.objects.get(id=options['document_id'])
+        except Document.DoesNotExist:
+            raise CommandError(f"Dokument {options['document_id']} nie istnieje")
+
+        assignments = list(
+            DocumentAssignment.objects
+            .filter(document=document, status='completed')
+            .select_related('document', 'user')
+            .defer('document__original_content')
+            .order_by('user__username')
+        )
+        if not options['force']:
+            existing = current_versions(assignments)
+            assignments = [a for a in assignments if a.id not in existing]
+        if not assignments:
+            self.stdout.write('Brak przypisań do wygenerowania.')
+            return
+
+        started = time.perf_counter()
+        if options['workers']:
+            with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+                versions, errors = generate_versions(assignments, executor=executor, force=options['force'])
+        else:
+            versions, errors = generate_versions(assignments, force=options['force'])
+        elapsed = time.perf_counter() - started
+
+        for ass in assignments:
+            if ass.id in errors:
+                self.stderr.write(f"{archive_name(ass)}: {errors[ass.id]}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Wygenerowano {len(versions)} z {len(assignments)} wersji w {elapsed:.1f} s"
+            + (f", błędy: {len(errors)}" if errors else '')
+        ))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0003_processing_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='compiled_template',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
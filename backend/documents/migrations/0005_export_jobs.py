@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0004_document_compiled_template'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingjob',
+            name='cache_key',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='processingjob',
+            name='progress_done',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='processingjob',
+            name='progress_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='processingjob',
+            name='result_file',
+            field=models.FileField(blank=True, null=True, upload_to='exports/'),
+        ),
+        migrations.AlterField(
+            model_name='processingjob',
+            name='kind',
+            field=models.CharField(choices=[('convert', 'Konwersja DOCX -> HTML'), ('export', 'Eksport ukończonych przypisań (ZIP)')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0005_export_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentassignment',
+            name='revision',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:58
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def copy_field_values(apps, schema_editor):
+    """Przepisz istniejące wiersze FieldValue do DocumentAssignment.values."""
+    DocumentAssignment = apps.get_model('documents', 'DocumentAssignment')
+    FieldValue = apps.get_model('documents', 'FieldValue')
+    last_id = 0
+    while True:
+        batch = list(DocumentAssignment.objects.filter(id__gt=last_id)
+                     .order_by('id').values_list('id', flat=True)[:BATCH_SIZE])
+        if not batch:
+            return
+        last_id = batch[-1]
+        by_assignment = {}
+        for a_id, field_id, value in (FieldValue.objects
+                                      .filter(assignment_id__in=batch)
+                                      .values_list('assignment_id', 'field__field_id', 'value')):
+            by_assignment.setdefault(a_id, {})[field_id] = value
+        DocumentAssignment.objects.bulk_update(
+            [DocumentAssignment(id=a_id, values=vals) for a_id, vals in by_assignment.items()],
+            ['values'], batch_size=BATCH_SIZE,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0006_assignment_revision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentassignment',
+            name='values',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        # Wiersze FieldValue zostają - cofnięcie migracji usuwa tylko kolumnę
+        migrations.RunPython(copy_field_values, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0007_assignment_values'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentversion',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='documentversion',
+            name='error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='documentversion',
+            name='render_key',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='documentversion',
+            name='status',
+            field=models.CharField(choices=[('rendering', 'Generowanie'), ('ready', 'Gotowa'), ('failed', 'Błąd')], default='ready', max_length=10),
+        ),
+        migrations.AddConstraint(
+            model_name='documentversion',
+            constraint=models.UniqueConstraint(condition=models.Q(('render_key', ''), _negated=True), fields=('assignment', 'render_key'), name='unique_version_render_key'),
+        ),
+    ]
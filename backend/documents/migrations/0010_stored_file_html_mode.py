@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0009_stored_files'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedfile',
+            name='html_mode',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0010_stored_file_html_mode'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='storedfile',
+            name='html_mode',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
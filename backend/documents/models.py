@@ -24,6 +24,24 @@ class UserProfile(models.Model):
         return f"{self.user.username} ({self.role})"
 
 
+class StoredFile(models.Model):
+    """Plik źródłowy przechowywany raz na treść (adresowany skrótem SHA-256, patrz documents.blobs)"""
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='blobs/')
+    size = models.PositiveBigIntegerField(default=0)
+    # Liczba dokumentów korzystających z pliku - przy zerze plik jest usuwany
+    ref_count = models.PositiveIntegerField(default=0)
+    # Wynik konwersji mammoth dla tej treści (None - jeszcze nie skonwertowano) i jej tryb
+    # ('inline' - obrazy jako data URI, 'files:<skrót adresu>' - obrazy jako osobne pliki,
+    # patrz documents.jobs.html_cache_mode)
+    html = models.TextField(null=True, blank=True)
+    html_mode = models.CharField(max_length=32, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.ref_count})"
+
+
 class Document(models.Model):
     """Model dokumentu Word przesłanego przez administratora"""
     name = models.CharField(max_length=255)
@@ -31,6 +49,8 @@ class Document(models.Model):
         upload_to='documents/',
         validators=[FileExtensionValidator(allowed_extensions=['docx', 'doc'])]
     )
+    # Współdzielony plik treści; file wskazuje ten sam plik. Dokumenty sprzed deduplikacji mają własny plik.
+    blob = models.ForeignKey(StoredFile, on_delete=models.PROTECT, related_name='documents', null=True, blank=True)
     original_content = models.TextField(blank=True)  # Zawartość HTML z mammoth
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='created_documents')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -42,6 +62,17 @@ class Document(models.Model):
         ('completed', 'Ukończony'),
     ]
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='draft')
+
+    # Stan konwersji DOCX -> HTML (wykonywanej w tle, patrz documents.jobs)
+    PROCESSING_STATUS_CHOICES = [
+        ('processing', 'Przetwarzanie'),
+        ('ready', 'Gotowy'),
+        ('failed', 'Błąd przetwarzania'),
+    ]
+    processing_status = models.CharField(max_length=12, choices=PROCESSING_STATUS_CHOICES, default='ready')
+
+    # Skompilowany indeks szablonu (patrz documents.docx_template), przebudowywany przy zmianie pól
+    compiled_template = models.JSONField(null=True, blank=True, editable=False)
     
     def __str__(self):
         return self.name
@@ -93,6 +124,10 @@ class DocumentAssignment(models.Model):
     assigned_at = models.DateTimeField(auto_now_add=True)
     started_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
+    # Zwiększana przy każdym zapisie wartości - wykrywa równoległe zapisy (np. dwie karty)
+    revision = models.PositiveIntegerField(default=0)
+    # Wartości pól jako jeden dokument {field_id: wartość} (patrz documents.values)
+    values = models.JSONField(default=dict, blank=True)
     
     class Meta:
         unique_together = ['document', 'user']
@@ -122,8 +157,65 @@ class DocumentVersion(models.Model):
     assignment = models.ForeignKey(DocumentAssignment, on_delete=models.CASCADE, related_name='versions')
     content = models.TextField()  # HTML z wypełnionymi polami
     generated_file = models.FileField(upload_to='generated/', blank=True, null=True)
+
+    # Renderowanie jednej wersji naraz (patrz documents.generation.get_or_render_version):
+    # wiersz z kluczem renderowania jest rezerwowany przed renderowaniem, a pozostali
+    # wywołujący czekają na jego zakończenie zamiast renderować ten sam plik
+    STATUS_CHOICES = [
+        ('rendering', 'Generowanie'),
+        ('ready', 'Gotowa'),
+        ('failed', 'Błąd'),
+    ]
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='ready')
+    render_key = models.CharField(max_length=64, blank=True, default='')
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
     
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['assignment', 'render_key'],
+                condition=~models.Q(render_key=''),
+                name='unique_version_render_key',
+            ),
+        ]
     
     def __str__(self):
         return f"Wersja {self.assignment} - {self.created_at}"
+
+
+class ProcessingJob(models.Model):
+    """Model zadania wykonywanego w tle przez lokalną pulę procesów"""
+    KIND_CHOICES = [
+        ('convert', 'Konwersja DOCX -> HTML'),
+        ('export', 'Eksport ukończonych przypisań (ZIP)'),
+    ]
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+
+    STATUS_CHOICES = [
+        ('queued', 'W kolejce'),
+        ('running', 'W trakcie'),
+        ('done', 'Zakończone'),
+        ('failed', 'Błąd'),
+    ]
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='jobs', null=True, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='processing_jobs')
+    error = models.TextField(blank=True)
+
+    # Postęp i wynik (eksport ZIP); cache_key opisuje zakres danych - gotowe archiwum
+    # z tym samym kluczem jest wykorzystywane ponownie
+    progress_total = models.PositiveIntegerField(default=0)
+    progress_done = models.PositiveIntegerField(default=0)
+    result_file = models.FileField(upload_to='exports/', blank=True, null=True)
+    cache_key = models.CharField(max_length=64, blank=True, db_index=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.id} ({self.status})"
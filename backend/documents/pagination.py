@@ -0,0 +1,38 @@
+"""Stronicowanie list kursorem (keyset).
+
+Kolejna strona jest wyznaczana warunkiem na kolumnie sortowania (np. created_at < kursor),
+a nie przez OFFSET, więc koszt zapytania nie rośnie wraz z numerem strony.
+Odpowiedź ma postać {"next": url|null, "previous": url|null, "results": [...]}.
+"""
+from rest_framework.pagination import CursorPagination
+
+
+class _CursorPagination(CursorPagination):
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def paginate(self, queryset, request, serializer_class, **serializer_kwargs):
+        """Zwróć odpowiedź z jedną stroną querysetu zserializowaną podaną klasą."""
+        page = self.paginate_queryset(queryset, request)
+        serializer = serializer_class(page, many=True, **serializer_kwargs)
+        return self.get_paginated_response(serializer.data)
+
+
+class UserCursorPagination(_CursorPagination):
+    ordering = ('username', 'id')
+
+
+class DocumentCursorPagination(_CursorPagination):
+    ordering = ('-created_at', '-id')
+
+
+class AssignmentCursorPagination(_CursorPagination):
+    ordering = ('-assigned_at', '-id')
+
+
+class CompletedAssignmentCursorPagination(_CursorPagination):
+    ordering = ('-completed_at', '-id')
+
+
+class VersionCursorPagination(_CursorPagination):
+    ordering = ('-created_at', '-id')
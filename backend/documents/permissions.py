@@ -0,0 +1,74 @@
+"""Uprawnienia widoków oparte na roli i sekcji z profilu użytkownika.
+
+Rola i sekcja są trzymane w cache (CACHES['default']) pod kluczem z ID użytkownika,
+więc typowe żądanie nie wykonuje zapytania o UserProfile. Wpis jest usuwany przy
+każdym zapisie lub usunięciu profilu (sygnały w documents.apps), czyli także przez
+set_user_role i complete_profile. Przy cache lokalnym dla procesu (LocMemCache)
+pozostałe procesy widzą zmianę najpóźniej po PROFILE_CACHE_TIMEOUT sekundach.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import BasePermission
+
+from .models import UserProfile
+
+_NO_PROFILE = {'role': None, 'section': ''}
+
+
+def _cache_key(user_id: int, joined) -> str:
+    # Data utworzenia konta odróżnia nowego użytkownika, który dostał ID po usuniętym
+    return f'documents:profile:{user_id}:{joined.timestamp() if joined else ""}'
+
+
+def profile_info(user) -> dict:
+    """Rola i sekcja użytkownika: {'role': 'admin'|'user'|None, 'section': str}.
+    Wynik jest zapamiętywany na obiekcie użytkownika (na czas żądania) i w cache."""
+    info = getattr(user, '_profile_info', None)
+    if info is not None:
+        return info
+    if not getattr(user, 'is_authenticated', False):
+        return _NO_PROFILE
+    key = _cache_key(user.id, user.date_joined)
+    info = cache.get(key)
+    if info is None:
+        row = UserProfile.objects.filter(user_id=user.id).values('role', 'section').first()
+        info = {'role': row['role'], 'section': (row['section'] or '').strip()} if row else _NO_PROFILE
+        cache.set(key, info, getattr(settings, 'PROFILE_CACHE_TIMEOUT', 300))
+    user._profile_info = info
+    return info
+
+
+def invalidate_profile(user):
+    cache.delete(_cache_key(user.id, user.date_joined))
+    user.__dict__.pop('_profile_info', None)
+
+
+def is_admin(user) -> bool:
+    return profile_info(user)['role'] == 'admin'
+
+
+class IsDocumentAdmin(BasePermission):
+    """Administrator (rola 'admin' w profilu)."""
+    message = 'Brak uprawnień'
+
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_authenticated and is_admin(request.user))
+
+
+class IsSectionAdmin(IsDocumentAdmin):
+    """Administrator z ustawioną sekcją - zarządza tylko użytkownikami swojej sekcji."""
+
+    def has_permission(self, request, view):
+        if not super().has_permission(request, view):
+            return False
+        if not profile_info(request.user)['section']:
+            self.message = 'Administrator nie ma ustawionej sekcji w profilu.'
+            return False
+        return True
+
+
+class IsSuperuser(BasePermission):
+    message = 'Brak uprawnień'
+
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_authenticated and request.user.is_superuser)
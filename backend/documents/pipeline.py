@@ -1,6 +1,7 @@
 from typing import Any, Dict
 from django.contrib.auth.models import User
 from .models import UserProfile
+from .tokens import SESSION_KEY, issue_tokens, tokens_enabled
 
 
 def save_discord_profile(backend, user: User, response: Dict[str, Any], *args, **kwargs):
@@ -32,3 +33,12 @@ def save_discord_profile(backend, user: User, response: Dict[str, Any], *args, *
 
     profile.save()
     user.save()
+
+
+def issue_api_tokens(strategy, user: User = None, *args, **kwargs):
+    """Pipeline hook: przy włączonych tokenach API wydaj parę tokenów i zostaw ją w sesji.
+    SPA odbiera ją po zamknięciu okna logowania przez POST auth/token/ (jednorazowo).
+    """
+    if user is None or not tokens_enabled():
+        return
+    strategy.session_set(SESSION_KEY, issue_tokens(user))
@@ -1,9 +1,11 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
 from .models import (
     UserProfile, Document, EditableField, 
-    DocumentAssignment, FieldValue, DocumentVersion
+    DocumentAssignment, FieldValue, DocumentVersion, ProcessingJob
 )
+from .values import read_values, reads_json
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -57,6 +59,15 @@ class EditableFieldSerializer(serializers.ModelSerializer):
         ]
 
 
+def _absolute_image_urls(html: str, request) -> str:
+    """Względny adres obrazów (DOCUMENT_IMAGES_URL od "/") uzupełniony o adres serwera API -
+    frontend może działać pod innym adresem niż backend."""
+    url = getattr(settings, 'DOCUMENT_IMAGES_URL', '')
+    if not url.startswith('/') or url.startswith('//'):
+        return html
+    return html.replace(f'src="{url}', f'src="{request.build_absolute_uri(url)}')
+
+
 class DocumentSerializer(serializers.ModelSerializer):
     editable_fields = EditableFieldSerializer(many=True, read_only=True)
     created_by_username = serializers.CharField(source='created_by.username', read_only=True)
@@ -67,14 +78,32 @@ class DocumentSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'name', 'file', 'original_content', 'created_by', 
             'created_by_username', 'created_at', 'updated_at', 'status',
-            'editable_fields', 'assigned_users_count'
+            'processing_status', 'editable_fields', 'assigned_users_count'
         ]
-        read_only_fields = ['created_by', 'original_content']
+        read_only_fields = ['created_by', 'original_content', 'processing_status']
     
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        request = self.context.get('request')
+        if request is not None and data.get('original_content'):
+            data['original_content'] = _absolute_image_urls(data['original_content'], request)
+        return data
+
     def get_assigned_users_count(self, obj):
+        # Listy dokumentów dostarczają liczbę z adnotacji (bez zapytania na wiersz)
+        count = getattr(obj, 'assigned_users_count', None)
+        if count is not None:
+            return count
         return obj.assignments.count()
 
 
+class DocumentListSerializer(DocumentSerializer):
+    """Dokument na liście - bez treści HTML (pobierana osobno przez document_detail)."""
+
+    class Meta(DocumentSerializer.Meta):
+        fields = [f for f in DocumentSerializer.Meta.fields if f != 'original_content']
+
+
 class FieldValueSerializer(serializers.ModelSerializer):
     field_label = serializers.CharField(source='field.label', read_only=True)
     field_type = serializers.CharField(source='field.field_type', read_only=True)
@@ -90,20 +119,65 @@ class FieldValueSerializer(serializers.ModelSerializer):
 class DocumentAssignmentSerializer(serializers.ModelSerializer):
     document_name = serializers.CharField(source='document.name', read_only=True)
     user_username = serializers.CharField(source='user.username', read_only=True)
-    field_values = FieldValueSerializer(many=True, read_only=True)
+    field_values = serializers.SerializerMethodField()
     editable_fields = serializers.SerializerMethodField()
     
     class Meta:
         model = DocumentAssignment
         fields = [
             'id', 'document', 'document_name', 'user', 'user_username',
-            'status', 'assigned_at', 'started_at', 'completed_at',
+            'status', 'assigned_at', 'started_at', 'completed_at', 'revision',
             'field_values', 'editable_fields'
         ]
     
+    def get_field_values(self, obj):
+        if not reads_json():
+            return FieldValueSerializer(obj.field_values.all(), many=True).data
+        # Tryb JSON: wartości z DocumentAssignment.values w kształcie wierszy FieldValue
+        stored = obj.values or {}
+        return [
+            {
+                'id': None, 'field': f.id, 'field_label': f.label, 'field_type': f.field_type,
+                'value': stored[f.field_id], 'created_at': None, 'updated_at': None,
+            }
+            for f in obj.document.editable_fields.all() if f.field_id in stored
+        ]
+
     def get_editable_fields(self, obj):
-        fields = obj.document.editable_fields.all()
-        return EditableFieldSerializer(fields, many=True).data
+        # Pola są wspólne dla wszystkich przypisań dokumentu - serializujemy je raz na dokument
+        cache = self.context.setdefault('editable_fields_by_document', {})
+        if obj.document_id not in cache:
+            fields = obj.document.editable_fields.all()
+            cache[obj.document_id] = EditableFieldSerializer(fields, many=True).data
+        return cache[obj.document_id]
+
+
+class DocumentAssignmentListSerializer(serializers.ModelSerializer):
+    """Przypisanie na liście - bez wartości i definicji pól (pobierane osobno przez
+    assignment_detail), z liczbą pól i liczbą wypełnionych pól."""
+    document_name = serializers.CharField(source='document.name', read_only=True)
+    user_username = serializers.CharField(source='user.username', read_only=True)
+    fields_count = serializers.SerializerMethodField()
+    filled_fields_count = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DocumentAssignment
+        fields = [
+            'id', 'document', 'document_name', 'user', 'user_username',
+            'status', 'assigned_at', 'started_at', 'completed_at', 'revision',
+            'fields_count', 'filled_fields_count'
+        ]
+
+    def get_fields_count(self, obj):
+        return len(obj.document.editable_fields.all())
+
+    def get_filled_fields_count(self, obj):
+        # Tryb 'rows' - liczba z adnotacji; tryb JSON - z kolumny values i pól dokumentu
+        count = getattr(obj, 'filled_fields_count', None)
+        if count is not None:
+            return count
+        stored = read_values(obj)
+        return sum(1 for f in obj.document.editable_fields.all() if f.field_id in stored)
 
 
 class DocumentVersionSerializer(serializers.ModelSerializer):
@@ -112,7 +186,7 @@ class DocumentVersionSerializer(serializers.ModelSerializer):
     class Meta:
         model = DocumentVersion
         fields = [
-            'id', 'assignment', 'assignment_info', 'content', 
+            'id', 'assignment', 'assignment_info', 'content', 'status',
             'generated_file', 'created_at'
         ]
     
@@ -124,6 +198,37 @@ class DocumentVersionSerializer(serializers.ModelSerializer):
         }
 
 
+class DocumentVersionListSerializer(DocumentVersionSerializer):
+    """Wersja na liście - bez treści HTML (pobierana osobno przez version_detail)."""
+
+    class Meta(DocumentVersionSerializer.Meta):
+        fields = ['id', 'assignment', 'assignment_info', 'status', 'generated_file', 'created_at']
+
+
+class ProcessingJobSerializer(serializers.ModelSerializer):
+    queue_seconds = serializers.SerializerMethodField()
+    run_seconds = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ProcessingJob
+        fields = [
+            'id', 'kind', 'status', 'document', 'error',
+            'progress_total', 'progress_done',
+            'created_at', 'started_at', 'finished_at',
+            'queue_seconds', 'run_seconds'
+        ]
+
+    def get_queue_seconds(self, obj):
+        if not obj.started_at:
+            return None
+        return round((obj.started_at - obj.created_at).total_seconds(), 3)
+
+    def get_run_seconds(self, obj):
+        if not obj.started_at or not obj.finished_at:
+            return None
+        return round((obj.finished_at - obj.started_at).total_seconds(), 3)
+
+
 class LoginSerializer(serializers.Serializer):
     username = serializers.CharField()
     password = serializers.CharField()
@@ -151,15 +256,31 @@ class FieldCreationSerializer(serializers.Serializer):
 
 
 class AssignDocumentSerializer(serializers.Serializer):
+    TARGETS = [('users', 'Wybrani użytkownicy'), ('section', 'Cała sekcja')]
+
     document_id = serializers.IntegerField()
+    target = serializers.ChoiceField(choices=TARGETS, default='users')
     user_ids = serializers.ListField(
         child=serializers.IntegerField(),
-        allow_empty=False
+        required=False,
+        default=list
     )
 
+    def validate(self, attrs):
+        if attrs['target'] == 'users' and not attrs['user_ids']:
+            raise serializers.ValidationError({'user_ids': 'Wybierz przynajmniej jednego użytkownika.'})
+        return attrs
+
 
 class SubmitFieldValuesSerializer(serializers.Serializer):
     assignment_id = serializers.IntegerField()
     field_values = serializers.DictField(
         child=serializers.CharField(allow_blank=True)
     )
+
+
+class PatchFieldValuesSerializer(serializers.Serializer):
+    revision = serializers.IntegerField(min_value=0)
+    values = serializers.DictField(
+        child=serializers.CharField(allow_blank=True)
+    )
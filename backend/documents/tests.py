@@ -1,3 +1,1195 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import struct
+import tempfile
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from docx import Document as DocxDocument
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import F
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .permissions import profile_info
+from .generation import RENDER_STALE_AFTER, claim_version, current_versions, render_inputs
+from . import archives, docx_template, docx_zip, exports, generation, jobs, tokens, views, workers
+from .models import (
+    UserProfile, Document, EditableField, DocumentAssignment, DocumentVersion, FieldValue, ProcessingJob, StoredFile,
+)
+from .values import backfill_json, read_values, write_values
+
+
+class DocumentTestCase(TestCase):
+    """Wspólne dane testów: użytkownicy z profilami, dokumenty z polami i przypisania."""
+
+    def make_user(self, username, role=None, section='', **profile):
+        """Użytkownik; z rolą - także z profilem (rola i sekcja)."""
+        user = User.objects.create_user(username)
+        if role:
+            UserProfile.objects.create(user=user, role=role, section=section, **profile)
+        return user
+
+    def make_document(self, created_by, fields=0, name='doc.docx', **kwargs):
+        """Dokument z polami f0..f{fields-1} (etykiety 'Pole i'); dostępne w self.fields."""
+        document = Document.objects.create(name=name, file=kwargs.pop('file', 'documents/doc.docx'),
+                                           created_by=created_by, **kwargs)
+        self.fields = [EditableField.objects.create(document=document, field_id=f'f{i}', label=f'Pole {i}')
+                       for i in range(fields)]
+        return document
+
+    def make_assignment(self, document, user, **kwargs):
+        return DocumentAssignment.objects.create(document=document, user=user, **kwargs)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def use_media_root(self, **overrides):
+        """Tymczasowy MEDIA_ROOT (usuwany po teście) i dodatkowe ustawienia na czas testu."""
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media, **overrides)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+
+class AdminDocumentsQueryTests(DocumentTestCase):
+    """Lista dokumentów admina wykonuje stałą liczbę zapytań niezależnie od liczby dokumentów."""
+
+    def setUp(self):
+        self.admin = self.make_user('admin_q', role='admin')
+        self.users = [self.make_user(f'user_q{i}') for i in range(3)]
+        self.client = self.client_for(self.admin)
+
+    def _create_documents(self, count):
+        for i in range(count):
+            doc = self.make_document(self.admin, fields=2, name=f'doc{i}.docx',
+                                     original_content='<p>' + 'x' * 1000 + '</p>')
+            for user in self.users:
+                self.make_assignment(doc, user)
+
+    def _list_queries(self):
+        # Odśwież użytkownika, żeby każde żądanie zaczynało w tym samym stanie; rola admina
+        # jest już w cache (documents.permissions), więc zostają dokumenty i ich pola
+        self.admin = User.objects.get(id=self.admin.id)
+        profile_info(self.admin)
+        self.admin = User.objects.get(id=self.admin.id)
+        self.client.force_authenticate(self.admin)
+        with self.assertNumQueries(2) as ctx:
+            response = self.client.get('/api/documents/admin/')
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx.captured_queries)
+
+    def test_query_count_does_not_depend_on_document_count(self):
+        self._create_documents(1)
+        _, few = self._list_queries()
+        self._create_documents(10)
+        response, many = self._list_queries()
+        self.assertEqual(few, many)
+        self.assertEqual(len(response.data['results']), 11)
+
+    def test_list_contains_counts_without_html(self):
+        self._create_documents(2)
+        response, _ = self._list_queries()
+        item = response.data['results'][0]
+        self.assertNotIn('original_content', item)
+        self.assertEqual(item['assigned_users_count'], 3)
+        self.assertEqual(len(item['editable_fields']), 2)
+        self.assertEqual(item['created_by_username'], 'admin_q')
+
+    def test_detail_returns_html(self):
+        self._create_documents(1)
+        doc = Document.objects.get()
+        response = self.client.get(f'/api/documents/{doc.id}/detail/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['original_content'].startswith('<p>'))
+        self.assertEqual(response.data['assigned_users_count'], 3)
+
+
+@override_settings(DOCUMENT_VALUE_STORAGE='rows')
+class AssignmentListQueryTests(DocumentTestCase):
+    """Listy przypisań wykonują stałą liczbę zapytań niezależnie od liczby przypisań."""
+
+    def setUp(self):
+        self.admin = self.make_user('admin_a', role='admin')
+        profile_info(self.admin)  # rola w cache - liczymy tylko zapytania listy
+        self.client = APIClient()
+
+    def _create_completed(self, docs, users):
+        for i in range(docs):
+            doc = self.make_document(self.admin, fields=2, name=f'doc{i}.docx')
+            for u in range(users):
+                user = self.make_user(f'u{docs}_{i}_{u}')
+                ass = self.make_assignment(doc, user, status='completed', completed_at=timezone.now())
+                for field in self.fields:
+                    FieldValue.objects.create(assignment=ass, field=field, value='v')
+
+    def _completed_queries(self, url='/api/assignments/completed/?page_size=50'):
+        self.client.force_authenticate(User.objects.get(id=self.admin.id))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self._last_queries = ' '.join(q['sql'] for q in ctx.captured_queries)
+        return response, len(ctx.captured_queries)
+
+    def test_completed_assignments_query_count_is_constant(self):
+        self._create_completed(1, 1)
+        _, few = self._completed_queries()
+        self._create_completed(3, 4)
+        response, many = self._completed_queries()
+        self.assertEqual(few, many)
+        self.assertLessEqual(many, 5)
+        self.assertEqual(len(response.data['results']), 13)
+        item = response.data['results'][0]
+        self.assertEqual((item['fields_count'], item['filled_fields_count']), (2, 2))
+        self.assertNotIn('field_values', item)
+        # Lista nie pobiera treści dokumentu ani wartości pól
+        self.assertNotIn('original_content', self._last_queries)
+        self.assertNotIn('"value"', self._last_queries)
+
+    def test_assignment_detail_has_fields_and_values(self):
+        self._create_completed(1, 1)
+        assignment = DocumentAssignment.objects.get()
+        self.client.force_authenticate(assignment.user)
+        response = self.client.get(f'/api/assignments/{assignment.id}/detail/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['editable_fields']), 2)
+        self.assertEqual(response.data['field_values'][0]['field_label'], 'Pole 0')
+        self.client.force_authenticate(self.make_user('obcy'))
+        self.assertEqual(self.client.get(f'/api/assignments/{assignment.id}/detail/').status_code, 403)
+
+    def test_completed_assignments_cursor_pages(self):
+        self._create_completed(3, 4)
+        seen = []
+        url = '/api/assignments/completed/?page_size=5'
+        while url:
+            response, _ = self._completed_queries(url)
+            self.assertLessEqual(len(response.data['results']), 5)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(len(seen), 12)
+        self.assertEqual(len(set(seen)), 12)
+
+
+@override_settings(DOCUMENT_VALUE_STORAGE='rows')
+class SubmitFieldValuesTests(DocumentTestCase):
+    """Zapis wartości pól jednym upsertem niezależnie od liczby pól."""
+
+    def setUp(self):
+        self.user = self.make_user('user_s')
+        self.document = self.make_document(self.make_user('admin_s'), fields=60)
+        self.assignment = self.make_assignment(self.document, self.user)
+        self.client = self.client_for(self.user)
+
+    def _submit(self, values):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/assignments/submit-values/', {
+                'assignment_id': self.assignment.id, 'field_values': values,
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx.captured_queries)
+
+    def test_insert_then_update_with_constant_queries(self):
+        _, few = self._submit({'f0': 'a'})
+        response, many = self._submit({f'f{i}': f'v{i}' for i in range(60)})
+        self.assertEqual(few, many)
+        self.assertEqual(response.data['saved'], 60)
+        self.assertEqual(FieldValue.objects.filter(assignment=self.assignment).count(), 60)
+        self.assertEqual(FieldValue.objects.get(assignment=self.assignment, field__field_id='f0').value, 'v0')
+        self.assignment.refresh_from_db()
+        self.assertEqual(self.assignment.status, 'in_progress')
+        self.assertIsNotNone(self.assignment.started_at)
+
+    def test_unknown_field_ids_are_reported(self):
+        response, _ = self._submit({'f1': 'x', 'missing': 'y'})
+        self.assertEqual(response.data['saved'], 1)
+        self.assertEqual(response.data['unknown_field_ids'], ['missing'])
+
+    def test_revision_update_takes_the_lock_before_json_merge(self):
+        with override_settings(DOCUMENT_VALUE_STORAGE='json'):
+            self._submit({'f0': 'a'})
+            with CaptureQueriesContext(connection) as ctx:
+                self._submit({'f1': 'b'})
+            values = read_values(DocumentAssignment.objects.get(id=self.assignment.id))
+        self.assertEqual(values, {'f0': 'a', 'f1': 'b'})
+        sql = [q['sql'] for q in ctx.captured_queries]
+        bump = next(i for i, q in enumerate(sql) if q.startswith('UPDATE') and '"revision"' in q)
+        # Odczyt samego dokumentu JSON do scalenia (nie pełnego przypisania z rewizją)
+        merge = next(i for i, q in enumerate(sql) if q.startswith('SELECT') and '"values"' in q
+                     and '"revision"' not in q)
+        self.assertLess(bump, merge)
+
+    def test_revision_comes_from_the_update(self):
+        after_save_changes = views._after_save_changes
+
+        def concurrent_save():
+            # Inny zapis tego przypisania między odczytem a naszym UPDATE
+            DocumentAssignment.objects.filter(id=self.assignment.id).update(revision=F('revision') + 1)
+            return after_save_changes()
+
+        with mock.patch('documents.views._after_save_changes', concurrent_save):
+            response, _ = self._submit({'f0': 'a'})
+        self.assignment.refresh_from_db()
+        self.assertEqual(self.assignment.revision, 2)
+        self.assertEqual(response.data['revision'], 2)
+
+
+class AssignDocumentTests(DocumentTestCase):
+    """Przypisywanie dokumentu zbiorczo: wskazani użytkownicy albo cała sekcja."""
+
+    def setUp(self):
+        self.admin = self.make_user('admin_b', role='admin', section='A')
+        self.document = self.make_document(self.admin, fields=1)
+        self.section = [self.make_user(f'sec_a{i}', role='user', section='A') for i in range(30)]
+        self.outsider = self.make_user('sec_b', role='user', section='B')
+        profile_info(self.admin)  # rola i sekcja w cache - liczymy tylko zapytania przypisania
+        self.client = self.client_for(self.admin)
+
+    def _assign(self, payload):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/documents/assign/', {'document_id': self.document.id, **payload}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx.captured_queries)
+
+    def test_selected_users_skip_other_sections(self):
+        ids = [u.id for u in self.section[:5]] + [self.outsider.id, self.admin.id]
+        response, _ = self._assign({'user_ids': ids})
+        self.assertEqual(response.data['created'], 6)
+        self.assertEqual(response.data['invalid_user_ids'], [self.outsider.id])
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.status, 'sent')
+
+    def test_whole_section_with_constant_queries(self):
+        _, few = self._assign({'user_ids': [self.section[0].id]})
+        response, many = self._assign({'target': 'section'})
+        self.assertEqual(few, many)
+        self.assertEqual(response.data['created'], 29)
+        self.assertEqual(response.data['already_assigned'], 1)
+        self.assertFalse(DocumentAssignment.objects.filter(user=self.outsider).exists())
+
+    def test_sections_match_ignoring_surrounding_whitespace(self):
+        padded = self.make_user('sec_pad', role='user', section='  A ')
+        response, _ = self._assign({'target': 'section'})
+        self.assertEqual(response.data['created'], 31)
+        self.assertTrue(DocumentAssignment.objects.filter(document=self.document, user=padded).exists())
+        other = self.make_document(self.admin, fields=1, name='inny.docx')
+        response = self.client.post('/api/documents/assign/', {'document_id': other.id, 'user_ids': [padded.id]},
+                                    format='json')
+        self.assertEqual((response.data['created'], response.data['invalid_user_ids']), (1, []))
+
+
+@override_settings(DOCUMENT_VALUE_STORAGE='rows')
+class PatchFieldValuesTests(DocumentTestCase):
+    """Autosave zmienionych pól z kontrolą rewizji przypisania."""
+
+    def setUp(self):
+        self.user = self.make_user('user_p')
+        document = self.make_document(self.make_user('admin_p'), fields=3)
+        self.assignment = self.make_assignment(document, self.user)
+        self.client = self.client_for(self.user)
+        self.url = f'/api/assignments/{self.assignment.id}/values/'
+
+    def test_patch_writes_changed_field_and_bumps_revision(self):
+        response = self.client.patch(self.url, {'revision': 0, 'values': {'f1': 'a'}}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'revision': 1, 'saved': 1})
+        response = self.client.patch(self.url, {'revision': 1, 'values': {'f1': 'b'}}, format='json')
+        self.assertEqual(response.data['revision'], 2)
+        self.assertEqual(FieldValue.objects.get(assignment=self.assignment).value, 'b')
+        self.assignment.refresh_from_db()
+        self.assertEqual((self.assignment.revision, self.assignment.status), (2, 'in_progress'))
+
+    def test_stale_revision_is_a_conflict(self):
+        self.client.patch(self.url, {'revision': 0, 'values': {'f0': 'first tab'}}, format='json')
+        response = self.client.patch(self.url, {'revision': 0, 'values': {'f0': 'second tab'}}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['revision'], 1)
+        self.assertEqual(FieldValue.objects.get(assignment=self.assignment).value, 'first tab')
+
+
+class ValueStorageTests(DocumentTestCase):
+    """Wartości pól w DocumentAssignment.values (DOCUMENT_VALUE_STORAGE=both/json)."""
+
+    def setUp(self):
+        self.user = self.make_user('user_j')
+        document = self.make_document(self.make_user('admin_j'), fields=3)
+        self.assignment = self.make_assignment(document, self.user)
+        self.client = self.client_for(self.user)
+
+    def _patch(self, revision, values):
+        return self.client.patch(f'/api/assignments/{self.assignment.id}/values/',
+                                 {'revision': revision, 'values': values}, format='json')
+
+    @override_settings(DOCUMENT_VALUE_STORAGE='json')
+    def test_json_mode_writes_no_rows(self):
+        self._patch(0, {'f0': 'a', 'f1': 'b'})
+        self._patch(1, {'f1': 'c'})
+        self.assignment.refresh_from_db()
+        self.assertEqual(self.assignment.values, {'f0': 'a', 'f1': 'c'})
+        self.assertFalse(FieldValue.objects.exists())
+        response = self.client.get('/api/assignments/user/')
+        self.assertEqual(response.data['results'][0]['filled_fields_count'], 2)
+        response = self.client.get(f'/api/assignments/{self.assignment.id}/detail/')
+        values = {fv['field']: fv['value'] for fv in response.data['field_values']}
+        self.assertEqual(values, {self.fields[0].id: 'a', self.fields[1].id: 'c'})
+
+    @override_settings(DOCUMENT_VALUE_STORAGE='both')
+    def test_both_mode_keeps_rows_and_json_in_step(self):
+        self._patch(0, {'f2': 'x'})
+        self.assignment.refresh_from_db()
+        self.assertEqual(self.assignment.values, {'f2': 'x'})
+        self.assertEqual(FieldValue.objects.get(assignment=self.assignment).value, 'x')
+        self.assertEqual(read_values(self.assignment), {'f2': 'x'})
+
+    def test_backfill_copies_rows(self):
+        FieldValue.objects.create(assignment=self.assignment, field=self.fields[0], value='v')
+        self.assertEqual(backfill_json(), 1)
+        self.assignment.refresh_from_db()
+        self.assertEqual(self.assignment.values, {'f0': 'v'})
+
+
+class CompleteAssignmentTests(DocumentTestCase):
+    """Ukończenie przypisania: jeden warunkowy UPDATE, generowanie DOCX po zatwierdzeniu."""
+
+    def setUp(self):
+        self.user = self.make_user('user_c')
+        self.document = self.make_document(self.make_user('admin_c'), fields=2)
+        self.assignment = self.make_assignment(self.document, self.user)
+        self.client = self.client_for(self.user)
+        self.url = f'/api/assignments/{self.assignment.id}/complete/'
+
+    def _fill(self, values):
+        response = self.client.post('/api/assignments/submit-values/', {
+            'assignment_id': self.assignment.id, 'field_values': values,
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_incomplete_assignment_is_rejected(self):
+        self._fill({'f0': 'a'})
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 400)
+        self.assignment.refresh_from_db()
+        self.assertNotEqual(self.assignment.status, 'completed')
+
+    def test_complete_schedules_generation_after_commit(self):
+        self._fill({'f0': 'a', 'f1': 'b'})
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(callbacks), 1)
+        self.assignment.refresh_from_db()
+        self.assertEqual(self.assignment.status, 'completed')
+        self.assertIsNotNone(self.assignment.completed_at)
+        # Ponowne wysłanie nie zmienia stanu ani nie zleca kolejnego renderowania
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(callbacks), 0)
+
+    def test_values_of_deleted_fields_do_not_count(self):
+        self._fill({'f0': 'a', 'f1': 'b'})
+        EditableField.objects.create(document=self.document, field_id='f2', label='Pole 2')
+        self.assertEqual(self.client.post(self.url).status_code, 400)
+        self._fill({'f2': 'c'})
+        self.fields[0].delete()
+        self.assertEqual(self.client.post(self.url).status_code, 200)
+
+    @override_settings(DOCUMENT_VALUE_STORAGE='json')
+    def test_complete_in_json_mode(self):
+        self._fill({'f0': 'a'})
+        self.assertEqual(self.client.post(self.url).status_code, 400)
+        self._fill({'f1': 'b'})
+        self.assertEqual(self.client.post(self.url).status_code, 200)
+
+
+class RenderClaimTests(DocumentTestCase):
+    """Rezerwacja renderowania wersji: jeden renderujący na odcisk przypisania."""
+
+    def setUp(self):
+        user = self.make_user('user_r')
+        self.assignment = self.make_assignment(self.make_document(user), user)
+        self.key = 'k' * 64
+
+    def test_second_claim_waits_for_the_first(self):
+        first, owned = claim_version(self.assignment, self.key)
+        self.assertTrue(owned)
+        second, owned = claim_version(self.assignment, self.key)
+        self.assertFalse(owned)
+        self.assertEqual((second.id, second.status), (first.id, 'rendering'))
+
+    def test_stale_or_failed_claim_is_taken_over(self):
+        version, _ = claim_version(self.assignment, self.key)
+        DocumentVersion.objects.filter(id=version.id).update(
+            claimed_at=timezone.now() - RENDER_STALE_AFTER - timedelta(seconds=1))
+        again, owned = claim_version(self.assignment, self.key)
+        self.assertTrue(owned)
+        self.assertEqual(again.id, version.id)
+        DocumentVersion.objects.filter(id=version.id).update(status='failed')
+        self.assertTrue(claim_version(self.assignment, self.key)[1])
+
+    def test_new_key_gets_its_own_version(self):
+        first, _ = claim_version(self.assignment, self.key)
+        DocumentVersion.objects.filter(id=first.id).update(status='ready')
+        self.assertFalse(claim_version(self.assignment, self.key)[1])
+        second, owned = claim_version(self.assignment, 'n' * 64)
+        self.assertTrue(owned)
+        self.assertNotEqual(second.id, first.id)
+
+
+@override_settings(DOCUMENT_VALUE_STORAGE='rows')
+class VersionFingerprintTests(DocumentTestCase):
+    """Odcisk wersji zmienia się tylko ze zmianą wejścia renderowania."""
+
+    def setUp(self):
+        user = self.make_user('user_fp')
+        self.document = self.make_document(user, fields=1)
+        self.field = self.fields[0]
+        self.assignment = self.make_assignment(self.document, user)
+        FieldValue.objects.create(assignment=self.assignment, field=self.field, value='a')
+
+    def _key(self):
+        return render_inputs(DocumentAssignment.objects.get(id=self.assignment.id))[2]
+
+    def test_fingerprint_follows_inputs(self):
+        key = self._key()
+        self.assertEqual(self._key(), key)
+        # Sama zmiana rewizji (zapis bez zmian) nie wymusza renderowania
+        DocumentAssignment.objects.filter(id=self.assignment.id).update(revision=5)
+        self.assertEqual(self._key(), key)
+        FieldValue.objects.filter(assignment=self.assignment).update(value='b')
+        changed = self._key()
+        self.assertNotEqual(changed, key)
+        EditableField.objects.filter(id=self.field.id).update(original_value='inny tekst')
+        self.assertNotEqual(self._key(), changed)
+
+    def test_fingerprint_follows_source_content(self):
+        blob = StoredFile.objects.create(sha256='a' * 64, file='blobs/aa/a.docx', size=10)
+        Document.objects.filter(id=self.document.id).update(blob=blob)
+        key = self._key()
+        # Ta sama nazwa pliku, inna treść
+        StoredFile.objects.filter(id=blob.id).update(sha256='b' * 64)
+        self.assertNotEqual(self._key(), key)
+
+    def test_export_cache_key_follows_fields(self):
+        DocumentAssignment.objects.filter(id=self.assignment.id).update(status='completed', completed_at=timezone.now())
+        owner = self.document.created_by
+        key = exports.export_cache_key(owner, self.document)
+        self.assertEqual(exports.export_cache_key(owner, self.document), key)
+        field = EditableField.objects.create(document=self.document, field_id='f1', label='Nowe')
+        with_field = exports.export_cache_key(owner, self.document)
+        self.assertNotEqual(with_field, key)
+        field.delete()
+        self.assertEqual(exports.export_cache_key(owner, self.document), key)
+
+    def test_only_matching_version_is_current(self):
+        DocumentVersion.objects.create(assignment=self.assignment, generated_file='generated/x.docx',
+                                       render_key=self._key())
+        self.assertIn(self.assignment.id, current_versions([self.assignment]))
+        FieldValue.objects.filter(assignment=self.assignment).update(value='b')
+        self.assertEqual(current_versions([DocumentAssignment.objects.get(id=self.assignment.id)]), {})
+
+
+def _docx_bytes(text):
+    doc = DocxDocument()
+    doc.add_paragraph(text)
+    buf = io.BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+
+class StoredFileTests(DocumentTestCase):
+    """Identyczne pliki są zapisywane i konwertowane raz; plik znika z ostatnim dokumentem."""
+
+    def setUp(self):
+        self.use_media_root(DOCUMENT_JOBS_EAGER=True)
+        self.admin = self.make_user('admin_b', role='admin')
+        self.client = self.client_for(self.admin)
+        self.data = _docx_bytes('Wniosek')
+
+    def _upload(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/documents/upload/',
+                                        {'file': SimpleUploadedFile(name, self.data)}, format='multipart')
+        self.assertEqual(response.status_code, 202)
+        return Document.objects.get(id=response.data['id'])
+
+    def test_same_bytes_are_stored_and_converted_once(self):
+        convert = mock.Mock(wraps=workers.convert_docx_to_html)
+        with mock.patch.object(workers, 'convert_docx_to_html', convert):
+            first = self._upload('a.docx')
+            second = self._upload('kopia.docx')
+        self.assertEqual(convert.call_count, 1)
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertIn('Wniosek', second.original_content)
+        blob = StoredFile.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        path = blob.file.path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/documents/{first.id}/')
+        self.assertTrue(StoredFile.objects.filter(id=blob.id, ref_count=1).exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/documents/{second.id}/')
+        self.assertFalse(StoredFile.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+    def _post(self, data):
+        return self.client.post('/api/documents/upload/',
+                                {'file': SimpleUploadedFile('a.docx', data)}, format='multipart')
+
+    def _with_compression(self, method):
+        """Archiwum, w którym [Content_Types].xml jest zapisany bez kompresji, ale w nagłówkach
+        ma wpisaną inną metodę (8 - deflate: uszkodzony strumień, 99 - nieobsługiwana)."""
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w') as zf:
+            zf.writestr('[Content_Types].xml', '<Types><Override ContentType="x"/></Types>')
+            zf.writestr('word/document.xml', '<w:document/>')
+        data = bytearray(buf.getvalue())
+        struct.pack_into('<H', data, 8, method)
+        struct.pack_into('<H', data, data.index(b'PK\x01\x02') + 10, method)
+        return bytes(data)
+
+    def test_undecodable_content_types_are_rejected(self):
+        for method in (8, 99):
+            with self.subTest(method=method):
+                response = self._post(self._with_compression(method))
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('archiwum DOCX', response.data['error'])
+        self.assertFalse(StoredFile.objects.exists())
+
+    def test_invalid_archives_are_rejected_before_storing(self):
+        self.assertEqual(self._post(b'to nie jest zip').status_code, 400)
+
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w') as zf:
+            zf.writestr('[Content_Types].xml', '<Types><Override ContentType="application/vnd.ms-excel"/></Types>')
+            zf.writestr('word/document.xml', '<w:document/>')
+        response = self._post(buf.getvalue())
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('typ zawartości', response.data['error'])
+
+        with override_settings(DOCUMENT_MAX_UNCOMPRESSED_SIZE=1024):
+            response = self._post(self.data)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('limit', response.data['error'])
+        self.assertFalse(StoredFile.objects.exists())
+
+
+class ConversionJobTests(DocumentTestCase):
+    """Konwersja DOCX -> HTML jako zadanie (DOCUMENT_JOBS_EAGER) i przejmowanie porzuconych zadań."""
+
+    def setUp(self):
+        self.use_media_root(DOCUMENT_JOBS_EAGER=True)
+        self.admin = self.make_user('admin_k', role='admin')
+        self.client = self.client_for(self.admin)
+
+    def _upload(self, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/documents/upload/',
+                                        {'file': SimpleUploadedFile('a.docx', data)}, format='multipart')
+        self.assertEqual(response.status_code, 202)
+        return response.data['id'], response.data['job']['id']
+
+    def _job(self, job_id):
+        response = self.client.get(f'/api/jobs/{job_id}/')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_successful_conversion(self):
+        document_id, job_id = self._upload(_docx_bytes('Zaświadczenie'))
+        self.assertEqual(self._job(job_id)['status'], 'done')
+        document = Document.objects.get(id=document_id)
+        self.assertEqual(document.processing_status, 'ready')
+        self.assertIn('Zaświadczenie', document.original_content)
+        self.assertIn('Zaświadczenie', StoredFile.objects.get().html)
+
+    def test_failed_conversion_marks_job_and_document(self):
+        with mock.patch.object(workers, 'convert_docx_to_html', side_effect=RuntimeError('uszkodzony plik')):
+            document_id, job_id = self._upload(_docx_bytes('Wniosek'))
+        job = self._job(job_id)
+        self.assertEqual(job['status'], 'failed')
+        self.assertIn('uszkodzony plik', job['error'])
+        self.assertEqual(Document.objects.get(id=document_id).processing_status, 'failed')
+        self.assertIsNone(StoredFile.objects.get().html)
+
+    def test_cached_html_finishes_job_immediately(self):
+        data = _docx_bytes('Wniosek')
+        self._upload(data)
+        with mock.patch.object(workers, 'convert_docx_to_html') as convert, \
+                self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/api/documents/upload/',
+                                        {'file': SimpleUploadedFile('b.docx', data)}, format='multipart')
+        convert.assert_not_called()
+        self.assertEqual(callbacks, [])
+        self.assertEqual(response.data['job']['status'], 'done')
+        self.assertEqual(response.data['processing_status'], 'ready')
+
+    def _stuck_job(self, age):
+        document = self.make_document(self.admin, processing_status='processing')
+        job = ProcessingJob.objects.create(kind='convert', document=document, created_by=self.admin, status='running')
+        ProcessingJob.objects.filter(id=job.id).update(created_at=timezone.now() - age)
+        return document, job
+
+    def test_stale_job_is_reported_failed_and_taken_over(self):
+        stale_age = jobs.JOB_STALE_AFTER['convert'] + timedelta(minutes=1)
+        document, job = self._stuck_job(stale_age)
+        data = self._job(job.id)
+        self.assertEqual(data['status'], 'failed')
+        self.assertEqual(data['error'], jobs.STALE_ERROR)
+        document.refresh_from_db()
+        self.assertEqual(document.processing_status, 'failed')
+
+        # Spóźniony wynik porzuconego zadania niczego już nie zmienia
+        jobs._finish_conversion(job.id, result={'html': '<p>stare</p>'})
+        document.refresh_from_db()
+        self.assertEqual((document.processing_status, document.original_content), ('failed', ''))
+
+    def test_reprocess_reuses_active_job_and_replaces_stale_one(self):
+        document, job = self._stuck_job(timedelta(minutes=1))
+        with mock.patch.object(jobs, '_dispatch_conversion') as dispatch:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(f'/api/documents/{document.id}/reprocess/')
+            self.assertEqual(response.data['job']['id'], job.id)
+            dispatch.assert_not_called()
+
+            ProcessingJob.objects.filter(id=job.id).update(
+                created_at=timezone.now() - jobs.JOB_STALE_AFTER['convert'] - timedelta(minutes=1))
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(f'/api/documents/{document.id}/reprocess/')
+        self.assertNotEqual(response.data['job']['id'], job.id)
+        dispatch.assert_called_once_with(response.data['job']['id'])
+        self.assertEqual(ProcessingJob.objects.get(id=job.id).status, 'failed')
+        self.assertEqual(Document.objects.get(id=document.id).processing_status, 'processing')
+
+
+def _png_1x1():
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 1, 1, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(b'\x00\xff\x00\x00')) + chunk(b'IEND', b''))
+
+
+@override_settings(DOCUMENT_EXTRACT_IMAGES=True, DOCUMENT_IMAGES_URL='/api/documents/images/',
+                   DOCUMENT_JOBS_EAGER=True)
+class ExtractedImageTests(DocumentTestCase):
+    """Obrazy z konwersji trafiają do osobnych plików zamiast base64 w HTML."""
+
+    def setUp(self):
+        self.use_media_root()
+        self.client = self.client_for(self.make_user('admin_i', role='admin'))
+        # Jedne bajty na test - zapis python-docx zawiera znacznik czasu
+        doc = DocxDocument()
+        doc.add_picture(io.BytesIO(_png_1x1()))
+        buf = io.BytesIO()
+        doc.save(buf)
+        self.data = buf.getvalue()
+
+    def _upload_picture(self, name='a.docx'):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/documents/upload/',
+                                        {'file': SimpleUploadedFile(name, self.data)}, format='multipart')
+        return response.data['id']
+
+    def test_image_is_served_by_url_with_cache_headers(self):
+        html = Document.objects.get(id=self._upload_picture()).original_content
+        self.assertNotIn('base64', html)
+        src = html.split('src="')[1].split('"')[0]
+        self.assertRegex(src, r'^/api/documents/images/[0-9a-f]{64}\.png$')
+
+        response = APIClient().get(src)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(b''.join(response.streaming_content), _png_1x1())
+        self.assertEqual(APIClient().get('/api/documents/images/../settings.py').status_code, 404)
+
+    def test_api_returns_absolute_image_urls(self):
+        document_id = self._upload_picture()
+        html = self.client.get(f'/api/documents/{document_id}/detail/').data['original_content']
+        self.assertIn('src="http://testserver/api/documents/images/', html)
+        # W bazie (i w cache treści) adres pozostaje względny
+        self.assertIn('src="/api/documents/images/', Document.objects.get(id=document_id).original_content)
+
+    def test_changed_images_url_converts_again(self):
+        self._upload_picture()
+        convert = mock.Mock(wraps=workers.convert_docx_to_html)
+        with mock.patch.object(workers, 'convert_docx_to_html', convert):
+            self._upload_picture('kopia.docx')
+            self.assertEqual(convert.call_count, 0)
+            with override_settings(DOCUMENT_IMAGES_URL='https://cdn.example.com/images/'):
+                document_id = self._upload_picture('cdn.docx')
+        self.assertEqual(convert.call_count, 1)
+        self.assertIn('src="https://cdn.example.com/images/', Document.objects.get(id=document_id).original_content)
+
+
+def _template_docx():
+    """Szablon z polami rozbitymi na runy, powtórzeniami, nagłówkiem, stopką i tabelą zagnieżdżoną."""
+    doc = DocxDocument()
+    para = doc.add_paragraph('Imię: ')
+    para.add_run('{{IMI')
+    para.add_run('E}}').bold = True
+    para.add_run(' koniec').italic = True
+    doc.add_paragraph('{{MIASTO}} i jeszcze raz {{MIASTO}}')
+    doc.add_paragraph('Bez pól')
+    doc.add_picture(io.BytesIO(_png_1x1()))
+    outer = doc.add_table(rows=1, cols=1)
+    inner = outer.cell(0, 0).add_table(rows=1, cols=1)
+    inner.cell(0, 0).paragraphs[0].text = 'Kod: {{KOD}}'
+    section = doc.sections[0]
+    section.header.paragraphs[0].text = 'Nagłówek {{MIASTO}}'
+    section.footer.paragraphs[0].text = 'Stopka {{KOD}}'
+    buf = io.BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+
+TEMPLATE_FIELDS = [('imie', '{{IMIE}}'), ('miasto', '{{MIASTO}}'), ('kod', '{{KOD}}')]
+TEMPLATE_VALUES = {'imie': 'Jan', 'miasto': 'Kraków', 'kod': '30-001'}
+
+
+def _all_paragraph_texts(doc):
+    texts = [p.text for p in docx_template.part_paragraphs(doc.element)]
+    section = doc.sections[0]
+    texts += [p.text for p in section.header.paragraphs + section.footer.paragraphs]
+    return texts
+
+
+class CompletedExportTests(DocumentTestCase):
+    """Generowanie wersji, zbiorcze pobieranie i eksport ukończonych przypisań (prawdziwy DOCX)."""
+
+    def setUp(self):
+        self.use_media_root(DOCUMENT_JOBS_EAGER=True)
+        os.makedirs(os.path.join(self.media, 'documents'))
+        with open(os.path.join(self.media, 'documents', 'doc.docx'), 'wb') as fh:
+            fh.write(_docx_bytes('Imię: Jan'))
+        self.admin = self.make_user('admin_e', role='admin')
+        self.client = self.client_for(self.admin)
+        self.document = self.make_document(self.admin, fields=1)
+        EditableField.objects.filter(id=self.fields[0].id).update(original_value='Jan')
+        self.assignments = []
+        for name in ('anna', 'piotr'):
+            user = self.make_user(f'user_{name}')
+            assignment = self.make_assignment(self.document, user, status='completed', completed_at=timezone.now())
+            write_values(assignment, {'f0': name.capitalize()})
+            self.assignments.append(assignment)
+
+    def _remove_generated_file(self, assignment):
+        version = generation.get_or_render_version(DocumentAssignment.objects.get(id=assignment.id))
+        version.generated_file.storage.delete(version.generated_file.name)
+
+    def test_parallel_generation_keeps_going_after_failed_render(self):
+        render = workers.render_docx
+
+        def render_or_fail(src_path, dst_path, compiled, values, mode='zip'):
+            if values.get('f0') == 'Piotr':
+                raise ValueError('uszkodzony szablon')
+            return render(src_path, dst_path, compiled, values, mode)
+
+        assignments = list(DocumentAssignment.objects.filter(id__in=[a.id for a in self.assignments])
+                           .select_related('document', 'user'))
+        anna, piotr = (a.id for a in self.assignments)
+        with mock.patch.object(workers, 'render_docx', render_or_fail), \
+                ThreadPoolExecutor(max_workers=2) as executor:
+            versions, errors = generation.generate_versions(assignments, executor=executor, max_in_flight=1)
+        self.assertEqual(list(versions), [anna])
+        self.assertEqual(errors, {piotr: 'uszkodzony szablon'})
+        self.assertEqual(versions[anna].status, 'ready')
+        self.assertTrue(versions[anna].generated_file.storage.exists(versions[anna].generated_file.name))
+        failed = DocumentVersion.objects.get(assignment_id=piotr)
+        self.assertEqual((failed.status, failed.error), ('failed', 'uszkodzony szablon'))
+        # Nieudane renderowanie jest ponawiane przy kolejnym eksporcie
+        versions, errors = generation.ensure_versions(assignments)
+        self.assertEqual((set(versions), errors), ({anna, piotr}, {}))
+
+    def test_pregenerate_versions_skips_current_unless_forced(self):
+        render = mock.Mock(wraps=workers.render_docx)
+        with mock.patch.object(workers, 'render_docx', render):
+            call_command('pregenerate_versions', self.document.id, stdout=io.StringIO())
+            self.assertEqual(render.call_count, 2)
+            out = io.StringIO()
+            call_command('pregenerate_versions', self.document.id, stdout=out)
+            self.assertEqual(render.call_count, 2)
+            self.assertIn('Brak przypisań', out.getvalue())
+            call_command('pregenerate_versions', self.document.id, '--force', stdout=io.StringIO())
+            self.assertEqual(render.call_count, 4)
+        self.assertEqual(DocumentVersion.objects.filter(status='ready').count(), 2)
+
+    def test_missing_generated_file_is_reported_in_zip(self):
+        self._remove_generated_file(self.assignments[0])
+        response = self.client.get('/api/assignments/completed/download-zip/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Export-Errors'], '1')
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as zf:
+            self.assertIsNone(zf.testzip())
+            names = zf.namelist()
+            report = zf.read(archives.ERRORS_FILE).decode('utf-8')
+        self.assertEqual(len(names), 2)
+        self.assertIn('user_anna', report)
+        self.assertIn(archives.MISSING_FILE_ERROR, report)
+
+    def test_unreadable_generated_file_is_counted_before_streaming(self):
+        version = generation.get_or_render_version(DocumentAssignment.objects.get(id=self.assignments[1].id))
+        # Istnieje w magazynie, ale nie da się go otworzyć jako pliku
+        path = version.generated_file.path
+        os.unlink(path)
+        os.mkdir(path)
+        response = self.client.get('/api/assignments/completed/download-zip/')
+        self.assertEqual(response['X-Export-Errors'], '1')
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as zf:
+            self.assertIn('user_piotr', zf.read(archives.ERRORS_FILE).decode('utf-8'))
+            self.assertEqual(len(zf.namelist()), 2)
+
+    def test_file_lost_while_streaming_is_reported(self):
+        versions = {a.id: generation.get_or_render_version(a) for a in self.assignments}
+        members = list(archives.completed_members(self.assignments, versions))
+        first = versions[self.assignments[0].id].generated_file
+        first.storage.delete(first.name)
+        failures = []
+        data = b''.join(archives.stream_zip(members, failures=failures))
+        self.assertEqual(len(failures), 1)
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(len(zf.namelist()), 2)
+            self.assertIn(members[0][0], zf.read(archives.ERRORS_FILE).decode('utf-8'))
+
+    def test_export_job_records_missing_file(self):
+        self._remove_generated_file(self.assignments[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/assignments/completed/exports/', {}, format='json')
+        job = ProcessingJob.objects.get(id=response.data['id'])
+        self.assertEqual(job.status, 'done')
+        self.assertIn('user_piotr', job.error)
+        with job.result_file.open('rb') as fh, zipfile.ZipFile(fh) as zf:
+            self.assertIn(archives.ERRORS_FILE, zf.namelist())
+
+    def _export(self, client=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return (client or self.client).post('/api/assignments/completed/exports/', {}, format='json')
+
+    def test_export_is_cached_until_data_changes(self):
+        first = self._export()
+        self.assertEqual((first.status_code, first.data['cached']), (202, False))
+        self.assertEqual(ProcessingJob.objects.get(id=first.data['id']).status, 'done')
+        again = self._export()
+        self.assertEqual((again.status_code, again.data['id'], again.data['cached']), (200, first.data['id'], True))
+
+        # Zapis wartości podbija rewizję przypisania - zakres eksportu się zmienia
+        DocumentAssignment.objects.filter(id=self.assignments[0].id).update(revision=F('revision') + 1)
+        changed = self._export()
+        self.assertNotEqual(changed.data['id'], first.data['id'])
+        self.assertFalse(changed.data['cached'])
+
+        # Archiwum usunięte z dysku nie jest podawane z cache
+        job = ProcessingJob.objects.get(id=changed.data['id'])
+        job.result_file.storage.delete(job.result_file.name)
+        self.assertNotEqual(self._export().data['id'], job.id)
+
+    def test_running_export_is_reused_and_stale_one_replaced(self):
+        key = exports.export_cache_key(self.admin)
+        running = ProcessingJob.objects.create(kind='export', created_by=self.admin, cache_key=key, status='running')
+        job, cached = exports.request_export(self.admin)
+        self.assertEqual((job.id, cached), (running.id, False))
+
+        ProcessingJob.objects.filter(id=running.id).update(
+            created_at=timezone.now() - exports.STALE_AFTER - timedelta(minutes=1))
+        response = self._export()
+        self.assertNotEqual(response.data['id'], running.id)
+        self.assertEqual(ProcessingJob.objects.get(id=response.data['id']).status, 'done')
+        running.refresh_from_db()
+        self.assertEqual((running.status, running.error), ('failed', jobs.STALE_ERROR))
+
+    def test_only_owner_can_download_export(self):
+        job_id = self._export().data['id']
+        url = f'/api/assignments/completed/exports/{job_id}/download/'
+        other = self.client_for(self.make_user('admin_other', role='admin'))
+        self.assertEqual(other.get(f'/api/assignments/completed/exports/{job_id}/').status_code, 404)
+        self.assertEqual(other.get(url).status_code, 404)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(len(zf.namelist()), 2)
+
+        ProcessingJob.objects.filter(id=job_id).update(status='running')
+        self.assertEqual(self.client.get(url).status_code, 409)
+
+
+class DocxTemplateTests(SimpleTestCase):
+    """Indeks szablonu i renderowanie na poziomie archiwum ZIP na prawdziwym pliku DOCX."""
+
+    def setUp(self):
+        self.source = _template_docx()
+        self.compiled = docx_zip.compile_zip(io.BytesIO(self.source), TEMPLATE_FIELDS, 'szablon.docx')
+
+    def _render(self):
+        dst = io.BytesIO()
+        replaced = docx_zip.render_zip(io.BytesIO(self.source), dst, self.compiled, TEMPLATE_VALUES)
+        return replaced, dst.getvalue()
+
+    def test_matcher_prefers_leftmost_longest_without_overlaps(self):
+        matcher = docx_template.PlaceholderMatcher([('a', 'abc'), ('b', 'bcd'), ('c', 'c'), ('d', 'ab')])
+        self.assertEqual(matcher.find_all('abcd abcd'), [[0, 3, 'a'], [5, 8, 'a']])
+        self.assertEqual(matcher.find_all('xbcdc'), [[1, 4, 'b'], [4, 5, 'c']])
+        # Powtórzony wzorzec - wygrywa pierwszy klucz
+        self.assertEqual(docx_template.PlaceholderMatcher([('x', 'ab'), ('y', 'ab')]).find_all('ab'), [[0, 2, 'x']])
+
+    def test_index_covers_split_runs_repeats_header_footer_and_nested_tables(self):
+        parts = self.compiled['parts']
+        self.assertEqual(sorted(parts), ['word/document.xml', 'word/footer1.xml', 'word/header1.xml'])
+        spans = [span for part in parts.values() for para in part.values() for span in para]
+        keys = sorted(key for _, _, key in spans)
+        self.assertEqual(keys, ['imie', 'kod', 'kod', 'miasto', 'miasto', 'miasto'])
+
+    def test_split_placeholder_keeps_styles_outside_the_span(self):
+        para = DocxDocument(io.BytesIO(self.source)).paragraphs[0]
+        start = para.text.index('{{IMIE}}')
+        self.assertTrue(docx_template.replace_span(para.runs, start, start + len('{{IMIE}}'), 'Jan'))
+        self.assertEqual(para.text, 'Imię: Jan koniec')
+        self.assertEqual([r.text for r in para.runs], ['Imię: ', 'Jan', '', ' koniec'])
+        self.assertTrue(para.runs[3].italic)
+
+    def test_render_zip_output_is_valid_and_copies_untouched_members(self):
+        replaced, output = self._render()
+        self.assertEqual(replaced, 6)
+        with zipfile.ZipFile(io.BytesIO(self.source)) as src, zipfile.ZipFile(io.BytesIO(output)) as dst:
+            self.assertIsNone(dst.testzip())
+            self.assertEqual(dst.namelist(), src.namelist())
+            rewritten = set(self.compiled['parts'])
+            for info in src.infolist():
+                if info.filename in rewritten:
+                    continue
+                copied = dst.getinfo(info.filename)
+                self.assertEqual((copied.CRC, copied.compress_size, copied.compress_type),
+                                 (info.CRC, info.compress_size, info.compress_type), info.filename)
+                self.assertEqual(dst.read(info.filename), src.read(info.filename))
+            self.assertTrue(any(name.startswith('word/media/') for name in src.namelist()))
+
+        texts = _all_paragraph_texts(DocxDocument(io.BytesIO(output)))
+        self.assertIn('Imię: Jan koniec', texts)
+        self.assertIn('Kraków i jeszcze raz Kraków', texts)
+        self.assertIn('Kod: 30-001', texts)
+        self.assertIn('Nagłówek Kraków', texts)
+        self.assertIn('Stopka 30-001', texts)
+        self.assertFalse(any('{{' in text for text in texts))
+
+    def test_zip_and_python_docx_modes_render_the_same_text(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, ignore_errors=True)
+        src = os.path.join(tmp, 'szablon.docx')
+        with open(src, 'wb') as f:
+            f.write(self.source)
+        texts = {}
+        for mode in ('zip', 'docx'):
+            dst = workers.render_docx(src, os.path.join(tmp, f'{mode}.docx'), self.compiled, TEMPLATE_VALUES, mode)
+            texts[mode] = _all_paragraph_texts(DocxDocument(dst))
+        self.assertEqual(texts['zip'], texts['docx'])
+
+    def test_values_without_matches_copy_the_archive(self):
+        dst = io.BytesIO()
+        self.assertEqual(docx_zip.render_zip(io.BytesIO(self.source), dst, self.compiled, {}), 0)
+        with zipfile.ZipFile(io.BytesIO(self.source)) as src, zipfile.ZipFile(dst) as out:
+            self.assertIsNone(out.testzip())
+            for info in src.infolist():
+                self.assertEqual(out.read(info.filename), src.read(info.filename))
+
+
+class ProfilePermissionTests(DocumentTestCase):
+    """Rola z profilu jest brana z cache i unieważniana przy zmianie profilu."""
+
+    def setUp(self):
+        self.admin = self.make_user('admin_p', role='admin', section='A')
+        self.superuser = User.objects.create_superuser('root_p')
+        self.client = APIClient()
+
+    def _get_admin_documents(self):
+        self.client.force_authenticate(User.objects.get(id=self.admin.id))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/documents/admin/')
+        profile_queries = [q for q in ctx.captured_queries if 'documents_userprofile' in q['sql']]
+        return response, len(profile_queries)
+
+    def test_role_is_cached_and_invalidated_by_set_user_role(self):
+        self._get_admin_documents()
+        response, profile_queries = self._get_admin_documents()
+        self.assertEqual((response.status_code, profile_queries), (200, 0))
+
+        root = self.client_for(self.superuser)
+        self.assertEqual(root.post(f'/api/users/{self.admin.id}/set-role/', {'role': 'user'}).status_code, 200)
+        response, _ = self._get_admin_documents()
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.data['error'], 'Brak uprawnień')
+
+    def test_admin_without_section_cannot_list_users(self):
+        UserProfile.objects.filter(user=self.admin).update(section='')
+        # update() omija sygnały - unieważniamy ręcznie jak przy zapisie profilu
+        UserProfile.objects.get(user=self.admin).save()
+        self.client.force_authenticate(User.objects.get(id=self.admin.id))
+        response = self.client.get('/api/users/')
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('sekcji', response.data['error'])
+
+
+@override_settings(API_TOKENS_ENABLED=True,
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ApiTokenTests(DocumentTestCase):
+    """Podpisane tokeny API: logowanie, żądania bez sesji i odświeżanie."""
+
+    def setUp(self):
+        self.admin = User.objects.create_user('admin_t', password='haslo123')
+        UserProfile.objects.create(user=self.admin, role='admin', section='A')
+        self.client = APIClient()
+
+    def _login(self):
+        response = self.client.post('/api/auth/login/', {'username': 'admin_t', 'password': 'haslo123'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data['tokens']
+
+    def test_token_request_does_not_read_session_or_profile(self):
+        access = self._login()['access']
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get('/api/documents/admin/')
+        self.assertEqual(response.status_code, 200)
+        sql = ' '.join(q['sql'] for q in ctx.captured_queries)
+        self.assertNotIn('django_session', sql)
+        self.assertNotIn('documents_userprofile', sql)
+        self.assertNotIn('FROM "auth_user"', sql)
+        self.assertEqual(client.get('/api/auth/current-user/').data['role'], 'admin')
+
+    def test_refresh_token_only_in_http_only_cookie(self):
+        issued = self._login()
+        self.assertEqual(set(issued), {'access', 'expires_in'})
+        cookie = self.client.cookies[tokens.REFRESH_COOKIE]
+        self.assertTrue(cookie['httponly'])
+        self.assertEqual((cookie['path'], cookie['samesite']), (tokens.REFRESH_COOKIE_PATH, 'Strict'))
+
+        response = self.client.post('/api/auth/token/refresh/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data), {'access', 'expires_in'})
+        # Bez ciasteczka nie ma czego odświeżyć
+        self.assertEqual(APIClient().post('/api/auth/token/refresh/').status_code, 401)
+
+        response = self.client.post('/api/auth/logout/')
+        self.assertEqual(response.cookies[tokens.REFRESH_COOKIE].value, '')
+
+    def test_refresh_and_rejected_tokens(self):
+        issued = self._login()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {issued["access"]}x')
+        self.assertEqual(client.get('/api/auth/current-user/').status_code, 401)
+
+        # Zmiana hasła unieważnia tokeny odświeżania
+        self.admin.set_password('nowe-haslo')
+        self.admin.save()
+        response = self.client.post('/api/auth/token/refresh/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.cookies[tokens.REFRESH_COOKIE].value, '')
+
+    def test_access_token_expires(self):
+        access = self._login()['access']
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        with override_settings(ACCESS_TOKEN_LIFETIME=-1):
+            self.assertEqual(client.get('/api/auth/current-user/').status_code, 401)
+
+
+class SessionProfileTests(TestCase):
+    """Profile sesji z SESSION_PROFILES: poza 'db' zalogowane żądanie nie czyta django_session."""
+
+    def _session_queries(self, profile):
+        user = User.objects.create_user(f'sess_{profile}')
+        with override_settings(**settings.SESSION_PROFILES[profile]):
+            client = Client()
+            client.force_login(user)
+            client.get('/api/auth/current-user/')
+            with CaptureQueriesContext(connection) as ctx:
+                response = client.get('/api/auth/current-user/')
+        self.assertEqual(response.status_code, 200)
+        return sum('django_session' in q['sql'] for q in ctx.captured_queries)
+
+    def test_cached_and_cookie_profiles_skip_session_table(self):
+        self.assertEqual(self._session_queries('db'), 1)
+        self.assertEqual(self._session_queries('cached_db'), 0)
+        self.assertEqual(self._session_queries('signed_cookies'), 0)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ImportUsersTests(TestCase):
+    """Import kont z profilami z pliku CSV partiami."""
+
+    def test_import_creates_users_and_profiles_and_skips_existing(self):
+        User.objects.create_user('istnieje')
+        tmp = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8')
+        self.addCleanup(os.unlink, tmp.name)
+        with tmp:
+            tmp.write('username,password,first_name,last_name,index,section,role\n'
+                      'jan.k,tajne1,Jan,Kowalski,123,IT,user\n'
+                      'anna.n,tajne2,Anna,Nowak,456,IT,admin\n'
+                      'istnieje,x,,,,,user\n'
+                      'jan.k,powtórka,,,,,user\n'
+                      'zła nazwa,x,,,,,user\n')
+        out = io.StringIO()
+        call_command('import_users', tmp.name, '--workers', '0', '--batch-size', '2', stdout=out)
+        self.assertIn('Utworzono 2 z 5 kont', out.getvalue())
+        jan = User.objects.get(username='jan.k')
+        self.assertTrue(jan.check_password('tajne1'))
+        self.assertEqual((jan.userprofile.role, jan.userprofile.index, jan.userprofile.section), ('user', '123', 'IT'))
+        self.assertEqual(User.objects.get(username='anna.n').userprofile.role, 'admin')
+        self.assertFalse(UserProfile.objects.filter(user__username='istnieje').exists())
+
+    def _import(self, rows):
+        tmp = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8')
+        self.addCleanup(os.unlink, tmp.name)
+        with tmp:
+            tmp.write('username,role,section\n' + ''.join(f'{row}\n' for row in rows))
+        out = io.StringIO()
+        call_command('import_users', tmp.name, '--workers', '0', '--batch-size', '2', stdout=out)
+        return out.getvalue()
+
+    def test_reimport_with_overlapping_usernames(self):
+        self.assertIn('Utworzono 2 z 2 kont', self._import(['jan.k,user,IT', 'anna.n,admin,IT']))
+        out = self._import(['anna.n,user,HR', 'piotr.w,user,HR', 'jan.k,admin,HR'])
+        self.assertIn('Utworzono 1 z 3 kont', out)
+        self.assertIn('istniejące 2', out)
+        self.assertEqual(User.objects.count(), 3)
+        self.assertEqual(UserProfile.objects.count(), 3)
+        # Profile pominiętych kont pozostają bez zmian
+        self.assertEqual((UserProfile.objects.get(user__username='anna.n').role,
+                          UserProfile.objects.get(user__username='anna.n').section), ('admin', 'IT'))
+        self.assertEqual(UserProfile.objects.get(user__username='piotr.w').section, 'HR')
+
+    def test_accounts_created_during_import_are_not_counted(self):
+        tmp = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8')
+        self.addCleanup(os.unlink, tmp.name)
+        with tmp:
+            tmp.write('username,role\njan.k,admin\nanna.n,user\n')
+        hash_passwords = workers.hash_passwords
+
+        def hash_and_race(passwords):
+            # Ktoś zakłada konto jan.k między sprawdzeniem istniejących kont a zapisem
+            User.objects.get_or_create(username='jan.k')
+            return hash_passwords(passwords)
+
+        out = io.StringIO()
+        with mock.patch('documents.management.commands.import_users.hash_passwords', hash_and_race):
+            call_command('import_users', tmp.name, '--workers', '0', stdout=out)
+        self.assertIn('Utworzono 1 z 2 kont', out.getvalue())
+        self.assertIn('istniejące 1', out.getvalue())
+        self.assertFalse(UserProfile.objects.filter(user__username='jan.k').exists())
+        self.assertEqual(UserProfile.objects.get(user__username='anna.n').role, 'user')
@@ -0,0 +1,108 @@
+"""Podpisane tokeny dostępu dla API (opcjonalnie, API_TOKENS_ENABLED).
+
+Token dostępu (access) to podpisany (django.core.signing, SECRET_KEY) słownik z ID użytkownika,
+nazwą, flagą superużytkownika oraz rolą i sekcją z profilu. Żądanie z nagłówkiem
+`Authorization: Bearer <access>` jest uwierzytelniane bez odczytu sesji, użytkownika i profilu
+(documents.authentication). Token jest ważny ACCESS_TOKEN_LIFETIME sekund, więc zmiana roli
+lub sekcji dociera do klienta najpóźniej po tym czasie (przy następnym odświeżeniu).
+
+Token odświeżania (refresh) zawiera tylko ID użytkownika i fragment skrótu hasła - zmiana
+hasła lub dezaktywacja konta unieważnia wszystkie wydane tokeny odświeżania.
+
+Przeglądarka nie dostaje tokenu odświeżania w treści odpowiedzi: trafia on do ciasteczka HttpOnly
+(REFRESH_COOKIE, SameSite=Strict, tylko ścieżka auth/token/), więc skrypt na stronie (np. wstrzyknięty
+w HTML dokumentu) nie może go odczytać. Token dostępu SPA trzyma wyłącznie w pamięci.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.utils.crypto import constant_time_compare
+
+from .permissions import profile_info
+
+ACCESS_SALT = 'documents.tokens.access'
+REFRESH_SALT = 'documents.tokens.refresh'
+
+# Klucz sesji, pod którym pipeline Discord zostawia tokeny do odebrania przez SPA (auth/token/)
+SESSION_KEY = 'documents_api_tokens'
+
+# Ciasteczko z tokenem odświeżania - wysyłane tylko do auth/token/ (wydanie i odświeżenie)
+REFRESH_COOKIE = 'api_refresh'
+REFRESH_COOKIE_PATH = '/api/auth/token/'
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+def tokens_enabled() -> bool:
+    return getattr(settings, 'API_TOKENS_ENABLED', False)
+
+
+def access_lifetime() -> int:
+    return getattr(settings, 'ACCESS_TOKEN_LIFETIME', 300)
+
+
+def refresh_lifetime() -> int:
+    return getattr(settings, 'REFRESH_TOKEN_LIFETIME', 7 * 24 * 3600)
+
+
+def _password_marker(user) -> str:
+    return user.get_session_auth_hash()[:16]
+
+
+def issue_tokens(user) -> dict:
+    """Para tokenów dla użytkownika: {'access', 'refresh', 'expires_in'}."""
+    info = profile_info(user)
+    claims = {
+        'uid': user.id,
+        'un': user.username,
+        'su': bool(user.is_superuser),
+        'role': info['role'],
+        'section': info['section'],
+    }
+    return {
+        'access': signing.dumps(claims, salt=ACCESS_SALT, compress=True),
+        'refresh': signing.dumps({'uid': user.id, 'pw': _password_marker(user)}, salt=REFRESH_SALT),
+        'expires_in': access_lifetime(),
+    }
+
+
+def respond_with_tokens(response, pair: dict, key: str = None):
+    """Dołącz parę tokenów do odpowiedzi: access i expires_in w treści (response.data[key]
+    albo, bez key, cała treść), refresh - w ciasteczku HttpOnly."""
+    public = {'access': pair['access'], 'expires_in': pair['expires_in']}
+    if key is None:
+        response.data = public
+    else:
+        response.data[key] = public
+    response.set_cookie(
+        REFRESH_COOKIE, pair['refresh'], max_age=refresh_lifetime(), path=REFRESH_COOKIE_PATH,
+        secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Strict',
+    )
+    return response
+
+
+def clear_refresh_cookie(response):
+    response.delete_cookie(REFRESH_COOKIE, path=REFRESH_COOKIE_PATH, samesite='Strict')
+    return response
+
+
+def read_access(token: str) -> dict:
+    """Zweryfikuj token dostępu i zwróć jego dane (InvalidToken, gdy podpis lub ważność się nie zgadza)."""
+    try:
+        return signing.loads(token, salt=ACCESS_SALT, max_age=access_lifetime())
+    except signing.BadSignature as exc:  # także SignatureExpired
+        raise InvalidToken(str(exc)) from exc
+
+
+def refresh_tokens(token: str) -> dict:
+    """Nowa para tokenów na podstawie tokenu odświeżania (z aktualną rolą i sekcją)."""
+    try:
+        data = signing.loads(token, salt=REFRESH_SALT, max_age=refresh_lifetime())
+    except signing.BadSignature as exc:
+        raise InvalidToken(str(exc)) from exc
+    user = User.objects.filter(id=data.get('uid'), is_active=True).first()
+    if user is None or not constant_time_compare(_password_marker(user), data.get('pw', '')):
+        raise InvalidToken('Użytkownik nie istnieje lub zmienił hasło')
+    return issue_tokens(user)
@@ -0,0 +1,61 @@
+"""Sprawdzanie przesłanych plików DOCX przed zapisaniem.
+
+Plik jest już na dysku (FILE_UPLOAD_HANDLERS zapisuje przesyłane dane do pliku
+tymczasowego), a sprawdzenie czyta wyłącznie katalog archiwum ZIP i jedną małą
+część XML - bez dekompresji całego pliku, więc pamięć nie zależy od jego rozmiaru.
+
+Ustawienia:
+- DOCUMENT_MAX_UNCOMPRESSED_SIZE - maksymalny łączny rozmiar po rozpakowaniu (B),
+- DOCUMENT_MAX_ARCHIVE_ENTRIES - maksymalna liczba elementów archiwum.
+"""
+import zipfile
+import zlib
+
+from django.conf import settings
+
+DOCX_MAIN_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml'
+# [Content_Types].xml jest mały; większy oznacza uszkodzony lub spreparowany plik
+_MAX_CONTENT_TYPES_SIZE = 1024 * 1024
+
+
+class InvalidUpload(ValueError):
+    """Przesłany plik nie jest poprawnym dokumentem DOCX (komunikat dla użytkownika)."""
+
+
+def validate_docx(uploaded):
+    """Sprawdź strukturę archiwum, łączny rozmiar po rozpakowaniu i typ zawartości DOCX.
+    Rzuca InvalidUpload; po sprawdzeniu plik jest przewinięty na początek."""
+    max_size = getattr(settings, 'DOCUMENT_MAX_UNCOMPRESSED_SIZE', 200 * 1024 * 1024)
+    max_entries = getattr(settings, 'DOCUMENT_MAX_ARCHIVE_ENTRIES', 5000)
+    uploaded.seek(0)
+    try:
+        with zipfile.ZipFile(uploaded) as archive:
+            infos = archive.infolist()
+            if len(infos) > max_entries:
+                raise InvalidUpload('Plik DOCX zawiera zbyt wiele elementów.')
+            names = set()
+            total = 0
+            for info in infos:
+                if info.flag_bits & 0x01:
+                    raise InvalidUpload('Zaszyfrowane pliki DOCX nie są obsługiwane.')
+                if info.filename in names:
+                    raise InvalidUpload('Plik nie jest poprawnym archiwum DOCX (powtórzone elementy).')
+                names.add(info.filename)
+                total += info.file_size
+            if total > max_size:
+                raise InvalidUpload(
+                    f'Plik DOCX po rozpakowaniu przekracza limit {max_size // (1024 * 1024)} MB.')
+
+            if '[Content_Types].xml' not in names or 'word/document.xml' not in names:
+                raise InvalidUpload('Plik nie jest dokumentem Word DOCX.')
+            if archive.getinfo('[Content_Types].xml').file_size > _MAX_CONTENT_TYPES_SIZE:
+                raise InvalidUpload('Plik nie jest poprawnym archiwum DOCX.')
+            content_types = archive.read('[Content_Types].xml')
+    # zlib.error - uszkodzony strumień deflate, NotImplementedError - nieobsługiwana metoda kompresji
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, EOFError, OSError, zlib.error, NotImplementedError):
+        raise InvalidUpload('Plik nie jest poprawnym archiwum DOCX.')
+    finally:
+        uploaded.seek(0)
+    # Dokumenty z makrami (.docm) i szablony mają inny typ części głównej
+    if DOCX_MAIN_CONTENT_TYPE.encode('ascii') not in content_types:
+        raise InvalidUpload('Plik nie jest dokumentem Word DOCX (nieobsługiwany typ zawartości).')
@@ -8,6 +8,8 @@ urlpatterns = [
     path('auth/logout/', views.logout_view, name='logout'),
     path('auth/current-user/', views.current_user, name='current_user'),
     path('auth/complete-profile/', views.complete_profile, name='complete_profile'),
+    path('auth/token/', views.issue_token, name='issue_token'),
+    path('auth/token/refresh/', views.refresh_token, name='refresh_token'),
     
     # Użytkownicy
     path('users/', views.users_list, name='users_list'),
@@ -17,18 +19,30 @@ urlpatterns = [
     # Dokumenty
     path('documents/upload/', views.upload_document, name='upload_document'),
     path('documents/<int:document_id>/reprocess/', views.reprocess_document, name='reprocess_document'),
+    path('documents/images/<str:name>', views.document_image, name='document_image'),
     path('documents/<int:document_id>/', views.delete_document, name='delete_document'),
+    path('documents/<int:document_id>/detail/', views.document_detail, name='document_detail'),
     path('documents/admin/', views.admin_documents, name='admin_documents'),
     path('documents/create-field/', views.create_field, name='create_field'),
     path('documents/fields/<int:field_id>/', views.delete_field, name='delete_field'),
     path('documents/assign/', views.assign_document, name='assign_document'),
+
+    # Zadania w tle
+    path('jobs/<int:job_id>/', views.job_status, name='job_status'),
     
     # Przypisania
     path('assignments/user/', views.user_assignments, name='user_assignments'),
     path('assignments/completed/', views.completed_assignments, name='completed_assignments'),
     path('assignments/completed/download-zip/', views.download_completed_zip, name='download_completed_zip'),
+    path('assignments/completed/exports/', views.create_export, name='create_export'),
+    path('assignments/completed/exports/<int:job_id>/', views.export_status, name='export_status'),
+    path('assignments/completed/exports/<int:job_id>/download/', views.download_export, name='download_export'),
     path('assignments/submit-values/', views.submit_field_values, name='submit_field_values'),
+    path('assignments/<int:assignment_id>/values/', views.patch_field_values, name='patch_field_values'),
     path('assignments/<int:assignment_id>/complete/', views.complete_assignment, name='complete_assignment'),
+    path('assignments/<int:assignment_id>/detail/', views.assignment_detail, name='assignment_detail'),
+    path('assignments/<int:assignment_id>/versions/', views.assignment_versions, name='assignment_versions'),
     path('assignments/<int:assignment_id>/download-docx/', views.download_assignment_docx, name='download_assignment_docx'),
+    path('versions/<int:version_id>/', views.version_detail, name='version_detail'),
     path('assignments/<int:assignment_id>/', views.delete_assignment, name='delete_assignment'),
 ]
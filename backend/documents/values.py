@@ -0,0 +1,135 @@
+"""Przechowywanie wartości pól przypisań.
+
+Tryb wybiera ustawienie DOCUMENT_VALUE_STORAGE:
+- 'rows' (domyślnie) - każda wartość to wiersz FieldValue,
+- 'both' - zapis do FieldValue i do DocumentAssignment.values, odczyt z values,
+- 'json' - tylko DocumentAssignment.values (jeden dokument JSON {field_id: wartość}).
+
+Przy przejściu z 'rows' na 'both'/'json' wartości zapisane w międzyczasie jako wiersze
+przenosi komenda `backfill_assignment_values`.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, Func, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import DocumentAssignment, EditableField, FieldValue
+
+STORAGE_MODES = ('rows', 'both', 'json')
+
+
+def storage_mode() -> str:
+    mode = getattr(settings, 'DOCUMENT_VALUE_STORAGE', 'rows')
+    return mode if mode in STORAGE_MODES else 'rows'
+
+
+def reads_json() -> bool:
+    return storage_mode() != 'rows'
+
+
+def read_values(assignment: DocumentAssignment) -> dict:
+    """Wartości przypisania jako {field_id: wartość}.
+    W trybie 'rows' korzysta z prefetchu field_values (z polami), jeśli jest dostępny."""
+    if reads_json():
+        return dict(assignment.values or {})
+    if 'field_values' in getattr(assignment, '_prefetched_objects_cache', {}):
+        rows = assignment.field_values.all()
+    else:
+        rows = assignment.field_values.select_related('field')
+    return {fv.field.field_id: fv.value for fv in rows}
+
+
+def write_values(assignment: DocumentAssignment, submitted: dict):
+    """Zapisz wartości pól przypisania zbiorowo (w bieżącej transakcji lub nowej).
+
+    Pola rozwiązujemy jednym zapytaniem; wiersze FieldValue zapisujemy jednym upsertem,
+    a dokument JSON jednym UPDATE po scaleniu z aktualną zawartością.
+    Zwraca (liczba zapisanych wartości, posortowane nieznane field_id).
+    """
+    mode = storage_mode()
+    fields = {
+        f.field_id: f
+        for f in EditableField.objects.filter(document_id=assignment.document_id, field_id__in=list(submitted))
+    }
+    known = {field_id: value for field_id, value in submitted.items() if field_id in fields}
+    unknown = sorted(set(submitted) - set(fields))
+    if not known:
+        return 0, unknown
+
+    with transaction.atomic():
+        if mode in ('rows', 'both'):
+            FieldValue.objects.bulk_create(
+                [FieldValue(assignment=assignment, field=fields[field_id], value=value)
+                 for field_id, value in known.items()],
+                update_conflicts=True,
+                unique_fields=['assignment', 'field'],
+                update_fields=['value', 'updated_at'],
+            )
+        if mode in ('both', 'json'):
+            # Blokada wiersza, żeby równoległe zapisy się nie gubiły - tylko tam, gdzie baza wspiera
+            # select_for_update (na SQLite to no-op: wywołujący robi wcześniej UPDATE przypisania
+            # w tej samej transakcji, co bierze blokadę zapisu przed odczytem JSON)
+            current = (DocumentAssignment.objects.select_for_update()
+                       .filter(id=assignment.id).values_list('values', flat=True).first()) or {}
+            current.update(known)
+            DocumentAssignment.objects.filter(id=assignment.id).update(values=current)
+            assignment.values = current
+    return len(known), unknown
+
+
+def missing_field_ids(assignment: DocumentAssignment) -> list:
+    """field_id bieżących pól dokumentu, które nie mają zapisanej wartości."""
+    values = read_values(assignment)
+    return [
+        field_id
+        for field_id in EditableField.objects.filter(document_id=assignment.document_id)
+                                             .values_list('field_id', flat=True)
+        if field_id not in values
+    ]
+
+
+def missing_value_exists():
+    """Warunek SQL na przypisaniu: istnieje bieżące pole dokumentu bez wiersza FieldValue.
+    Pozostałości po usuniętych polach nie są liczone (w przeciwieństwie do porównania liczności)."""
+    return Exists(
+        EditableField.objects
+        .filter(document_id=OuterRef('document_id'))
+        .exclude(Exists(FieldValue.objects.filter(assignment_id=OuterRef(OuterRef('id')), field_id=OuterRef('id'))))
+    )
+
+
+def filled_count_subquery():
+    """Liczba bieżących pól przypisania z zapisanym wierszem FieldValue (tryb 'rows')
+    jako podzapytanie SQL - lista przypisań nie musi pobierać samych wartości."""
+    rows = (FieldValue.objects
+            .filter(assignment_id=OuterRef('id'), field__document_id=OuterRef('document_id'))
+            .order_by()
+            .annotate(n=Func(F('id'), function='COUNT'))
+            .values('n'))
+    return Coalesce(Subquery(rows, output_field=IntegerField()), 0)
+
+
+def backfill_json(assignment_ids=None, batch_size: int = 1000) -> int:
+    """Przepisz wartości z wierszy FieldValue do DocumentAssignment.values (partiami).
+    Przypisania bez wierszy zostają bez zmian. Uruchamiać przy przejściu z trybu 'rows' -
+    w trybie 'json' wiersze nie są aktualizowane i nadpisałyby nowsze wartości.
+    Zwraca liczbę zaktualizowanych przypisań."""
+    qs = DocumentAssignment.objects.order_by('id')
+    if assignment_ids is not None:
+        qs = qs.filter(id__in=assignment_ids)
+    updated = 0
+    last_id = 0
+    while True:
+        batch = list(qs.filter(id__gt=last_id).values_list('id', flat=True)[:batch_size])
+        if not batch:
+            return updated
+        last_id = batch[-1]
+        by_assignment = {}
+        for a_id, field_id, value in (FieldValue.objects
+                                      .filter(assignment_id__in=batch)
+                                      .values_list('assignment_id', 'field__field_id', 'value')):
+            by_assignment.setdefault(a_id, {})[field_id] = value
+        objs = [DocumentAssignment(id=a_id, values=vals) for a_id, vals in by_assignment.items()]
+        with transaction.atomic():
+            DocumentAssignment.objects.bulk_update(objs, ['values'], batch_size=batch_size)
+        updated += len(objs)
@@ -1,32 +1,55 @@
 from django.shortcuts import render
 from rest_framework import generics, status, permissions
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
 from django.utils import timezone
-from django.http import JsonResponse, FileResponse
+from django.http import JsonResponse, FileResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
 from django.core.files.base import ContentFile
-import io
-import zipfile
-from datetime import datetime
 from django.db import transaction
+from django.db.models import Case, Count, DateTimeField, F, Prefetch, Q, Value, When
+from django.db.models.functions import Trim
 from django.views.decorators.csrf import ensure_csrf_cookie
 import json
-from docx import Document as DocxDocument
-import mammoth  # konwersja .docx -> HTML
+import os
+import re
+
+from . import archives, blobs, exports, jobs, tokens
+from .generation import (
+    compile_document_template, ensure_versions, generate_version_after_commit, get_or_render_version
+)
+from .permissions import IsDocumentAdmin, IsSectionAdmin, IsSuperuser, profile_info
+from .uploads import InvalidUpload, validate_docx
+from .workers import IMAGE_EXTENSIONS
+from .values import (
+    filled_count_subquery, missing_field_ids, missing_value_exists, reads_json, storage_mode, write_values,
+)
+from .pagination import (
+    UserCursorPagination, DocumentCursorPagination,
+    AssignmentCursorPagination, CompletedAssignmentCursorPagination, VersionCursorPagination
+)
 
 from .models import (
     UserProfile, Document, EditableField, 
-    DocumentAssignment, FieldValue, DocumentVersion
+    DocumentAssignment, FieldValue, DocumentVersion, ProcessingJob
 )
 from .serializers import (
-    UserSerializer, DocumentSerializer, EditableFieldSerializer,
-    DocumentAssignmentSerializer, FieldValueSerializer, DocumentVersionSerializer,
+    UserSerializer, DocumentSerializer, DocumentListSerializer, EditableFieldSerializer,
+    DocumentAssignmentSerializer, DocumentAssignmentListSerializer, FieldValueSerializer,
+    DocumentVersionSerializer, DocumentVersionListSerializer,
     LoginSerializer, DocumentUploadSerializer, FieldCreationSerializer,
-    AssignDocumentSerializer, SubmitFieldValuesSerializer
+    AssignDocumentSerializer, SubmitFieldValuesSerializer, PatchFieldValuesSerializer,
+    ProcessingJobSerializer
 )
+
+# Obrazy wyodrębnione z dokumentów: <sha256>.<rozszerzenie> (patrz workers.IMAGE_EXTENSIONS)
+IMAGE_CONTENT_TYPES = {ext: content_type for content_type, ext in IMAGE_EXTENSIONS.items()}
+IMAGE_NAME_RE = re.compile(r'^([0-9a-f]{64})(\.[a-z]+)$')
+
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 @ensure_csrf_cookie
@@ -61,11 +84,14 @@ def login_view(request):
                 profile.save()
             
             user_data = UserSerializer(user).data
-            return Response({
+            response = Response({
                 'success': True,
                 'user': user_data,
                 'message': 'Zalogowano pomyślnie'
             })
+            if tokens.tokens_enabled():
+                tokens.respond_with_tokens(response, tokens.issue_tokens(user), 'tokens')
+            return response
         else:
             return Response({
                 'success': False,
@@ -84,17 +110,53 @@ def login_view(request):
 def logout_view(request):
     """Endpoint do wylogowania"""
     logout(request)
-    return Response({'success': True, 'message': 'Wylogowano pomyślnie'})
+    return tokens.clear_refresh_cookie(Response({'success': True, 'message': 'Wylogowano pomyślnie'}))
+
+
+def _full_user(request):
+    """Użytkownik z bazy. Przy tokenie API request.user ma tylko pola z tokenu
+    (request.auth to wtedy dane tokenu, przy sesji - None)."""
+    if request.auth is None:
+        return request.user
+    return User.objects.select_related('userprofile').get(id=request.user.id)
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def current_user(request):
     """Endpoint do pobrania danych aktualnego użytkownika"""
-    serializer = UserSerializer(request.user)
+    serializer = UserSerializer(_full_user(request))
     return Response(serializer.data)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def issue_token(request):
+    """Tokeny API dla użytkownika zalogowanego sesją (np. po logowaniu przez Discord -
+    wtedy zwracamy parę wydaną w pipeline, jednorazowo)."""
+    if not tokens.tokens_enabled():
+        return Response({'error': 'Tokeny API są wyłączone'}, status=status.HTTP_404_NOT_FOUND)
+    issued = request.session.pop(tokens.SESSION_KEY, None) if request.auth is None else None
+    return tokens.respond_with_tokens(Response(), issued or tokens.issue_tokens(_full_user(request)))
+
+
+@api_view(['POST'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def refresh_token(request):
+    """Nowa para tokenów na podstawie tokenu odświeżania z ciasteczka HttpOnly.
+    Bez uwierzytelniania żądania (i sprawdzania CSRF sesji) - dowodem jest samo ciasteczko,
+    wysyłane tylko z tej samej witryny (SameSite=Strict)."""
+    if not tokens.tokens_enabled():
+        return Response({'error': 'Tokeny API są wyłączone'}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        pair = tokens.refresh_tokens(request.COOKIES.get(tokens.REFRESH_COOKIE, ''))
+    except tokens.InvalidToken:
+        return tokens.clear_refresh_cookie(Response({'error': 'Token odświeżania wygasł lub jest nieprawidłowy'},
+                                                    status=status.HTTP_401_UNAUTHORIZED))
+    return tokens.respond_with_tokens(Response(), pair)
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def complete_profile(request):
@@ -108,58 +170,53 @@ def complete_profile(request):
     if not first_name or not last_name or not index or not section:
         return Response({'error': 'Wymagane: imię, nazwisko, index i sekcja.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    request.user.first_name = first_name
-    request.user.last_name = last_name
-    request.user.save()
+    # UPDATE zamiast save() - przy tokenie API request.user nie ma wszystkich pól
+    User.objects.filter(id=request.user.id).update(first_name=first_name, last_name=last_name)
 
-    profile, _ = UserProfile.objects.get_or_create(user=request.user, defaults={'role': 'user'})
+    profile, _ = UserProfile.objects.get_or_create(user_id=request.user.id, defaults={'role': 'user'})
     profile.index = index
     profile.section = section
     profile.profile_completed = True
     profile.save()
 
-    return Response({'success': True})
+    response = Response({'success': True})
+    if request.auth is not None:
+        # Sekcja w dotychczasowym tokenie jest już nieaktualna
+        tokens.respond_with_tokens(response, tokens.issue_tokens(_full_user(request)), 'tokens')
+    return response
+
+
+def _users_by_section():
+    """Użytkownicy z sekcją profilu bez białych znaków na brzegach (profile_section) - tak jak
+    sekcja admina z profile_info, więc ' A ' w profilu to ta sama sekcja co 'A'."""
+    return User.objects.alias(profile_section=Trim('userprofile__section'))
 
 
 @api_view(['GET'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, IsSectionAdmin])
 def users_list(request):
     """Lista wszystkich użytkowników (tylko dla adminów)"""
-    user_profile = getattr(request.user, 'userprofile', None)
-    if not user_profile or user_profile.role != 'admin':
-        return Response({'error': 'Brak uprawnień'}, status=status.HTTP_403_FORBIDDEN)
-    # Admin może zarządzać tylko swoją sekcją; musi mieć ustawioną sekcję
-    admin_section = (user_profile.section or '').strip()
-    if not admin_section:
-        return Response({'error': 'Administrator nie ma ustawionej sekcji w profilu.'}, status=status.HTTP_400_BAD_REQUEST)
+    # Admin może zarządzać tylko swoją sekcją (IsSectionAdmin wymaga ustawionej sekcji)
+    admin_section = profile_info(request.user)['section']
 
-    from django.db.models import Q
     # Użytkownicy z tej samej sekcji ORAZ dodatkowo sam admin (możliwość przypisania do siebie)
-    users_qs = User.objects.filter(
-        Q(userprofile__role='user', userprofile__section=admin_section) | Q(id=request.user.id)
-    ).distinct().order_by('username')
-    serializer = UserSerializer(users_qs, many=True)
-    return Response(serializer.data)
+    users_qs = _users_by_section().filter(
+        Q(userprofile__role='user', profile_section=admin_section) | Q(id=request.user.id)
+    ).distinct()
+    return UserCursorPagination().paginate(users_qs, request, UserSerializer)
 
 
 @api_view(['GET'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, IsSuperuser])
 def users_all(request):
     """Lista wszystkich użytkowników (tylko superuser)."""
-    if not request.user.is_superuser:
-        return Response({'error': 'Brak uprawnień'}, status=status.HTTP_403_FORBIDDEN)
-    users = User.objects.all().order_by('username')
-    serializer = UserSerializer(users, many=True)
-    return Response(serializer.data)
+    return UserCursorPagination().paginate(User.objects.all(), request, UserSerializer)
 
 
 @api_view(['POST'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, IsSuperuser])
 def set_user_role(request, user_id: int):
     """Nadanie roli admin/user (tylko superuser)."""
-    if not request.user.is_superuser:
-        return Response({'error': 'Brak uprawnień'}, status=status.HTTP_403_FORBIDDEN)
-
     role = (request.data or {}).get('role')
     if role not in ('admin', 'user'):
         return Response({'error': 'Nieprawidłowa rola'}, status=status.HTTP_400_BAD_REQUEST)
@@ -176,13 +233,9 @@ def set_user_role(request, user_id: int):
 
 
 @api_view(['POST'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, IsDocumentAdmin])
 def upload_document(request):
     """Upload dokumentu Word"""
-    user_profile = getattr(request.user, 'userprofile', None)
-    if not user_profile or user_profile.role != 'admin':
-        return Response({'error': 'Brak uprawnień'}, status=status.HTTP_403_FORBIDDEN)
-    
     serializer = DocumentUploadSerializer(data=request.data)
     if serializer.is_valid():
         uploaded = serializer.validated_data['file']
@@ -193,39 +246,37 @@ def upload_document(request):
             return Response({'error': 'Obsługiwane są tylko pliki .docx (zapisz dokument jako DOCX).'},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        # Konwertuj dokument Word do HTML
+        if not uploaded.size:
+            return Response({'error': 'Przesłany plik jest pusty.'}, status=status.HTTP_400_BAD_REQUEST)
+        # Plik jest już na dysku; sprawdzamy katalog archiwum bez ładowania go do pamięci
         try:
-            data = uploaded.read()
-            if not data:
-                return Response({'error': 'Przesłany plik jest pusty.'}, status=status.HTTP_400_BAD_REQUEST)
-            result = mammoth.convert_to_html(io.BytesIO(data))
-            html_content = result.value or ''
-        except Exception as e:
-            return Response({'error': f'Błąd przetwarzania pliku DOCX: {str(e)}'}, 
-                            status=status.HTTP_400_BAD_REQUEST)
+            validate_docx(uploaded)
+        except InvalidUpload as e:
+            return Response({'error': f'Błąd przetwarzania pliku DOCX: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Stwórz dokument w bazie; identyczna treść jest zapisywana raz (documents.blobs),
+        # a konwersja do HTML odbywa się w tle (lub pochodzi z cache dla tej treści)
+        with transaction.atomic():
+            blob = blobs.store_upload(uploaded)
+            document = Document.objects.create(
+                name=name,
+                file=blob.file.name,
+                blob=blob,
+                created_by=request.user
+            )
+            job = jobs.enqueue_conversion(document, request.user)
 
-        # Stwórz dokument w bazie
-        content_file = ContentFile(data)
-        content_file.name = uploaded.name
-        document = Document.objects.create(
-            name=name,
-            file=content_file,
-            original_content=html_content,
-            created_by=request.user
-        )
+        data = DocumentSerializer(document, context={'request': request}).data
+        data['job'] = ProcessingJobSerializer(job).data
+        return Response(data, status=status.HTTP_202_ACCEPTED)
 
-        serializer = DocumentSerializer(document)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
 @api_view(['POST'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, IsDocumentAdmin])
 def reprocess_document(request, document_id: int):
     """Ponownie przetwórz istniejący dokument DOCX do HTML (tylko admin, tylko własne dokumenty)."""
-    user_profile = getattr(request.user, 'userprofile', None)
-    if not user_profile or user_profile.role != 'admin':
-        return Response({'error': 'Brak uprawnień'}, status=status.HTTP_403_FORBIDDEN)
-
     try:
         document = Document.objects.get(id=document_id, created_by=request.user)
     except Document.DoesNotExist:
@@ -236,33 +287,51 @@ def reprocess_document(request, document_id: int):
         return Response({'error': 'Obsługiwane są tylko pliki .docx (zapisz dokument jako DOCX).'},
                         status=status.HTTP_400_BAD_REQUEST)
 
+    with transaction.atomic():
+        job = jobs.enqueue_conversion(document, request.user)
+
+    data = DocumentSerializer(document, context={'request': request}).data
+    data['job'] = ProcessingJobSerializer(job).data
+    return Response(data, status=status.HTTP_202_ACCEPTED)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def job_status(request, job_id: int):
+    """Stan zadania w tle wraz z czasem oczekiwania i wykonania (tylko zlecający)."""
     try:
-        with file.open('rb') as docx_file:
-            result = mammoth.convert_to_html(docx_file)
-            html_content = result.value or ''
-        try:
-            file.seek(0)
-        except Exception:
-            pass
-        document.original_content = html_content
-        document.save(update_fields=['original_content', 'updated_at'])
-        serializer = DocumentSerializer(document)
-        return Response(serializer.data)
-    except Exception as e:
-        return Response({'error': f'Błąd przetwarzania pliku DOCX: {str(e)}'},
-                        status=status.HTTP_400_BAD_REQUEST)
-    
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        job = ProcessingJob.objects.get(id=job_id, created_by=request.user)
+    except ProcessingJob.DoesNotExist:
+        return Response({'error': 'Zadanie nie istnieje'}, status=status.HTTP_404_NOT_FOUND)
+    # Porzucone zadanie (awaria procesu roboczego, restart) zgłaszamy jako nieudane
+    return Response(ProcessingJobSerializer(jobs.expire_if_stale(job)).data)
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def document_image(request, name: str):
+    """Obraz wyodrębniony z dokumentu przy konwersji (DOCUMENT_EXTRACT_IMAGES).
+    Nazwa to skrót SHA-256 treści, więc plik nigdy się nie zmienia i może być cache'owany
+    bez ograniczeń; dostęp bez logowania, bo <img> nie wysyła nagłówków autoryzacji."""
+    match = IMAGE_NAME_RE.match(name)
+    if not match or match.group(2) not in IMAGE_CONTENT_TYPES:
+        return Response({'error': 'Obraz nie istnieje'}, status=status.HTTP_404_NOT_FOUND)
+    path = os.path.join(jobs.images_dir(), name[:2], name)
+    try:
+        fh = open(path, 'rb')
+    except FileNotFoundError:
+        return Response({'error': 'Obraz nie istnieje'}, status=status.HTTP_404_NOT_FOUND)
+    response = FileResponse(fh, content_type=IMAGE_CONTENT_TYPES[match.group(2)])
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response['ETag'] = f'"{match.group(1)}"'
+    response['X-Content-Type-Options'] = 'nosniff'
+    return response
 
 
 @api_view(['POST'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, IsDocumentAdmin])
 def create_field(request):
     """Stworzenie pola do edycji w dokumencie"""
-    user_profile = getattr(request.user, 'userprofile', None)
-    if not user_profile or user_profile.role != 'admin':
-        return Response({'error': 'Brak uprawnień'}, status=status.HTTP_403_FORBIDDEN)
-    
     serializer = FieldCreationSerializer(data=request.data)
     if serializer.is_valid():
         data = serializer.validated_data
@@ -282,6 +351,11 @@ def create_field(request):
             position_start=data['position_start'],
             position_end=data['position_end']
         )
+        # Pola się zmieniły - przebuduj indeks szablonu
+        try:
+            compile_document_template(document)
+        except Exception as e:
+            print(f"[WARN] Template compilation failed for document {document.id}: {e}")
         
         serializer = EditableFieldSerializer(field)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -290,13 +364,9 @@ def create_field(request):
 
 
 @api_view(['DELETE'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, IsDocumentAdmin])
 def delete_field(request, field_id: int):
     """Usuń istniejące pole do edycji (tylko admin i tylko dla własnego dokumentu)."""
-    user_profile = getattr(request.user, 'userprofile', None)
-    if not user_profile or user_profile.role != 'admin':
-        return Response({'error': 'Brak uprawnień'}, status=status.HTTP_403_FORBIDDEN)
-
     try:
         field = EditableField.objects.select_related('document').get(id=field_id)
     except EditableField.DoesNotExist:
@@ -305,18 +375,19 @@ def delete_field(request, field_id: int):
     if field.document.created_by_id != request.user.id:
         return Response({'error': 'Brak uprawnień do tego pola'}, status=status.HTTP_403_FORBIDDEN)
 
+    document = field.document
     field.delete()
+    try:
+        compile_document_template(document)
+    except Exception as e:
+        print(f"[WARN] Template compilation failed for document {document.id}: {e}")
     return Response({'success': True})
 
 
 @api_view(['POST'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, IsSectionAdmin])
 def assign_document(request):
     """Przypisanie dokumentu do użytkowników"""
-    user_profile = getattr(request.user, 'userprofile', None)
-    if not user_profile or user_profile.role != 'admin':
-        return Response({'error': 'Brak uprawnień'}, status=status.HTTP_403_FORBIDDEN)
-    
     serializer = AssignDocumentSerializer(data=request.data)
     if serializer.is_valid():
         data = serializer.validated_data
@@ -332,66 +403,181 @@ def assign_document(request):
                           status=status.HTTP_400_BAD_REQUEST)
         
         # Admin może przypisać do użytkowników z własnej sekcji lub do siebie samego
-        admin_section = (user_profile.section or '').strip()
-        if not admin_section:
-            return Response({'error': 'Administrator nie ma ustawionej sekcji w profilu.'}, status=status.HTTP_400_BAD_REQUEST)
+        admin_section = profile_info(request.user)['section']
 
-        assignments_created = []
-        invalid_targets = []
-        for user_id in data['user_ids']:
-            try:
-                user = User.objects.get(id=user_id)
-            except User.DoesNotExist:
-                invalid_targets.append(user_id)
-                continue
-
-            # Dozwolone: użytkownik z tej samej sekcji albo sam admin
-            target_profile = getattr(user, 'userprofile', None)
-            same_section = (target_profile and (target_profile.section or '').strip() == admin_section)
-            is_self = user.id == request.user.id
-            if not (same_section or is_self):
-                invalid_targets.append(user_id)
-                continue
-
-            assignment, created = DocumentAssignment.objects.get_or_create(
-                document=document,
-                user=user,
-                defaults={'status': 'pending'}
+        # Cele przypisania jednym zapytaniem: cała sekcja (użytkownicy z rolą user)
+        # albo wskazane ID ograniczone do sekcji admina i jego samego
+        if data['target'] == 'section':
+            requested = set()
+            targets = _users_by_section().filter(userprofile__role='user', profile_section=admin_section)
+        else:
+            requested = set(data['user_ids'])
+            targets = _users_by_section().filter(id__in=requested).filter(
+                Q(profile_section=admin_section) | Q(id=request.user.id)
             )
-            if created:
-                assignments_created.append(assignment)
-        
-        # Zmień status dokumentu na wysłany
-        document.status = 'sent'
-        document.save()
-        message = f'Dokument przypisano do {len(assignments_created)} użytkowników'
+        target_ids = set(targets.values_list('id', flat=True))
+        invalid_targets = sorted(requested - target_ids)
+
+        already_assigned = set(
+            DocumentAssignment.objects.filter(document=document, user_id__in=target_ids)
+            .values_list('user_id', flat=True)
+        )
+        new_ids = sorted(target_ids - already_assigned)
+        with transaction.atomic():
+            # ignore_conflicts: równoległe przypisanie tego samego użytkownika nie przerywa operacji
+            DocumentAssignment.objects.bulk_create(
+                [DocumentAssignment(document=document, user_id=user_id, status='pending') for user_id in new_ids],
+                ignore_conflicts=True,
+                batch_size=500,
+            )
+            # Zmień status dokumentu na wysłany
+            Document.objects.filter(id=document.id).update(status='sent', updated_at=timezone.now())
+
+        message = f'Dokument przypisano do {len(new_ids)} użytkowników'
         if invalid_targets:
             message += f". Pominieto ID spoza sekcji: {','.join(map(str, invalid_targets))}"
-        return Response({'success': True, 'message': message})
+        return Response({
+            'success': True,
+            'message': message,
+            'created': len(new_ids),
+            'already_assigned': len(already_assigned),
+            'invalid_user_ids': invalid_targets,
+        })
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def _admin_documents(user):
+    """Dokumenty admina ze stałą liczbą zapytań niezależnie od ich liczby: autor przez JOIN,
+    liczba przypisań z adnotacji, pola jednym dodatkowym zapytaniem."""
+    return (Document.objects
+            .filter(created_by=user)
+            .select_related('created_by')
+            .prefetch_related('editable_fields')
+            .annotate(assigned_users_count=Count('assignments', distinct=True)))
+
+
 @api_view(['GET'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, IsDocumentAdmin])
 def admin_documents(request):
     """Lista dokumentów administratora"""
-    user_profile = getattr(request.user, 'userprofile', None)
-    if not user_profile or user_profile.role != 'admin':
-        return Response({'error': 'Brak uprawnień'}, status=status.HTTP_403_FORBIDDEN)
-    
-    documents = Document.objects.filter(created_by=request.user).order_by('-created_at')
-    serializer = DocumentSerializer(documents, many=True)
-    return Response(serializer.data)
+    # Treść HTML nie jest potrzebna na liście - pobiera ją document_detail
+    documents = _admin_documents(request.user).defer('original_content', 'compiled_template')
+    return DocumentCursorPagination().paginate(documents, request, DocumentListSerializer)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsDocumentAdmin])
+def document_detail(request, document_id: int):
+    """Szczegóły dokumentu admina razem z treścią HTML"""
+    jobs.expire_stale_conversions(document_id)
+    document = _admin_documents(request.user).filter(id=document_id).first()
+    if document is None:
+        return Response({'error': 'Dokument nie istnieje'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(DocumentSerializer(document, context={'request': request}).data)
+
+
+def _with_assignment_relations(assignments):
+    """Przypisania ze wszystkim, czego potrzebuje DocumentAssignmentSerializer,
+    w stałej liczbie zapytań: dokument i użytkownik przez JOIN (bez treści HTML),
+    wartości razem z polami oraz pola dokumentów po jednym zapytaniu."""
+    assignments = (assignments
+                   .select_related('document', 'user')
+                   .defer('document__original_content', 'document__compiled_template')
+                   .prefetch_related('document__editable_fields'))
+    if reads_json():
+        # Wartości są w kolumnie DocumentAssignment.values
+        return assignments
+    return assignments.prefetch_related(
+        Prefetch('field_values', queryset=FieldValue.objects.select_related('field')),
+    )
+
+
+def _assignment_list(assignments):
+    """Przypisania dla DocumentAssignmentListSerializer: tylko kolumny wyświetlane na liście
+    (bez treści dokumentu i wartości pól), liczba wypełnionych pól z podzapytania,
+    a identyfikatory pól dokumentów jednym dodatkowym zapytaniem."""
+    columns = ['id', 'document_id', 'user_id', 'status', 'assigned_at', 'started_at', 'completed_at',
+               'revision', 'document__name', 'user__username']
+    assignments = assignments.select_related('document', 'user').prefetch_related(
+        Prefetch('document__editable_fields', queryset=EditableField.objects.only('id', 'document_id', 'field_id')),
+    )
+    if reads_json():
+        return assignments.only(*columns, 'values')
+    return assignments.only(*columns).annotate(filled_fields_count=filled_count_subquery())
+
+
+def _can_view_assignment(user, assignment) -> bool:
+    # Admin, który utworzył dokument, lub użytkownik będący właścicielem przypisania
+    return assignment.document.created_by_id == user.id or assignment.user_id == user.id
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def user_assignments(request):
-    """Lista przypisań dla użytkownika"""
-    assignments = DocumentAssignment.objects.filter(user=request.user).order_by('-assigned_at')
-    serializer = DocumentAssignmentSerializer(assignments, many=True)
-    return Response(serializer.data)
+    """Lista przypisań dla użytkownika (bez wartości pól - patrz assignment_detail)"""
+    assignments = _assignment_list(DocumentAssignment.objects.filter(user=request.user))
+    return AssignmentCursorPagination().paginate(assignments, request, DocumentAssignmentListSerializer)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def assignment_detail(request, assignment_id: int):
+    """Przypisanie z definicjami pól i zapisanymi wartościami"""
+    assignment = _with_assignment_relations(DocumentAssignment.objects.filter(id=assignment_id)).first()
+    if assignment is None:
+        return Response({'error': 'Przypisanie nie istnieje'}, status=status.HTTP_404_NOT_FOUND)
+    if not _can_view_assignment(request.user, assignment):
+        return Response({'error': 'Brak uprawnień'}, status=status.HTTP_403_FORBIDDEN)
+    return Response(DocumentAssignmentSerializer(assignment).data)
+
+
+def _versions(versions):
+    # Wersje z przypisaniem, dokumentem i użytkownikiem przez JOIN, bez dużych kolumn dokumentu
+    return (versions
+            .select_related('assignment__document', 'assignment__user')
+            .defer('assignment__document__original_content', 'assignment__document__compiled_template',
+                   'assignment__values'))
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def assignment_versions(request, assignment_id: int):
+    """Lista wygenerowanych wersji przypisania (bez treści HTML - patrz version_detail)"""
+    assignment = DocumentAssignment.objects.select_related('document').only(
+        'id', 'user_id', 'document__created_by_id').filter(id=assignment_id).first()
+    if assignment is None:
+        return Response({'error': 'Przypisanie nie istnieje'}, status=status.HTTP_404_NOT_FOUND)
+    if not _can_view_assignment(request.user, assignment):
+        return Response({'error': 'Brak uprawnień'}, status=status.HTTP_403_FORBIDDEN)
+    versions = _versions(DocumentVersion.objects.filter(assignment_id=assignment.id)).defer('content')
+    return VersionCursorPagination().paginate(versions, request, DocumentVersionListSerializer)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def version_detail(request, version_id: int):
+    """Wersja razem z treścią HTML"""
+    version = _versions(DocumentVersion.objects.filter(id=version_id)).first()
+    if version is None:
+        return Response({'error': 'Wersja nie istnieje'}, status=status.HTTP_404_NOT_FOUND)
+    if not _can_view_assignment(request.user, version.assignment):
+        return Response({'error': 'Brak uprawnień'}, status=status.HTTP_403_FORBIDDEN)
+    return Response(DocumentVersionSerializer(version).data)
+
+
+def _after_save_changes() -> dict:
+    """Zmiany przypisania po zapisie wartości (jednym UPDATE): nowa rewizja
+    oraz przejście pending -> in_progress z datą rozpoczęcia."""
+    now = timezone.now()
+    return {
+        'revision': F('revision') + 1,
+        'status': Case(When(status='pending', then=Value('in_progress')), default=F('status')),
+        'started_at': Case(
+            When(status='pending', then=Value(now, output_field=DateTimeField())),
+            default=F('started_at'),
+        ),
+    }
 
 
 @api_view(['POST'])
@@ -410,213 +596,127 @@ def submit_field_values(request):
         except DocumentAssignment.DoesNotExist:
             return Response({'error': 'Przypisanie nie istnieje'}, status=status.HTTP_404_NOT_FOUND)
         
-        # Zapisz wartości pól
-        for field_id, value in data['field_values'].items():
-            try:
-                field = EditableField.objects.get(
-                    document=assignment.document,
-                    field_id=field_id
-                )
-                field_value, created = FieldValue.objects.update_or_create(
-                    assignment=assignment,
-                    field=field,
-                    defaults={'value': value}
-                )
-            except EditableField.DoesNotExist:
-                continue
-        
-        # Zaktualizuj status przypisania
-        if assignment.status == 'pending':
-            assignment.status = 'in_progress'
-            assignment.started_at = timezone.now()
+        with transaction.atomic():
+            # Najpierw UPDATE (jak w patch_field_values): transakcja od razu bierze blokadę zapisu
+            # wiersza (na SQLite - całej bazy), więc scalenie JSON w write_values nie przeplata się
+            # z równoległym zapisem także tam, gdzie select_for_update nic nie robi
+            DocumentAssignment.objects.filter(id=assignment.id).update(**_after_save_changes())
+            saved, unknown_field_ids = write_values(assignment, data['field_values'])
+            # Rewizja nadana przez nasz UPDATE, a nie odczytana przed zapisem -
+            # równoległy zapis mógł ją w międzyczasie podbić
+            assignment.refresh_from_db(fields=['revision'])
         
-        assignment.save()
-        
-        return Response({'success': True, 'message': 'Wartości zostały zapisane'})
+        return Response({
+            'success': True,
+            'message': 'Wartości zostały zapisane',
+            'saved': saved,
+            'unknown_field_ids': unknown_field_ids,
+            'revision': assignment.revision,
+        })
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-@api_view(['POST'])
+@api_view(['PATCH'])
 @permission_classes([IsAuthenticated])
-def complete_assignment(request, assignment_id):
-    """Finalizacja wypełniania dokumentu"""
-    try:
-        assignment = DocumentAssignment.objects.get(
-            id=assignment_id,
-            user=request.user
-        )
-    except DocumentAssignment.DoesNotExist:
+def patch_field_values(request, assignment_id: int):
+    """Zapis tylko zmienionych pól (autosave).
+
+    Klient wysyła ostatnią znaną rewizję przypisania. Jeśli w międzyczasie ktoś
+    zapisał inne wartości (np. w drugiej karcie), zwracamy 409 z aktualną rewizją
+    zamiast nadpisywać cudze zmiany.
+    """
+    serializer = PatchFieldValuesSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    data = serializer.validated_data
+
+    assignment = (DocumentAssignment.objects
+                  .filter(id=assignment_id, user=request.user)
+                  .only('id', 'document_id')
+                  .first())
+    if assignment is None:
         return Response({'error': 'Przypisanie nie istnieje'}, status=status.HTTP_404_NOT_FOUND)
-    
-    # Sprawdź czy wszystkie pola zostały wypełnione
-    required_fields = assignment.document.editable_fields.all()
-    filled_fields = assignment.field_values.all()
-    
-    if required_fields.count() != filled_fields.count():
-        return Response({'error': 'Nie wszystkie pola zostały wypełnione'}, 
-                      status=status.HTTP_400_BAD_REQUEST)
-    
-    assignment.status = 'completed'
-    assignment.completed_at = timezone.now()
-    assignment.save()
 
-    # Wygeneruj plik DOCX z wstawionymi wartościami pól i zapisz wersję
-    try:
-        _generate_assignment_docx_version(assignment)
-    except Exception as e:
-        # Nie blokuj kończenia, jeśli generowanie pliku się nie powiedzie
-        print(f"[WARN] DOCX generation failed for assignment {assignment.id}: {e}")
-    
-    return Response({'success': True, 'message': 'Dokument został wysłany pomyślnie'})
+    with transaction.atomic():
+        # Warunkowy UPDATE rezerwuje rewizję - przegrany z dwóch równoległych zapisów dostaje 409
+        claimed = (DocumentAssignment.objects
+                   .filter(id=assignment.id, revision=data['revision'])
+                   .update(**_after_save_changes()))
+        if not claimed:
+            current = DocumentAssignment.objects.filter(id=assignment.id).values_list('revision', flat=True).first()
+            return Response(
+                {'error': 'Przypisanie zostało zmienione w międzyczasie', 'revision': current},
+                status=status.HTTP_409_CONFLICT,
+            )
+        saved, unknown_field_ids = write_values(assignment, data['values'])
 
+    response = {'revision': data['revision'] + 1, 'saved': saved}
+    if unknown_field_ids:
+        response['unknown_field_ids'] = unknown_field_ids
+    return Response(response)
 
-def _replace_in_runs(runs, old: str, new: str):
-    """Replace text possibly spanning multiple runs while preserving styles
-    outside the replaced span.
 
-    - Only the text inside the matched placeholder (old) will be unified (goes into
-      the first affected run); text before and after keeps their original runs/styles.
-    - If no match, returns False.
-    """
-    try:
-        if not runs or not old:
-            return False
-
-        texts = [r.text or '' for r in runs]
-        combined = ''.join(texts)
-        start = combined.find(old)
-        if start < 0:
-            return False
-        end = start + len(old)
-
-        # Compute offsets per run: [start_pos, end_pos)
-        offsets = []
-        pos = 0
-        for t in texts:
-            offsets.append((pos, pos + len(t)))
-            pos += len(t)
-
-        # Find runs overlapping [start, end)
-        in_span = [i for i, (s, e) in enumerate(offsets) if not (e <= start or s >= end)]
-        if not in_span:
-            return False
-
-        first_i, last_i = in_span[0], in_span[-1]
-        first_s, first_e = offsets[first_i]
-        last_s, last_e = offsets[last_i]
-
-        # Compute prefix/suffix relative to first/last affected runs
-        first_run_text = texts[first_i]
-        last_run_text = texts[last_i]
-
-        prefix_len = max(0, start - first_s)
-        suffix_start = max(0, end - last_s)
-
-        if first_i == last_i:
-            # Replacement fully inside a single run
-            runs[first_i].text = (
-                first_run_text[:prefix_len] + new + first_run_text[suffix_start:]
-            )
-        else:
-            # Set first run: prefix + new
-            runs[first_i].text = first_run_text[:prefix_len] + new
-            # Clear middle runs
-            for i in in_span[1:-1]:
-                runs[i].text = ''
-            # Set last run: suffix
-            runs[last_i].text = last_run_text[suffix_start:]
-        return True
-    except Exception:
-        return False
-
-
-def _generate_assignment_docx_version(assignment: DocumentAssignment) -> DocumentVersion:
-    """Utwórz plik DOCX z wartościami pól. Zachowujemy style, podmieniając tekst w istniejących runach.
-    Uwaga: jeśli placeholder (original_value) został rozbity na wiele runów, prosta podmiana może go nie znaleźć.
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def complete_assignment(request, assignment_id):
+    """Finalizacja wypełniania dokumentu.
+
+    Sprawdzenie kompletności i zmiana stanu to jeden warunkowy UPDATE; plik DOCX
+    generujemy w tle po zatwierdzeniu transakcji.
     """
-    doc_model = assignment.document
-    file_field = doc_model.file
-    if not file_field or not file_field.name.lower().endswith('.docx'):
-        raise ValueError('Brak pliku DOCX do przetworzenia')
-
-    # Mapuj field_id -> value i field.original_value
-    values_by_field_id = {fv.field.field_id: fv.value for fv in assignment.field_values.select_related('field').all()}
-    fields = list(doc_model.editable_fields.all())
-
-    with file_field.open('rb') as f:
-        doc = DocxDocument(f)
-
-    # Podmień w paragrafach
-    for para in doc.paragraphs:
-        for field in fields:
-            old = field.original_value or ''
-            if not old:
-                continue
-            new = values_by_field_id.get(field.field_id)
-            if new is None:
-                continue
-            _replace_in_runs(para.runs, old, new)
-
-    # Podmień w tabelach
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                for p in cell.paragraphs:
-                    for field in fields:
-                        old = field.original_value or ''
-                        if not old:
-                            continue
-                        new = values_by_field_id.get(field.field_id)
-                        if new is None:
-                            continue
-                        _replace_in_runs(p.runs, old, new)
-
-    # Zapisz do pamięci i do FileField
-    buf = io.BytesIO()
-    doc.save(buf)
-    buf.seek(0)
-
-    def _sanitize(name: str) -> str:
-        name = name or ''
-        return ''.join(ch if ch.isalnum() or ch in (' ', '-', '_') else '_' for ch in name).strip().replace(' ', '_')
-
-    filename_base = doc_model.name.rsplit('.', 1)[0]
-    safe_doc = _sanitize(filename_base)
-    safe_user = _sanitize(assignment.user.username)
-    # Prefer pattern: username__document.docx for easy sorting by user
-    out_name = f"{safe_user}__{safe_doc}.docx"
-
-    content = ContentFile(buf.read())
-    version = DocumentVersion.objects.create(
-        assignment=assignment,
-        content='',
-    )
-    version.generated_file.save(out_name, content, save=True)
-    return version
+    pending = (DocumentAssignment.objects
+               .filter(id=assignment_id, user=request.user)
+               .exclude(status='completed'))
+    if storage_mode() == 'json':
+        # Wartości w kolumnie JSON sprawdzamy w Pythonie; UPDATE warunkowy na rewizji
+        # gwarantuje, że od sprawdzenia nikt ich nie zmienił
+        assignment = pending.only('id', 'document_id', 'values', 'revision').first()
+        if assignment is not None:
+            if missing_field_ids(assignment):
+                return Response({'error': 'Nie wszystkie pola zostały wypełnione'},
+                              status=status.HTTP_400_BAD_REQUEST)
+            pending = pending.filter(revision=assignment.revision)
+    else:
+        pending = pending.exclude(missing_value_exists())
+
+    if pending.update(status='completed', completed_at=timezone.now()):
+        # Wygeneruj plik DOCX z wstawionymi wartościami pól i zapisz wersję
+        generate_version_after_commit(assignment_id)
+        return Response({'success': True, 'message': 'Dokument został wysłany pomyślnie'})
+
+    # Nic nie zaktualizowano - ustal przyczynę
+    current_status = (DocumentAssignment.objects
+                      .filter(id=assignment_id, user=request.user)
+                      .values_list('status', flat=True)
+                      .first())
+    if current_status is None:
+        return Response({'error': 'Przypisanie nie istnieje'}, status=status.HTTP_404_NOT_FOUND)
+    if current_status == 'completed':
+        return Response({'success': True, 'message': 'Dokument został już wysłany'})
+    return Response({'error': 'Nie wszystkie pola zostały wypełnione'}, 
+                  status=status.HTTP_400_BAD_REQUEST)
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def download_assignment_docx(request, assignment_id: int):
-    """Zwróć wygenerowany plik DOCX dla przypisania. Jeśli nie istnieje, wygeneruj go."""
+    """Zwróć wygenerowany plik DOCX dla przypisania. Jeśli nie istnieje lub jest nieaktualny, wygeneruj go."""
     try:
-        assignment = DocumentAssignment.objects.get(id=assignment_id)
+        assignment = (DocumentAssignment.objects.select_related('document')
+                      .defer('document__original_content').get(id=assignment_id))
     except DocumentAssignment.DoesNotExist:
         return Response({'error': 'Przypisanie nie istnieje'}, status=status.HTTP_404_NOT_FOUND)
 
-    # Dostęp: admin, który utworzył dokument, lub użytkownik będący właścicielem assignment
-    is_admin_owner = assignment.document.created_by_id == request.user.id
-    is_user_self = assignment.user_id == request.user.id
-    if not (is_admin_owner or is_user_self):
+    if not _can_view_assignment(request.user, assignment):
         return Response({'error': 'Brak uprawnień'}, status=status.HTTP_403_FORBIDDEN)
 
-    version = assignment.versions.order_by('-created_at').first()
-    if not version or not version.generated_file:
-        try:
-            version = _generate_assignment_docx_version(assignment)
-        except Exception as e:
-            return Response({'error': f'Błąd generowania pliku: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        # Wersja z odciskiem zgodnym z bieżącymi polami i wartościami; renderujemy tylko przy
+        # niezgodności, a równoległe żądania o ten sam plik czekają na jedno renderowanie
+        version = get_or_render_version(assignment)
+    except Exception as e:
+        return Response({'error': f'Błąd generowania pliku: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
 
     if not version.generated_file:
         return Response({'error': 'Brak wygenerowanego pliku'}, status=status.HTTP_404_NOT_FOUND)
@@ -627,13 +727,9 @@ def download_assignment_docx(request, assignment_id: int):
 
 
 @api_view(['DELETE'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, IsDocumentAdmin])
 def delete_document(request, document_id: int):
     """Usuń dokument (tylko admin i tylko własne). Czyści również pliki wygenerowane oraz oryginalny plik."""
-    user_profile = getattr(request.user, 'userprofile', None)
-    if not user_profile or user_profile.role != 'admin':
-        return Response({'error': 'Brak uprawnień'}, status=status.HTTP_403_FORBIDDEN)
-
     try:
         document = Document.objects.get(id=document_id, created_by=request.user)
     except Document.DoesNotExist:
@@ -641,32 +737,30 @@ def delete_document(request, document_id: int):
 
     with transaction.atomic():
         # Usuń wygenerowane pliki wersji powiązanych przypisań
-        versions = DocumentVersion.objects.filter(assignment__document=document)
+        versions = DocumentVersion.objects.filter(assignment__document=document).only('id', 'generated_file')
         for v in versions:
             if v.generated_file:
                 try:
                     v.generated_file.delete(save=False)
                 except Exception:
                     pass
-        # Usuń plik źródłowy dokumentu
-        if document.file:
+        # Usuń plik źródłowy dokumentu; współdzielony plik tylko, gdy nikt już z niego nie korzysta
+        if document.blob_id is None and document.file:
             try:
                 document.file.delete(save=False)
             except Exception:
                 pass
         document.delete()
+        if document.blob_id is not None:
+            blobs.release(document.blob_id)
 
     return Response({'success': True})
 
 
 @api_view(['DELETE'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, IsDocumentAdmin])
 def delete_assignment(request, assignment_id: int):
     """Usuń przypisanie (np. ukończony dokument). Admin może usuwać tylko przypisania swoich dokumentów."""
-    user_profile = getattr(request.user, 'userprofile', None)
-    if not user_profile or user_profile.role != 'admin':
-        return Response({'error': 'Brak uprawnień'}, status=status.HTTP_403_FORBIDDEN)
-
     try:
         assignment = DocumentAssignment.objects.select_related('document').get(id=assignment_id)
     except DocumentAssignment.DoesNotExist:
@@ -677,7 +771,7 @@ def delete_assignment(request, assignment_id: int):
 
     with transaction.atomic():
         # Usuń wygenerowane pliki z wersji
-        for v in assignment.versions.all():
+        for v in assignment.versions.only('id', 'generated_file'):
             if v.generated_file:
                 try:
                     v.generated_file.delete(save=False)
@@ -689,33 +783,23 @@ def delete_assignment(request, assignment_id: int):
 
 
 @api_view(['GET'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, IsDocumentAdmin])
 def completed_assignments(request):
     """Lista ukończonych przypisań (dla adminów)"""
-    user_profile = getattr(request.user, 'userprofile', None)
-    if not user_profile or user_profile.role != 'admin':
-        return Response({'error': 'Brak uprawnień'}, status=status.HTTP_403_FORBIDDEN)
-    
-    assignments = DocumentAssignment.objects.filter(
+    assignments = _assignment_list(DocumentAssignment.objects.filter(
         document__created_by=request.user,
         status='completed'
-    ).order_by('-completed_at')
-    
-    serializer = DocumentAssignmentSerializer(assignments, many=True)
-    return Response(serializer.data)
+    ))
+    return CompletedAssignmentCursorPagination().paginate(assignments, request, DocumentAssignmentListSerializer)
 
 
 @api_view(['GET'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, IsDocumentAdmin])
 def download_completed_zip(request):
     """Zbiorcze pobranie ukończonych przypisań jako ZIP.
     Opcjonalnie przyjmujemy query param ?document_id=ID, aby ograniczyć do jednego dokumentu.
     Dostępne wyłącznie dla admina i tylko dla jego dokumentów.
     """
-    user_profile = getattr(request.user, 'userprofile', None)
-    if not user_profile or user_profile.role != 'admin':
-        return Response({'error': 'Brak uprawnień'}, status=status.HTTP_403_FORBIDDEN)
-
     document_id = request.GET.get('document_id')
     assignments_qs = DocumentAssignment.objects.filter(
         document__created_by=request.user,
@@ -728,47 +812,80 @@ def download_completed_zip(request):
             return Response({'error': 'Dokument nie istnieje lub nie masz do niego dostępu'}, status=status.HTTP_404_NOT_FOUND)
         assignments_qs = assignments_qs.filter(document=doc)
 
-    assignments = list(assignments_qs.order_by('document__name', 'user__username'))
+    assignments = list(
+        assignments_qs.select_related('document', 'user').defer('document__original_content')
+        .order_by('document__name', 'user__username')
+    )
     if not assignments:
         return Response({'error': 'Brak ukończonych przypisań do pobrania'}, status=status.HTTP_404_NOT_FOUND)
 
-    # Zbuduj ZIP w pamięci
-    buf = io.BytesIO()
-    def _sanitize(name: str) -> str:
-        name = name or ''
-        return ''.join(ch if ch.isalnum() or ch in (' ', '-', '_') else '_' for ch in name).strip().replace(' ', '_')
-
-    with zipfile.ZipFile(buf, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
-        for ass in assignments:
-            # Upewnij się, że wersja istnieje (wygeneruj jeśli brak)
-            version = ass.versions.order_by('-created_at').first()
-            if not version or not version.generated_file:
-                try:
-                    version = _generate_assignment_docx_version(ass)
-                except Exception:
-                    continue
-            if not version or not version.generated_file:
-                continue
+    zip_name = archives.export_filename(request.user, doc if document_id else None)
 
-            try:
-                f = version.generated_file
-                with f.open('rb') as fh:
-                    data = fh.read()
-                # Zbuduj nazwę pliku w ZIP
-                base = _sanitize(ass.document.name.rsplit('.', 1)[0])
-                uname = _sanitize(ass.user.username)
-                # Prefer same pattern as generator
-                arcname = f"{uname}/{uname}__{base}.docx"
-                zf.writestr(arcname, data)
-            except Exception:
-                continue
+    # Brakujące wersje generujemy równolegle (pula procesów) przed budową archiwum
+    versions, errors = ensure_versions(assignments)
+    archives.drop_missing_files(assignments, versions, errors)
 
-    buf.seek(0)
-    stamp = datetime.now().strftime('%Y%m%d_%H%M')
-    if document_id:
-        zip_base = _sanitize(doc.name.rsplit('.', 1)[0])
-        zip_name = f"{zip_base}_completed_{stamp}.zip"
-    else:
-        zip_name = f"completed_{_sanitize(request.user.username)}_{stamp}.zip"
-    response = FileResponse(buf, as_attachment=True, filename=zip_name)
+    # ZIP budowany w locie i wysyłany strumieniowo (bez trzymania całości w pamięci)
+    response = StreamingHttpResponse(
+        archives.stream_zip(archives.completed_members(assignments, versions),
+                            archives.errors_report(assignments, errors)),
+        content_type='application/zip',
+    )
+    response['Content-Disposition'] = content_disposition_header(True, zip_name)
+    response['X-Export-Errors'] = str(len(errors))
     return response
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated, IsDocumentAdmin])
+def create_export(request):
+    """Zleć eksport ukończonych przypisań do ZIP (opcjonalnie document_id).
+    Jeśli archiwum dla tego samego zakresu jest gotowe, zwracamy je od razu (cached=True).
+    """
+    document = None
+    document_id = (request.data or {}).get('document_id')
+    if document_id:
+        try:
+            document = Document.objects.get(id=int(document_id), created_by=request.user)
+        except (Document.DoesNotExist, ValueError, TypeError):
+            return Response({'error': 'Dokument nie istnieje lub nie masz do niego dostępu'}, status=status.HTTP_404_NOT_FOUND)
+
+    if not exports.completed_queryset(request.user, document).exists():
+        return Response({'error': 'Brak ukończonych przypisań do pobrania'}, status=status.HTTP_404_NOT_FOUND)
+
+    with transaction.atomic():
+        job, cached = exports.request_export(request.user, document)
+
+    data = ProcessingJobSerializer(job).data
+    data['cached'] = cached
+    return Response(data, status=status.HTTP_200_OK if job.status == 'done' else status.HTTP_202_ACCEPTED)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_status(request, job_id: int):
+    """Postęp eksportu ZIP."""
+    try:
+        job = ProcessingJob.objects.get(id=job_id, kind='export', created_by=request.user)
+    except ProcessingJob.DoesNotExist:
+        return Response({'error': 'Eksport nie istnieje'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(ProcessingJobSerializer(jobs.expire_if_stale(job)).data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def download_export(request, job_id: int):
+    """Pobierz gotowe archiwum eksportu."""
+    try:
+        job = ProcessingJob.objects.get(id=job_id, kind='export', created_by=request.user)
+    except ProcessingJob.DoesNotExist:
+        return Response({'error': 'Eksport nie istnieje'}, status=status.HTTP_404_NOT_FOUND)
+    if job.status != 'done' or not job.result_file:
+        return Response({'error': 'Archiwum nie jest jeszcze gotowe'}, status=status.HTTP_409_CONFLICT)
+
+    file = job.result_file
+    try:
+        fh = file.open('rb')
+    except FileNotFoundError:
+        return Response({'error': 'Archiwum wygasło, zleć eksport ponownie'}, status=status.HTTP_410_GONE)
+    return FileResponse(fh, as_attachment=True, filename=file.name.split('/')[-1])
@@ -0,0 +1,86 @@
+"""Funkcje wykonywane w procesach roboczych (patrz documents.jobs).
+
+Moduł nie importuje modeli Django - procesy robocze dostają wyłącznie
+ścieżki do plików i proste struktury danych, a wynik zwracają jako wartość.
+"""
+import hashlib
+import os
+import tempfile
+import time
+
+import mammoth  # konwersja .docx -> HTML
+import mammoth.images
+from django.contrib.auth.hashers import make_password
+from docx import Document as DocxDocument
+
+from . import docx_template, docx_zip
+
+
+# Typy obrazów zapisywanych jako osobne pliki; pozostałe (np. EMF/WMF, SVG) zostają w HTML jako data URI
+IMAGE_EXTENSIONS = {
+    'image/png': '.png',
+    'image/jpeg': '.jpg',
+    'image/gif': '.gif',
+    'image/bmp': '.bmp',
+    'image/tiff': '.tiff',
+    'image/webp': '.webp',
+}
+
+
+def _image_writer(images_dir: str, images_url: str):
+    """Handler obrazów mammoth: zapisuje obraz pod nazwą ze skrótu SHA-256 treści
+    (ten sam obraz w wielu dokumentach to jeden plik) i zwraca jego URL."""
+    def convert(image):
+        ext = IMAGE_EXTENSIONS.get(image.content_type)
+        if ext is None:
+            return mammoth.images.data_uri(image)
+        with image.open() as stream:
+            data = stream.read()
+        name = hashlib.sha256(data).hexdigest() + ext
+        path = os.path.join(images_dir, name[:2], name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Zapis przez plik tymczasowy - równoległa konwersja nie zobaczy niepełnego obrazu
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return {'src': images_url + name}
+    return mammoth.images.img_element(convert)
+
+
+def convert_docx_to_html(path: str, images_dir: str = None, images_url: str = '') -> dict:
+    """Konwertuj plik DOCX do HTML. Zwraca HTML oraz znaczniki czasu pracy procesu.
+    images_dir - zapisuj obrazy jako pliki w tym katalogu (w HTML adres images_url + nazwa)
+    zamiast osadzać je w HTML jako base64."""
+    started = time.time()
+    options = {}
+    if images_dir:
+        options['convert_image'] = _image_writer(images_dir, images_url)
+    with open(path, 'rb') as f:
+        result = mammoth.convert_to_html(f, **options)
+    return {
+        'html': result.value or '',
+        'started_at': started,
+        'finished_at': time.time(),
+    }
+
+
+def render_docx(src_path: str, dst_path: str, compiled: dict, values: dict, mode: str = 'zip') -> str:
+    """Wygeneruj plik DOCX z wartościami pól na podstawie indeksu szablonu.
+
+    mode - 'zip' (przepisuje tylko części XML z polami) lub 'docx' (python-docx).
+    """
+    if mode == 'docx':
+        doc = DocxDocument(src_path)
+        docx_template.apply_template(doc, compiled, values)
+        doc.save(dst_path)
+    else:
+        with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+            docx_zip.render_zip(src, dst, compiled, values)
+    return dst_path
+
+
+def hash_passwords(passwords: list) -> list:
+    """Skróty haseł (PASSWORD_HASHERS) dla listy haseł; puste hasło daje konto bez hasła."""
+    return [make_password(p or None) for p in passwords]
@@ -92,6 +92,7 @@ function App() {
         if (popup.closed) {
           window.clearInterval(timer);
           try {
+            await apiClient.exchangeSessionForTokens();
             const userData = await apiClient.getCurrentUser() as User;
             setAuthState({ user: userData, isAuthenticated: true, isLoading: false });
             // Po zalogowaniu przez Discord też ustaw przekierowanie na /, aby trafić do właściwego panelu
@@ -1,9 +1,14 @@
 import React, { useState, useRef, useEffect } from 'react';
-import { Document, EditableField, User, DocumentAssignment } from '../../types';
+import { Document, EditableField, User, DocumentAssignment, ProcessingJob, Page } from '../../types';
 import apiClient from '../../services/api';
 import './AdminPanel.css';
 import { saveAs } from 'file-saver';
 
+// Limity odpytywania zadań w tle (co 1 s) - nieco dłużej niż backend czeka przed uznaniem
+// zadania za porzucone (jobs.JOB_STALE_AFTER: konwersja 15 min, eksport 30 min)
+const JOB_MAX_POLLS = 16 * 60;
+const EXPORT_MAX_POLLS = 31 * 60;
+
 interface AdminPanelProps {
   user: User;
   onLogout: () => void;
@@ -13,6 +18,7 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ user, onLogout }) => {
   const [documents, setDocuments] = useState<Document[]>([]);
   const [selectedDocument, setSelectedDocument] = useState<Document | null>(null);
   const [completedAssignments, setCompletedAssignments] = useState<DocumentAssignment[]>([]);
+  const [completedNext, setCompletedNext] = useState<string | null>(null);
   const [users, setUsers] = useState<User[]>([]);
   const [selectedUsers, setSelectedUsers] = useState<number[]>([]);
   const [isUploading, setIsUploading] = useState(false);
@@ -29,7 +35,9 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ user, onLogout }) => {
         ]);
         setUsers(usersData as User[]);
         setDocuments(documentsData as Document[]);
-        setCompletedAssignments(completed as DocumentAssignment[]);
+        const page = completed as Page<DocumentAssignment>;
+        setCompletedAssignments(page.results);
+        setCompletedNext(page.next);
       } catch (error) {
         console.error('Błąd pobierania danych:', error);
         alert('Błąd pobierania danych z serwera');
@@ -41,6 +49,85 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ user, onLogout }) => {
 
   // helpery niewykorzystane zostały usunięte
 
+  // Odpytywanie zadania w tle co sekundę, ale najwyżej maxPolls razy - backend i tak oznacza
+  // porzucone zadania jako nieudane, a pętla nie może kręcić się bez końca
+  const pollJob = async (
+    job: ProcessingJob,
+    fetchJob: (id: number) => Promise<ProcessingJob>,
+    maxPolls: number,
+    onProgress?: (job: ProcessingJob) => void,
+  ): Promise<ProcessingJob> => {
+    let current = job;
+    for (let polls = 0; current.status === 'queued' || current.status === 'running'; polls++) {
+      if (polls >= maxPolls) {
+        throw new Error('Zadanie trwa zbyt długo - spróbuj ponownie później');
+      }
+      onProgress?.(current);
+      await new Promise(resolve => setTimeout(resolve, 1000));
+      current = await fetchJob(current.id);
+    }
+    return current;
+  };
+
+  // Konwersja DOCX -> HTML odbywa się w tle: czekamy na zakończenie zadania
+  // i pobieramy odświeżony dokument z listy
+  const waitForJob = async (job: ProcessingJob, documentId: number): Promise<Document | null> => {
+    const current = await pollJob(job, id => apiClient.getJob(id) as Promise<ProcessingJob>, JOB_MAX_POLLS);
+    if (current.status === 'failed') {
+      throw new Error(current.error || 'Błąd przetwarzania pliku DOCX');
+    }
+    const refreshed = await apiClient.getAdminDocuments() as Document[];
+    setDocuments(refreshed);
+    return await apiClient.getDocument(documentId) as Document;
+  };
+
+  // Lista dokumentów nie zawiera treści HTML - pobieramy ją przy wyborze dokumentu
+  const selectDocument = async (doc: Document) => {
+    setSelectedDocument(doc);
+    try {
+      const detail = await apiClient.getDocument(doc.id) as Document;
+      setSelectedDocument(current => (current && current.id === detail.id ? detail : current));
+    } catch (error) {
+      console.error('Błąd pobierania dokumentu:', error);
+    }
+  };
+
+  // Eksport ZIP: zlecenie zadania, odpytywanie postępu, pobranie gotowego archiwum
+  const [exportProgress, setExportProgress] = useState<string | null>(null);
+  const downloadExport = async (documentId?: number) => {
+    try {
+      const queued = await apiClient.createExport(documentId) as ProcessingJob;
+      const job = await pollJob(
+        queued,
+        id => apiClient.getExport(id) as Promise<ProcessingJob>,
+        EXPORT_MAX_POLLS,
+        current => setExportProgress(`Przygotowywanie archiwum: ${current.progress_done}/${current.progress_total || '?'}`),
+      );
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Nie udało się przygotować ZIPa');
+      }
+      const { blob, filename } = await apiClient.fetchExport(job.id);
+      saveAs(blob, filename);
+      if (job.error) alert(`Niektórych plików nie udało się wygenerować - szczegóły w BLEDY.txt w archiwum`);
+    } catch (e) {
+      console.error('Błąd pobierania ZIP:', e);
+      alert(e instanceof Error ? e.message : 'Nie udało się pobrać ZIPa');
+    } finally {
+      setExportProgress(null);
+    }
+  };
+
+  const loadMoreCompleted = async () => {
+    if (!completedNext) return;
+    try {
+      const page = await apiClient.getCompletedAssignments(completedNext) as Page<DocumentAssignment>;
+      setCompletedAssignments(prev => [...prev, ...page.results]);
+      setCompletedNext(page.next);
+    } catch (error) {
+      console.error('Błąd pobierania ukończonych przypisań:', error);
+    }
+  };
+
   const handleFileUpload = async (event: React.ChangeEvent<HTMLInputElement>) => {
     const file = event.target.files?.[0];
     if (!file) return;
@@ -53,7 +140,8 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ user, onLogout }) => {
 
       const newDocument = await apiClient.uploadDocument(formData) as Document;
       setDocuments(prev => [...prev, newDocument]);
-      setSelectedDocument(newDocument);
+      const processed = newDocument.job ? await waitForJob(newDocument.job, newDocument.id) : newDocument;
+      setSelectedDocument(processed || newDocument);
       
       alert('Dokument został pomyślnie wgrany!');
     } catch (error) {
@@ -125,6 +213,24 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ user, onLogout }) => {
     }
   };
 
+  const handleSendToSection = async () => {
+    if (!selectedDocument) return;
+    if (!window.confirm('Wysłać dokument do wszystkich użytkowników z Twojej sekcji?')) return;
+    try {
+      const result = await apiClient.assignDocumentToSection(selectedDocument.id) as { message: string };
+      const updatedDocument: Document = {
+        ...selectedDocument,
+        status: 'sent',
+      } as Document;
+      setDocuments(prev => prev.map(doc => doc.id === selectedDocument.id ? updatedDocument : doc));
+      setSelectedDocument(updatedDocument);
+      alert(result.message);
+    } catch (e) {
+      console.error('Błąd podczas wysyłania dokumentu:', e);
+      alert(e instanceof Error ? e.message : 'Nie udało się przypisać dokumentu');
+    }
+  };
+
   const handleUserSelection = (userId: number) => {
     setSelectedUsers(prev => 
       prev.includes(userId)
@@ -173,9 +279,12 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ user, onLogout }) => {
                   key={doc.id}
                   className={`document-item ${selectedDocument?.id === doc.id ? 'selected' : ''}`}
                 >
-                  <div onClick={() => setSelectedDocument(doc)} style={{ cursor: 'pointer' }}>
+                  <div onClick={() => selectDocument(doc)} style={{ cursor: 'pointer' }}>
                     <h3>{doc.name}</h3>
                     <p>Status: {doc.status}</p>
+                    {doc.processing_status !== 'ready' && (
+                      <p>Konwersja: {doc.processing_status === 'processing' ? 'w toku...' : 'błąd'}</p>
+                    )}
                     <p>Pola do edycji: {doc.editable_fields?.length || 0}</p>
                     <p>Przypisani użytkownicy: {doc.assigned_users_count || 0}</p>
                   </div>
@@ -223,9 +332,10 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ user, onLogout }) => {
                   onClick={async () => {
                     if (!selectedDocument) return;
                     try {
-                      const updated = await apiClient.reprocessDocument(selectedDocument.id) as Document;
-                      setSelectedDocument(updated);
-                      setDocuments(prev => prev.map(d => d.id === updated.id ? updated : d));
+                      const queued = await apiClient.reprocessDocument(selectedDocument.id) as Document;
+                      setSelectedDocument(queued);
+                      const updated = queued.job ? await waitForJob(queued.job, queued.id) : queued;
+                      if (updated) setSelectedDocument(updated);
                     } catch (e) {
                       console.error('Błąd odświeżania zawartości:', e);
                       alert(e instanceof Error ? e.message : 'Nie udało się odświeżyć zawartości');
@@ -238,7 +348,7 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ user, onLogout }) => {
               </div>
               <div 
                 className="document-preview"
-                dangerouslySetInnerHTML={{ __html: selectedDocument.original_content }}
+                dangerouslySetInnerHTML={{ __html: selectedDocument.original_content || '' }}
               />
             </div>
 
@@ -300,6 +410,11 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ user, onLogout }) => {
                   Wyślij dokument do wybranych użytkowników
                 </button>
               )}
+              {selectedDocument.editable_fields && selectedDocument.editable_fields.length > 0 && (
+                <button onClick={handleSendToSection} className="send-button">
+                  Wyślij dokument do całej sekcji
+                </button>
+              )}
             </div>
           </div>
         )}
@@ -309,34 +424,21 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ user, onLogout }) => {
           <div style={{ display: 'flex', gap: 8, marginBottom: 8 }}>
             <button
               className="send-button"
-              onClick={async () => {
-                try {
-                  const { blob, filename } = await apiClient.fetchCompletedZip();
-                  saveAs(blob, filename);
-                } catch (e) {
-                  console.error('Błąd pobierania ZIP:', e);
-                  alert(e instanceof Error ? e.message : 'Nie udało się pobrać ZIPa');
-                }
-              }}
+              disabled={exportProgress !== null}
+              onClick={() => downloadExport()}
             >
               Pobierz wszystkie (ZIP)
             </button>
             {selectedDocument && (
               <button
                 className="send-button"
-                onClick={async () => {
-                  try {
-                    const { blob, filename } = await apiClient.fetchCompletedZip(selectedDocument.id);
-                    saveAs(blob, filename);
-                  } catch (e) {
-                    console.error('Błąd pobierania ZIP:', e);
-                    alert(e instanceof Error ? e.message : 'Nie udało się pobrać ZIPa');
-                  }
-                }}
+                disabled={exportProgress !== null}
+                onClick={() => downloadExport(selectedDocument.id)}
               >
                 Pobierz ZIP dla tego dokumentu
               </button>
             )}
+            {exportProgress && <span>{exportProgress}</span>}
           </div>
           <div className="completed-documents-list">
             {completedAssignments.length === 0 && (
@@ -381,6 +483,11 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ user, onLogout }) => {
                 </button>
               </div>
             ))}
+            {completedNext && (
+              <button className="send-button" onClick={loadMoreCompleted}>
+                Pokaż więcej
+              </button>
+            )}
           </div>
         </div>
       </div>
@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { User, DocumentAssignment, EditableField } from '../../types';
-import apiClient from '../../services/api';
+import apiClient, { ApiError } from '../../services/api';
 import './UserPanel.css';
 
 interface UserPanelProps {
@@ -13,6 +13,9 @@ const UserPanel: React.FC<UserPanelProps> = ({ user, onLogout }) => {
   const [selectedAssignment, setSelectedAssignment] = useState<DocumentAssignment | null>(null);
   // Kluczem jest field_id (string), bo backend oczekuje mapy { field_id: value }
   const [fieldValues, setFieldValues] = useState<{ [fieldId: string]: string }>({});
+  // Wartości i rewizja ostatnio zapisane na serwerze - wysyłamy tylko różnice
+  const [savedValues, setSavedValues] = useState<{ [fieldId: string]: string }>({});
+  const [revision, setRevision] = useState(0);
 
   // Pobierz przypisania użytkownika z backendu
   useEffect(() => {
@@ -34,17 +37,47 @@ const UserPanel: React.FC<UserPanelProps> = ({ user, onLogout }) => {
     }));
   };
 
+  // Zapisz tylko pola zmienione od ostatniego zapisu. Przy konflikcie rewizji
+  // (zmiany z innej karty) przerywamy i prosimy o odświeżenie.
+  const saveChanges = async (assignment: DocumentAssignment): Promise<number | null> => {
+    const changed: { [key: string]: string } = {};
+    Object.keys(fieldValues).forEach(key => {
+      if (fieldValues[key] !== savedValues[key]) changed[key] = fieldValues[key];
+    });
+    if (Object.keys(changed).length === 0) return revision;
+    try {
+      const result = await apiClient.patchFieldValues(assignment.id, revision, changed);
+      if (result.unknown_field_ids && result.unknown_field_ids.length > 0) {
+        console.warn('Pominięto nieznane pola:', result.unknown_field_ids);
+      }
+      setRevision(result.revision);
+      setSavedValues(prev => ({ ...prev, ...changed }));
+      return result.revision;
+    } catch (e) {
+      if (e instanceof ApiError && e.status === 409) {
+        alert('Ten dokument został zmieniony w innym oknie. Odśwież stronę, aby zobaczyć aktualne wartości.');
+        return null;
+      }
+      throw e;
+    }
+  };
+
   const handleSave = async () => {
     if (!selectedAssignment) return;
     try {
-      await apiClient.submitFieldValues(selectedAssignment.id, fieldValues);
+      const newRevision = await saveChanges(selectedAssignment);
+      if (newRevision === null) return;
       // Lokalna aktualizacja statusu i liczby wartości
       const updatedAssignment: DocumentAssignment = {
         ...selectedAssignment,
+        revision: newRevision,
         status: selectedAssignment.status === 'pending' ? 'in_progress' : selectedAssignment.status,
         // nie mamy świeżych field_values, ale po odświeżeniu/fokusie można pobrać ponownie
       } as DocumentAssignment;
-      setAssignments(prev => prev.map(a => a.id === updatedAssignment.id ? updatedAssignment : a));
+      const filled = (updatedAssignment.editable_fields || []).filter(f => fieldValues[f.field_id]).length;
+      setAssignments(prev => prev.map(a => a.id === updatedAssignment.id
+        ? { ...a, revision: newRevision, status: updatedAssignment.status, filled_fields_count: filled }
+        : a));
       setSelectedAssignment(updatedAssignment);
       alert('Zmiany zostały zapisane');
     } catch (e) {
@@ -61,7 +94,7 @@ const UserPanel: React.FC<UserPanelProps> = ({ user, onLogout }) => {
     const currentValuesByFieldId: { [key: string]: string } = {};
     // mapuj istniejące field_values (po polu numericznym) do field_id string
     fields.forEach(f => {
-      const fv = selectedAssignment.field_values.find(v => v.field === f.id);
+      const fv = (selectedAssignment.field_values || []).find(v => v.field === f.id);
       if (fv) currentValuesByFieldId[f.field_id] = fv.value;
     });
 
@@ -73,9 +106,7 @@ const UserPanel: React.FC<UserPanelProps> = ({ user, onLogout }) => {
 
     try {
       // Najpierw zapisz wartości (jeśli są nowe)
-      if (Object.keys(fieldValues).length > 0) {
-        await apiClient.submitFieldValues(selectedAssignment.id, fieldValues);
-      }
+      if ((await saveChanges(selectedAssignment)) === null) return;
       // Oznacz jako ukończone
       await apiClient.completeAssignment(selectedAssignment.id);
 
@@ -85,7 +116,9 @@ const UserPanel: React.FC<UserPanelProps> = ({ user, onLogout }) => {
         completed_at: new Date().toISOString(),
       } as DocumentAssignment;
 
-      setAssignments(prev => prev.map(a => a.id === updatedAssignment.id ? updatedAssignment : a));
+      setAssignments(prev => prev.map(a => a.id === updatedAssignment.id
+        ? { ...a, status: 'completed', completed_at: updatedAssignment.completed_at, filled_fields_count: a.fields_count }
+        : a));
       setSelectedAssignment(null);
       setFieldValues({});
       alert('Dokument został wysłany pomyślnie!');
@@ -95,15 +128,26 @@ const UserPanel: React.FC<UserPanelProps> = ({ user, onLogout }) => {
     }
   };
 
-  const startEditing = (assignment: DocumentAssignment) => {
+  // Lista zawiera tylko liczby pól - pola i wartości pobieramy przy otwarciu formularza
+  const startEditing = async (listItem: DocumentAssignment) => {
+    let assignment: DocumentAssignment;
+    try {
+      assignment = await apiClient.getAssignment(listItem.id) as DocumentAssignment;
+    } catch (e) {
+      console.error('Błąd pobierania przypisania:', e);
+      alert(e instanceof Error ? e.message : 'Nie udało się otworzyć dokumentu');
+      return;
+    }
     setSelectedAssignment(assignment);
     // Zamapuj istniejące wartości do kluczy field_id (string)
     const map: { [key: string]: string } = {};
     (assignment.editable_fields || []).forEach(f => {
-      const fv = assignment.field_values.find(v => v.field === f.id);
+      const fv = (assignment.field_values || []).find(v => v.field === f.id);
       if (fv) map[f.field_id] = fv.value;
     });
     setFieldValues(map);
+    setSavedValues(map);
+    setRevision(assignment.revision || 0);
   };
 
   const getStatusText = (status: string) => {
@@ -167,7 +211,7 @@ const UserPanel: React.FC<UserPanelProps> = ({ user, onLogout }) => {
                     {assignment.completed_at && (
                       <p><strong>Ukończono:</strong> {new Date(assignment.completed_at).toLocaleDateString('pl-PL')}</p>
                     )}
-                    <p><strong>Wypełnione pola:</strong> {assignment.field_values.length} / {(assignment.editable_fields || []).length}</p>
+                    <p><strong>Wypełnione pola:</strong> {assignment.filled_fields_count ?? 0} / {assignment.fields_count ?? 0}</p>
                   </div>
 
                   {assignment.status !== 'completed' && (
@@ -210,7 +254,7 @@ const UserPanel: React.FC<UserPanelProps> = ({ user, onLogout }) => {
 
               <div className="fields-form">
                 {(selectedAssignment.editable_fields || []).map((field: EditableField) => {
-                  const currentValue = selectedAssignment.field_values.find(fv => fv.field === field.id)?.value || '';
+                  const currentValue = (selectedAssignment.field_values || []).find(fv => fv.field === field.id)?.value || '';
                   const value = fieldValues[field.field_id] ?? currentValue;
                   return (
                     <div key={field.id} className="form-field">
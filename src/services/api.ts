@@ -1,3 +1,5 @@
+import { ApiTokens, LoginResponse, Page } from '../types';
+
 const API_BASE_URL = 'http://localhost:3001/api';
 
 // Pomocnicza funkcja do pobrania ciasteczka (np. CSRF)
@@ -8,13 +10,74 @@ function getCookie(name: string): string | null {
   return null;
 }
 
+// Błąd odpowiedzi API z kodem HTTP (np. 409 przy konflikcie rewizji)
+export class ApiError extends Error {
+  status: number;
+  data: any;
+
+  constructor(message: string, status: number, data: any) {
+    super(message);
+    this.status = status;
+    this.data = data;
+  }
+}
+
 class ApiClient {
   private baseURL: string;
+  // Token dostępu tylko w pamięci (nie w localStorage - HTML dokumentów jest wstawiany
+  // przez dangerouslySetInnerHTML); token odświeżania jest w ciasteczku HttpOnly
+  private tokens: ApiTokens | null = null;
+  private refreshing: Promise<boolean> | null = null;
+  private restoring: Promise<boolean> | null = null;
 
   constructor(baseURL: string) {
     this.baseURL = baseURL;
   }
 
+  // Tokeny API są opcjonalne - bez nich żądania korzystają z sesji Django
+  private setTokens(tokens: ApiTokens | null | undefined) {
+    this.tokens = tokens || null;
+  }
+
+  private authHeaders(): Record<string, string> {
+    return this.tokens ? { Authorization: `Bearer ${this.tokens.access}` } : {};
+  }
+
+  // Jedno odświeżenie naraz, nawet gdy kilka żądań dostało 401 równocześnie
+  private refreshTokens(): Promise<boolean> {
+    if (!this.refreshing) {
+      // Token odświeżania wysyła przeglądarka (ciasteczko HttpOnly)
+      this.refreshing = fetch(`${this.baseURL}/auth/token/refresh/`, {
+        method: 'POST',
+        credentials: 'include',
+      })
+        .then(async res => {
+          this.setTokens(res.ok ? await res.json() : null);
+          return res.ok;
+        })
+        .catch(() => false)
+        .finally(() => { this.refreshing = null; });
+    }
+    return this.refreshing;
+  }
+
+  // fetch z tokenem API; po 401 odświeża token i ponawia żądanie raz
+  private async authFetch(url: string, init: RequestInit = {}): Promise<Response> {
+    // Po przeładowaniu strony odzyskaj token dostępu z ciasteczka (raz; bez niego zostaje sesja)
+    if (!this.restoring) this.restoring = this.tokens ? Promise.resolve(true) : this.refreshTokens();
+    await this.restoring;
+    const send = () => {
+      const headers = new Headers(init.headers);
+      Object.entries(this.authHeaders()).forEach(([name, value]) => headers.set(name, value));
+      return fetch(url, { credentials: 'include', ...init, headers });
+    };
+    const response = await send();
+    if (response.status === 401 && this.tokens && await this.refreshTokens()) {
+      return send();
+    }
+    return response;
+  }
+
   private async ensureCsrfCookie(): Promise<void> {
     try {
       await fetch(`${this.baseURL}/auth/csrf/`, { credentials: 'include' });
@@ -27,7 +90,8 @@ class ApiClient {
     endpoint: string,
     options: RequestInit = {}
   ): Promise<T> {
-    const url = `${this.baseURL}${endpoint}`;
+    // Adresy kolejnych stron (next/previous) przychodzą z serwera jako pełne URL
+    const url = /^https?:\/\//.test(endpoint) ? endpoint : `${this.baseURL}${endpoint}`;
     const isUnsafeMethod = (options.method || 'GET').toUpperCase() !== 'GET' && (options.method || 'GET').toUpperCase() !== 'HEAD';
     const isFormData = typeof FormData !== 'undefined' && options.body instanceof FormData;
 
@@ -55,20 +119,36 @@ class ApiClient {
 
     const config: RequestInit = {
       credentials: 'include', // Sesje Django
-      headers,
       ...options,
+      headers,
     };
 
-    const response = await fetch(url, config);
+    const response = await this.authFetch(url, config);
     
     if (!response.ok) {
       const errorData = await response.json().catch(() => ({}));
-      throw new Error(errorData.message || `HTTP error! status: ${response.status}`);
+      throw new ApiError(errorData.message || errorData.error || `HTTP error! status: ${response.status}`, response.status, errorData);
     }
 
     return response.json();
   }
 
+  // Listy są stronicowane kursorem: jedna strona albo wszystkie strony po kolei
+  async getPage<T>(endpoint: string): Promise<Page<T>> {
+    return this.request<Page<T>>(endpoint);
+  }
+
+  async getAllPages<T>(endpoint: string): Promise<T[]> {
+    const items: T[] = [];
+    let next: string | null = endpoint;
+    while (next) {
+      const page: Page<T> = await this.getPage<T>(next);
+      items.push(...page.results);
+      next = page.next;
+    }
+    return items;
+  }
+
   // Autentykacja
   async getCSRF() {
     // Pobranie ciasteczka CSRF (ustawiane przez backend)
@@ -76,16 +156,31 @@ class ApiClient {
   }
 
   async login(username: string, password: string) {
-    return this.request('/auth/login/', {
+    const response = await this.request<LoginResponse>('/auth/login/', {
       method: 'POST',
       body: JSON.stringify({ username, password }),
     });
+    this.setTokens(response.tokens);
+    return response;
+  }
+
+  // Po logowaniu przez Discord (sesja) odbierz tokeny wydane w pipeline; 404 = tokeny wyłączone
+  async exchangeSessionForTokens() {
+    try {
+      this.setTokens(await this.request<ApiTokens>('/auth/token/', { method: 'POST' }));
+    } catch {
+      this.setTokens(null);
+    }
   }
 
   async logout() {
-    return this.request('/auth/logout/', {
-      method: 'POST',
-    });
+    try {
+      return await this.request('/auth/logout/', {
+        method: 'POST',
+      });
+    } finally {
+      this.setTokens(null);
+    }
   }
 
   async getCurrentUser() {
@@ -93,20 +188,23 @@ class ApiClient {
   }
 
   async completeProfile(data: { first_name: string; last_name: string; index: string; section: string }) {
-    return this.request('/auth/complete-profile/', {
+    const response = await this.request<{ success: boolean; tokens?: ApiTokens }>('/auth/complete-profile/', {
       method: 'POST',
       body: JSON.stringify(data),
     });
+    // Nowa sekcja trafia do tokenu dopiero przy ponownym wydaniu
+    if (response.tokens) this.setTokens(response.tokens);
+    return response;
   }
 
   // Użytkownicy
   async getUsers() {
-    return this.request('/users/');
+    return this.getAllPages('/users/?page_size=200');
   }
 
   // Super admin
   async getAllUsers() {
-    return this.request('/users/all/');
+    return this.getAllPages('/users/all/?page_size=200');
   }
 
   async setUserRole(userId: number, role: 'admin' | 'user') {
@@ -126,7 +224,12 @@ class ApiClient {
   }
 
   async getAdminDocuments() {
-    return this.request('/documents/admin/');
+    return this.getAllPages('/documents/admin/');
+  }
+
+  // Szczegóły dokumentu razem z treścią HTML (lista jej nie zawiera)
+  async getDocument(documentId: number) {
+    return this.request(`/documents/${documentId}/detail/`);
   }
 
   async createField(fieldData: any) {
@@ -161,13 +264,32 @@ class ApiClient {
     });
   }
 
+  // Przypisanie do wszystkich użytkowników z sekcji administratora
+  async assignDocumentToSection(documentId: number) {
+    return this.request('/documents/assign/', {
+      method: 'POST',
+      body: JSON.stringify({ document_id: documentId, target: 'section' }),
+    });
+  }
+
+  // Zadania w tle (np. konwersja DOCX -> HTML)
+  async getJob(jobId: number) {
+    return this.request(`/jobs/${jobId}/`);
+  }
+
   // Przypisania
   async getUserAssignments() {
-    return this.request('/assignments/user/');
+    return this.getAllPages('/assignments/user/');
+  }
+
+  // Przypisanie z definicjami pól i zapisanymi wartościami (lista zwraca tylko liczby pól)
+  async getAssignment(assignmentId: number) {
+    return this.request(`/assignments/${assignmentId}/detail/`);
   }
 
-  async getCompletedAssignments() {
-    return this.request('/assignments/completed/');
+  // Ukończone przypisania: pierwsza strona albo strona spod adresu `next`
+  async getCompletedAssignments(next?: string | null) {
+    return this.getPage(next || '/assignments/completed/');
   }
 
   async submitFieldValues(assignmentId: number, fieldValues: { [key: string]: string }) {
@@ -180,6 +302,14 @@ class ApiClient {
     });
   }
 
+  // Autosave: tylko zmienione pola + ostatnia znana rewizja przypisania (409 przy konflikcie)
+  async patchFieldValues(assignmentId: number, revision: number, values: { [key: string]: string }) {
+    return this.request<{ revision: number; saved: number; unknown_field_ids?: string[] }>(`/assignments/${assignmentId}/values/`, {
+      method: 'PATCH',
+      body: JSON.stringify({ revision, values }),
+    });
+  }
+
   async completeAssignment(assignmentId: number) {
     return this.request(`/assignments/${assignmentId}/complete/`, {
       method: 'POST',
@@ -189,7 +319,7 @@ class ApiClient {
   // Pobieranie wygenerowanego DOCX (binarnie)
   async fetchAssignmentDocx(assignmentId: number): Promise<{ blob: Blob; filename: string }>{
     const url = `${this.baseURL}/assignments/${assignmentId}/download-docx/`;
-    const res = await fetch(url, { credentials: 'include' });
+    const res = await this.authFetch(url);
     if (!res.ok) {
       const text = await res.text();
       throw new Error(text || `HTTP error! status: ${res.status}`);
@@ -205,10 +335,39 @@ class ApiClient {
   }
 
   // ZIP wszystkich ukończonych (opcjonalnie ograniczonych do dokumentu)
-  async fetchCompletedZip(documentId?: number): Promise<{ blob: Blob; filename: string }> {
+  async fetchCompletedZip(documentId?: number): Promise<{ blob: Blob; filename: string; errors: number }> {
     const url = new URL(`${this.baseURL}/assignments/completed/download-zip/`);
     if (typeof documentId === 'number') url.searchParams.set('document_id', String(documentId));
-    const res = await fetch(url.toString(), { credentials: 'include' });
+    const res = await this.authFetch(url.toString());
+    if (!res.ok) {
+      const text = await res.text();
+      throw new Error(text || `HTTP error! status: ${res.status}`);
+    }
+    const cd = res.headers.get('Content-Disposition') || '';
+    let filename = `completed_assignments.zip`;
+    const match = cd.match(/filename\*=UTF-8''([^;\n]+)|filename="?([^";\n]+)"?/i);
+    if (match) filename = decodeURIComponent(match[1] || match[2]);
+    // Liczba przypisań, których nie udało się wygenerować (szczegóły w BLEDY.txt w archiwum)
+    const errors = Number(res.headers.get('X-Export-Errors') || 0);
+    const blob = await res.blob();
+    return { blob, filename, errors };
+  }
+
+  // Eksport ZIP jako zadanie w tle (gotowe archiwum jest wykorzystywane ponownie)
+  async createExport(documentId?: number) {
+    return this.request('/assignments/completed/exports/', {
+      method: 'POST',
+      body: JSON.stringify(typeof documentId === 'number' ? { document_id: documentId } : {}),
+    });
+  }
+
+  async getExport(jobId: number) {
+    return this.request(`/assignments/completed/exports/${jobId}/`);
+  }
+
+  async fetchExport(jobId: number): Promise<{ blob: Blob; filename: string }> {
+    const url = `${this.baseURL}/assignments/completed/exports/${jobId}/download/`;
+    const res = await this.authFetch(url);
     if (!res.ok) {
       const text = await res.text();
       throw new Error(text || `HTTP error! status: ${res.status}`);
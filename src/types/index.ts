@@ -40,14 +40,32 @@ export interface Document {
   id: number;
   name: string;
   file: string;
-  original_content: string;
+  original_content?: string;  // tylko w szczegółach dokumentu
   created_by: number;
   created_by_username: string;
   created_at: string;
   updated_at: string;
   status: 'draft' | 'sent' | 'completed';
+  processing_status: 'processing' | 'ready' | 'failed';
   editable_fields: EditableField[];
   assigned_users_count: number;
+  job?: ProcessingJob;
+}
+
+export interface ProcessingJob {
+  id: number;
+  kind: string;
+  status: 'queued' | 'running' | 'done' | 'failed';
+  document: number | null;
+  error: string;
+  progress_total: number;
+  progress_done: number;
+  cached?: boolean;
+  created_at: string;
+  started_at?: string | null;
+  finished_at?: string | null;
+  queue_seconds: number | null;
+  run_seconds: number | null;
 }
 
 export interface FieldValue {
@@ -70,8 +88,19 @@ export interface DocumentAssignment {
   assigned_at: string;
   started_at?: string;
   completed_at?: string;
-  field_values: FieldValue[];
-  editable_fields: EditableField[];
+  revision: number;
+  // Lista przypisań: tylko liczby pól; wartości i definicje pól zwraca getAssignment
+  fields_count?: number;
+  filled_fields_count?: number;
+  field_values?: FieldValue[];
+  editable_fields?: EditableField[];
+}
+
+// Strona listy stronicowanej kursorem (next/previous to pełne adresy kolejnych stron)
+export interface Page<T> {
+  next: string | null;
+  previous: string | null;
+  results: T[];
 }
 
 export interface ApiResponse<T> {
@@ -80,8 +109,16 @@ export interface ApiResponse<T> {
   user?: T;
 }
 
+// Tokeny API (gdy backend ma API_TOKENS_ENABLED): krótkotrwały access; refresh nie trafia
+// do JavaScriptu - backend ustawia go w ciasteczku HttpOnly
+export interface ApiTokens {
+  access: string;
+  expires_in: number;
+}
+
 export interface LoginResponse {
   success: boolean;
   user: User;
   message: string;
+  tokens?: ApiTokens;
 }